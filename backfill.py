@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import random
+import logging
+import datetime
+from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+from endpoint_guard import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# 回填进度检查点文件路径常量
+BACKFILL_CHECKPOINT_FILE = 'backfill_checkpoint.json'
+
+DEFAULT_BACKFILL_CONCURRENCY = 3  # 同时进行的 LLM 分析数
+BACKFILL_MAX_RETRIES = 5  # LLM 限流或临时故障时的最大重试次数
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError, CircuitOpenError)
+
+class BackfillCheckpoint:
+    """
+    回填进度检查点，按服务器记录已完成的 Ticket 频道和每个监控频道已回填到的时间窗口。
+    每完成一个单元即原子写入文件，进程被终止后重新执行 /backfill 可从断点继续。
+    """
+    def __init__(self, path=BACKFILL_CHECKPOINT_FILE):
+        self.path = path
+        self.data = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.error(f"读取回填检查点失败，将重新开始: {e}")
+
+    def start(self, guild_id, since, until, reset=False):
+        """
+        开始服务器的回填任务；存在未完成的任务时从断点恢复（沿用原起始时间，结束时间延长到本次启动时间）。
+
+        Args:
+            guild_id (str): Discord 服务器 ID
+            since (datetime): 回填起始时间
+            until (datetime): 回填结束时间（通常为 Bot 启动时间）
+            reset (bool): 是否丢弃已有进度
+
+        Returns:
+            dict: 服务器的回填进度，resumed 表示是否从断点恢复
+        """
+        progress = self.data.get(guild_id)
+        if progress and not progress.get('done') and not reset:
+            progress['until'] = max(progress['until'], until.isoformat())
+            progress['resumed'] = True
+        else:
+            progress = self.data[guild_id] = {
+                'since': since.isoformat(),
+                'until': until.isoformat(),
+                'tickets_done': [],
+                'windows_done': {},  # 监控频道 ID -> 已完成的最后一个窗口结束时间
+                'stats': {'tickets': 0, 'problems': 0, 'windows': 0, 'summaries': 0, 'errors': 0},
+                'done': False,
+                'resumed': False,
+            }
+        self.save()
+        return progress
+
+    def save(self):
+        """原子写入检查点文件"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+async def call_llm_with_retry(fn, *args, run=asyncio.to_thread):
+    """
+    在线程中执行同步 LLM 调用，遇到限流或临时故障时按指数退避（带抖动）重试。
+
+    Args:
+        fn (callable): 同步调用函数
+        *args: 调用参数
+        run (callable): 执行同步调用的异步函数 run(fn, *args)，默认 asyncio.to_thread（可换成 LLM 调度器）
+
+    Returns:
+        调用结果
+    """
+    for attempt in range(BACKFILL_MAX_RETRIES + 1):
+        try:
+            return await run(fn, *args)
+        except RETRYABLE_ERRORS as e:
+            if attempt == BACKFILL_MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt * 5, 120) * (0.5 + random.random())
+            logger.warning(f"LLM 调用受限或失败（{type(e).__name__}），{delay:.0f} 秒后重试")
+            await asyncio.sleep(delay)
+
+class BackfillRunner:
+    """
+    单个服务器的历史回填任务。
+    - 历史 Ticket 频道与监控频道的历史时间窗口作为独立单元，由信号量限制并发。
+    - Discord 历史消息拉取由 discord.py 自动遵守速率限制；LLM 调用通过 call_llm_with_retry 退避重试。
+    - 具体的分析与发布流程由 Bot 提供的回调完成，与实时流程共用同一套问题/总结管道。
+    """
+    def __init__(self, guild_id, checkpoint, progress, analyze_ticket, analyze_window, concurrency=DEFAULT_BACKFILL_CONCURRENCY):
+        """
+        Args:
+            guild_id (str): Discord 服务器 ID
+            checkpoint (BackfillCheckpoint): 检查点
+            progress (dict): checkpoint.start() 返回的进度
+            analyze_ticket (callable): async (channel) -> bool，返回是否产生了有效问题
+            analyze_window (callable): async (channel, start, end) -> bool，返回是否产生了总结
+            concurrency (int): 最大并发分析数
+        """
+        self.guild_id = guild_id
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.analyze_ticket = analyze_ticket
+        self.analyze_window = analyze_window
+        self.semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self.errors = 0  # 本次执行失败的单元数，有失败时不标记完成，再次执行可从断点重试
+
+    async def run_ticket(self, channel):
+        """回填单个历史 Ticket 频道"""
+        async with self.semaphore:
+            try:
+                produced = await self.analyze_ticket(channel)
+            except Exception as e:
+                logger.error(f"回填 Ticket 频道 {channel.name} 失败: {e}")
+                self.progress['stats']['errors'] += 1
+                self.errors += 1
+                return
+            self.progress['tickets_done'].append(channel.id)
+            self.progress['stats']['tickets'] += 1
+            self.progress['stats']['problems'] += int(bool(produced))
+            self.checkpoint.save()
+
+    async def run_channel_windows(self, channel, period_hours):
+        """按监控周期顺序回填单个监控频道的历史窗口，窗口按时间顺序处理以保证断点位置单调"""
+        until = datetime.datetime.fromisoformat(self.progress['until'])
+        cursor = self.progress['windows_done'].get(str(channel.id))
+        start = datetime.datetime.fromisoformat(cursor or self.progress['since'])
+        step = datetime.timedelta(hours=period_hours)
+        while start + step <= until:
+            end = start + step
+            async with self.semaphore:
+                try:
+                    produced = await self.analyze_window(channel, start, end)
+                except Exception as e:
+                    logger.error(f"回填监控频道 {channel.name} 窗口 {start} ~ {end} 失败，停止该频道: {e}")
+                    self.progress['stats']['errors'] += 1
+                    self.errors += 1
+                    return
+            self.progress['windows_done'][str(channel.id)] = end.isoformat()
+            self.progress['stats']['windows'] += 1
+            self.progress['stats']['summaries'] += int(bool(produced))
+            self.checkpoint.save()
+            start = end
+
+    async def run(self, ticket_channels, monitor_channels, period_hours):
+        """
+        执行回填，跳过检查点中已完成的单元。全部单元成功后才标记完成，
+        有单元失败（如预算用尽）时保留进度，再次执行 /backfill 只重试未完成的单元。
+
+        Args:
+            ticket_channels (list): 历史 Ticket 频道
+            monitor_channels (list): 监控频道
+            period_hours (int): 监控周期（小时），即回填窗口长度
+        """
+        done = set(self.progress['tickets_done'])
+        tasks = [self.run_ticket(channel) for channel in ticket_channels if channel.id not in done]
+        tasks += [self.run_channel_windows(channel, period_hours) for channel in monitor_channels]
+        logger.info(f"服务器 {self.guild_id} 开始回填：{len(tasks) - len(monitor_channels)} 个 Ticket 频道，{len(monitor_channels)} 个监控频道")
+        await asyncio.gather(*tasks)
+        self.progress['done'] = self.errors == 0
+        self.checkpoint.save()
+        if self.progress['done']:
+            logger.info(f"服务器 {self.guild_id} 回填完成: {self.progress['stats']}")
+        else:
+            logger.warning(f"服务器 {self.guild_id} 回填结束，{self.errors} 个单元失败，再次执行 /backfill 从断点继续: {self.progress['stats']}")
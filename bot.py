@@ -4,66 +4,136 @@ from discord.ext import commands
 import asyncio
 import os
 import logging
-from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 import datetime
 import pytz
-from config_manager import ConfigManager
+import hashlib
+import json
+import time
+import functools
+import contextlib
+from collections import Counter, OrderedDict
+from config_manager import ConfigManager, SharedConfigStore, CONFIG_SYNC_SECONDS
 from utils import get_conversation, is_ticket_channel
-from llm_analyzer import analyze_ticket_conversation, analyze_general_conversation
-from telegram_bot import TelegramBot
-
-# 配置主日志记录器，使用轮转日志保存到文件并输出到控制台
-handler = RotatingFileHandler(
-    'bot.log',           # 日志文件路径
-    maxBytes=5*1024*1024, # 单个日志文件最大 5MB
-    backupCount=5         # 保留 5 个备份文件
-)
-logging.basicConfig(
-    level=logging.INFO,   # 设置日志级别为 INFO
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[handler, logging.StreamHandler()]
-)
-logger = logging.getLogger(__name__)
+from llm_analyzer import analyze_ticket_conversation, analyze_general_conversation, triage_ticket_conversation, finalize_problem, STRUCTURED_OUTPUT_MODES
+from telegram_bot import TelegramBot, NoGetUpdatesFilter
+from logging_setup import setup_logging, parse_rate_limit
+from prefilter import prefilter_ticket, get_prefilter_config, PREFILTER_MODES
+from ticket_state import TicketStateStore
+from routing import RoutingIndex
+from problem_store import ProblemStore
+from backfill import BackfillCheckpoint, BackfillRunner, call_llm_with_retry, DEFAULT_BACKFILL_CONCURRENCY, BACKFILL_CHECKPOINT_FILE
+from similarity import SimilarityIndex, SIMILARITY_CAPACITY, SIMILARITY_MAX_GUILDS, DEDUP_MODES, get_dedup_config, problem_text
+from models import Problem
+from timeseries import TimeSeriesStore, ROLLUP_FREQS, SENTIMENT_LABELS, volume_anomalies, rollup
+from cadence import ActivityTracker, CADENCE_MODES, get_cadence_config
+from sampler import sample_channel_history, SAMPLING_MODES, DEFAULT_SAMPLING_MODE
+from replay import EventRecorder
+from sharding import ShardPlan
+from gateway_profile import client_kwargs, rss_mb, describe_memory, PROFILE_STANDARD, MEMORY_REPORT_MINUTES
+from endpoint_guard import CircuitOpenError, guard_key
+from llm_scheduler import LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_TICKET, PRIORITY_SUMMARY, DEFAULT_LLM_CONCURRENCY, DEFAULT_HEDGE_PERCENTILE, scale_reservations
+from job_queue import JobQueue, AnalysisDispatcher, WorkerPool, channel_ref, JOB_TICKET_FULL, JOB_TICKET_DELTA, JOB_TICKET_TRIAGE, JOB_MONITOR_SUMMARY, STATUS_DONE
+from token_usage import TOKEN_METER, BUDGET_NORMAL, BUDGET_EXHAUSTED, set_usage_scope, budget_status, get_budget_config, usage_day, monitor_sample_size, fallback_budget_left, call_as_fallback
+
+# 加载环境变量
+load_dotenv()
+
+# 分片部署：SHARD_COUNT 为分片总数（auto 表示按 Discord 推荐值在本进程运行全部分片），SHARD_IDS 为本进程负责的分片；
+# 多进程部署通常由 sharding.py 启动，各进程的日志和回填检查点写入按分片区分的文件
+shard_plan = ShardPlan.from_env(os.getenv('SHARD_COUNT'), os.getenv('SHARD_IDS'))
 
-# 配置心跳日志记录器，单独记录 Bot 运行状态
-heartbeat_logger = logging.getLogger('heartbeat')
-heartbeat_handler = RotatingFileHandler(
-    'heartbeat.log',     # 心跳日志文件路径
-    maxBytes=5*1024*1024,
-    backupCount=5
+# 配置日志：主日志（bot.log + 控制台）与心跳日志（heartbeat.log）均经内存队列由后台线程写入，
+# 事件循环线程不直接做磁盘 IO；可选 JSON 格式与按调用位置限速（默认关闭，WARNING 及以上从不限速）
+setup_logging(
+    log_file=shard_plan.scoped_path('bot.log'),
+    heartbeat_file=shard_plan.scoped_path('heartbeat.log'),
+    json_format=os.getenv('LOG_FORMAT', 'text').lower() == 'json',
+    rate_limit=parse_rate_limit(os.getenv('LOG_RATE_LIMIT', 'off')),
+    filters=[NoGetUpdatesFilter()]  # 屏蔽 Telegram getUpdates 轮询日志，只在监听线程中挂载一次
 )
-heartbeat_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-heartbeat_logger.addHandler(heartbeat_handler)
-heartbeat_logger.setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+heartbeat_logger = logging.getLogger('heartbeat')  # 心跳日志记录器，单独记录 Bot 运行状态
 
 # 设置 httpx 日志级别为 WARNING，避免频繁请求污染日志
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# 加载环境变量
-load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 MY_ACTIVE_KEY = os.getenv('MY_ACTIVE_KEY')  # 从 .env 读取激活密钥
 DEFAULT_LLM_API_KEY = os.getenv('LLM_API_KEY')
 DEFAULT_MODEL_ID = os.getenv('MODEL_ID')
 DEFAULT_BASE_URL = os.getenv('BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3')
+DEFAULT_TRIAGE_MODEL_ID = os.getenv('TRIAGE_MODEL_ID')  # 可选，Ticket 初筛使用的廉价模型
+DEFAULT_DAILY_TOKEN_BUDGET = int(os.getenv('DAILY_TOKEN_BUDGET', '0'))  # 可选，使用默认 LLM 密钥的服务器每日 token 上限，0 表示不限
+# 可选，Telegram Webhook 模式：设置公网 HTTPS 地址后由 Telegram 主动推送更新，代替长轮询
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_LISTEN = os.getenv('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0')
+TELEGRAM_WEBHOOK_PORT = int(os.getenv('TELEGRAM_WEBHOOK_PORT', '8443'))
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')  # 可选，自建 Bot API 服务器或本地模拟服务器，如 http://127.0.0.1:8081/bot
+# 可选，设置后将脱敏的消息事件（时间、ID 哈希、长度、特征位，不含内容）录制到该文件，供 replay.py 回放压测
+RECORD_EVENTS_FILE = os.getenv('RECORD_EVENTS_FILE')
+RECORD_EVENTS_SALT = os.getenv('RECORD_EVENTS_SALT')  # 可选，ID 哈希盐；固定后多次录制的 ID 可以对应
+CONFIG_STORE = os.getenv('CONFIG_STORE', 'json').lower()  # 配置存储：json（config.json）或 sqlite（多进程共享的 config.db）
+TELEGRAM_UPDATES = os.getenv('TELEGRAM_UPDATES', 'auto').lower()  # 是否接收 Telegram 更新：auto（持有 0 号分片的进程）、on、off
+# 可选，分析进程数；大于 0 时 Ticket 和监控频道分析经本地任务队列（jobs.db）交给独立进程执行，0 表示在本进程的工作线程中执行
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '0'))
+# 可选，设置为 on 时即使 ANALYSIS_WORKERS 为 0 也提交到任务队列，由单独运行的 job_queue.py 分析进程执行
+ANALYSIS_QUEUE = os.getenv('ANALYSIS_QUEUE', 'on' if ANALYSIS_WORKERS > 0 else 'off').lower() == 'on'
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', str(DEFAULT_LLM_CONCURRENCY)))  # 本进程同时进行的 LLM 调用数，按优先级分配
+# 可选，备用模型：主调用较慢时发出对冲请求、失败时改用；默认使用 LLM_API_KEY/BASE_URL/MODEL_ID（与服务器自定义配置相同时不启用）。
+# 备用模型使用运营方密钥，默认关闭；自带密钥的服务器还需通过 /set_llm_fallback 开启，用量受 DAILY_TOKEN_BUDGET 约束
+LLM_FALLBACK = os.getenv('LLM_FALLBACK', 'off').lower() == 'on'
+FALLBACK_LLM_API_KEY = os.getenv('FALLBACK_LLM_API_KEY')
+FALLBACK_MODEL_ID = os.getenv('FALLBACK_MODEL_ID')
+FALLBACK_BASE_URL = os.getenv('FALLBACK_BASE_URL')
+# 主调用耗时超过同类调用该分位数时发出对冲请求，0 表示只在失败时改用备用模型
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', str(DEFAULT_HEDGE_PERCENTILE)))
+# 网关与缓存配置：standard（默认）或 lean（只订阅服务器、频道和消息事件，不缓存消息、表情和其他成员，服务器较多时节省内存）
+GATEWAY_PROFILE = os.getenv('GATEWAY_PROFILE', PROFILE_STANDARD).lower()
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE')) if os.getenv('MESSAGE_CACHE_SIZE') else None  # 可选，消息缓存条数，默认按网关配置取值
+# 可选，逗号分隔的服务器 ID；设置后斜杠命令只同步到这些服务器（立即生效，便于开发调试），不做全局同步
+SYNC_GUILD_IDS = [int(guild_id) for guild_id in os.getenv('SYNC_GUILD_IDS', '').split(',') if guild_id.strip()]
 
 # 检查 MY_ACTIVE_KEY 是否配置
 if not MY_ACTIVE_KEY:
     logger.error("MY_ACTIVE_KEY 未在 .env 文件中定义，请配置后重启 Bot")
     raise ValueError("MY_ACTIVE_KEY 未定义，请在 .env 文件中设置激活密钥")
+if LLM_CONCURRENCY < 1:
+    logger.error(f"LLM_CONCURRENCY 必须至少为 1，当前为 {LLM_CONCURRENCY}")
+    raise ValueError("LLM_CONCURRENCY 必须至少为 1")
+if shard_plan.partial and CONFIG_STORE != 'sqlite':
+    logger.error("多进程分片部署需要共享配置库，请设置 CONFIG_STORE=sqlite")
+    raise ValueError("设置 SHARD_IDS 时必须使用 CONFIG_STORE=sqlite")
 
 # 初始化配置和 Bot
-config_manager = ConfigManager()
-intents = discord.Intents.default()
-intents.message_content = True
-intents.guilds = True
-intents.guild_messages = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+config_manager = ConfigManager(SharedConfigStore() if CONFIG_STORE == 'sqlite' else None)
+routing_index = RoutingIndex(config_manager)  # 按服务器编译的路由快照，配置变化时自动重建
+problem_store = ProblemStore()  # 本地问题库，记录所有推送的有效问题，供统计分析
+timeseries_store = TimeSeriesStore()  # General Chat 每个监控周期的消息量与情绪时间序列
+activity_tracker = ActivityTracker()  # 监控频道自上次分析以来的消息计数，驱动自适应监控节奏
+llm_scheduler = LLMScheduler(LLM_CONCURRENCY, scale_reservations(LLM_CONCURRENCY), hedge_percentile=HEDGE_PERCENTILE)  # 本进程的 LLM 调用按优先级排队：/warp_msg 优先，其次 Ticket 自动分析，最后定时总结和回填
+event_recorder = EventRecorder(RECORD_EVENTS_FILE, RECORD_EVENTS_SALT) if RECORD_EVENTS_FILE else None  # 网关事件录制
+client_options = client_kwargs(GATEWAY_PROFILE, MESSAGE_CACHE_SIZE)  # 网关 intents 与消息、成员缓存
+if shard_plan.auto:
+    bot = commands.AutoShardedBot(command_prefix='/', **client_options, **shard_plan.bot_kwargs())
+else:
+    bot = commands.Bot(command_prefix='/', **client_options)
 # 全局变量
 bot_start_time = datetime.datetime.now(datetime.timezone.utc)  # Bot 启动时间，用于过滤旧消息
 ticket_creation_times = {}  # 存储 Ticket 频道的创建时间，键为频道 ID，值为创建时间
+ticket_last_activity = {}  # 存储 Ticket 频道最近一条消息的时间，键为频道 ID，用于空闲触发分析
+DEFAULT_TICKET_IDLE_MINUTES = 15  # Ticket 空闲多久后触发分析
+DEFAULT_TICKET_MAX_WAIT_MINUTES = 60  # 首条消息后最长等待多久必定触发分析
+ticket_states = TicketStateStore()  # 未关闭 Ticket 的分析状态（最后分析的消息 ID 与问题草稿）
+DEFAULT_TICKET_INCREMENTAL = False  # 后台增量分析会为每条新消息额外调用 LLM，需通过 /set_ticket_incremental 开启
+TICKET_DRAFT_DEBOUNCE_SECONDS = 60  # 新消息后等待多久在后台更新问题草稿，合并连续消息
+TICKET_RETRY_DELAYS = (60, 300, 900)  # 自动分析因 LLM 接口故障失败后的重试间隔（秒），接口断路时至少等到断路结束
+backfill_checkpoint = BackfillCheckpoint(shard_plan.scoped_path(BACKFILL_CHECKPOINT_FILE))  # 历史回填进度，支持中断后继续
+backfill_tasks = {}  # 正在进行的回填任务，键为服务器 ID
+similarity_indexes = OrderedDict()  # 各服务器近期问题的相似度索引，键为服务器 ID，按最近使用排序，首次使用时从问题库重建
+commands_synced = False  # 本进程是否已检查过斜杠命令同步，断线重连触发的 on_ready 不再重复检查
 
 # 检查 Bot 是否激活的装饰器，用于限制命令使用
 def check_activation():
@@ -86,15 +156,60 @@ def check_activation():
 @bot.event
 async def on_ready():
     """
-    Bot 就绪事件，当 Bot 成功登录 Discord 时触发。
-    - 记录登录信息并同步斜杠命令。
+    Bot 就绪事件，当 Bot 成功登录 Discord 时触发（断线重连后也会再次触发）。
+    - 记录登录信息，首次就绪时按需同步斜杠命令（多进程部署时只由主进程同步）。
     """
+    global commands_synced
     logger.info(f'Discord Bot 成功登录为 {bot.user}')
-    try:
-        synced = await bot.tree.sync()  # 将斜杠命令同步到 Discord
-        logger.info(f"斜杠命令已成功同步到 Discord，同步了 {len(synced)} 个命令")
-    except Exception as e:
-        logger.error(f"斜杠命令同步失败: {e}")  # 记录同步失败的异常
+    if not commands_synced and shard_plan.is_primary:
+        commands_synced = True
+        await sync_command_tree()
+
+def command_tree_fingerprint(guild=None):
+    """
+    计算已注册斜杠命令树的指纹（命令名称、描述、参数、选项等的序列化哈希）。
+    
+    Args:
+        guild (discord.abc.Snowflake): 可选，计算指定服务器的命令树
+    
+    Returns:
+        str: SHA-256 十六进制指纹
+    """
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands(guild=guild)), key=lambda c: c['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+async def sync_command_tree():
+    """
+    仅在命令树与上次成功同步时不同才调用 Discord 同步接口（该接口耗时且限流严格）。
+    - 指纹按应用 ID 和同步范围保存在配置中，Bot 重启后依然有效。
+    - 配置了 SYNC_GUILD_IDS 时改为逐个服务器同步，命令变更立即生效。
+    - 切换同步方式或移出 SYNC_GUILD_IDS 的服务器会同步为空命令列表，避免旧范围的命令残留（与新范围重复显示）。
+    """
+    prefix = f"{bot.application_id}:"
+    scopes = {}
+    if SYNC_GUILD_IDS:
+        for guild_id in SYNC_GUILD_IDS:
+            guild = discord.Object(id=guild_id)
+            bot.tree.copy_global_to(guild=guild)
+            scopes[f"{prefix}{guild_id}"] = guild
+        bot.tree.clear_commands(guild=None)  # 全局命令已复制到各服务器，全局范围同步为空
+        scopes[f"{prefix}global"] = None
+    else:
+        scopes[f"{prefix}global"] = None
+    for scope in config_manager.get_command_scopes():
+        if scope.startswith(prefix) and scope not in scopes and scope[len(prefix):].isdigit():
+            scopes[scope] = discord.Object(id=int(scope[len(prefix):]))  # 不再同步的服务器，树中没有其命令，同步后即清空
+    for scope, guild in scopes.items():
+        fingerprint = command_tree_fingerprint(guild)
+        if config_manager.get_command_fingerprint(scope) == fingerprint:
+            logger.info(f"斜杠命令未变化，跳过同步（{scope}）")
+            continue
+        try:
+            synced = await bot.tree.sync(guild=guild)  # 将斜杠命令同步到 Discord
+            await config_manager.set_command_fingerprint(scope, fingerprint)
+            logger.info(f"斜杠命令已成功同步到 Discord（{scope}），同步了 {len(synced)} 个命令")
+        except Exception as e:
+            logger.error(f"斜杠命令同步失败（{scope}）: {e}")  # 记录同步失败的异常，下次启动时重试
 
 @bot.event
 async def on_message(message):
@@ -103,24 +218,152 @@ async def on_message(message):
     - 忽略 Bot 自己的消息和启动前的消息。
     - 检查是否为 Ticket 频道并触发分析。
     """
-    if message.author == bot.user or message.created_at < bot_start_time:
-        return  # 跳过 Bot 自己的消息或旧消息
-    guild_id = str(message.guild.id)  # 获取服务器 ID
-    config = config_manager.get_guild_config(guild_id)  # 获取服务器配置
-    if is_ticket_channel(message.channel, config):  # 检查是否为 Ticket 频道
+    if message.guild is None or message.author == bot.user or message.created_at < bot_start_time:
+        return  # 跳过私信、Bot 自己的消息或旧消息
+    route = routing_index.get(message.guild.id)  # 获取服务器路由快照（O(1)，无日志）
+    if event_recorder:
+        event_recorder.record_message(message, route)  # 录制脱敏事件（批量异步写入）
+    if route.is_ticket_channel(message.channel):  # 检查是否为 Ticket 频道
+        guild_id = str(message.guild.id)  # 获取服务器 ID
+        ticket_last_activity[message.channel.id] = message.created_at  # 刷新活跃时间，推迟空闲触发
         if message.channel.id not in ticket_creation_times:
             ticket_creation_times[message.channel.id] = message.created_at  # 记录新 Ticket 频道创建时间
             logger.info(f"检测到新 Ticket 频道: {message.channel.name}")
             asyncio.create_task(auto_analyze_ticket(message.channel, guild_id))  # 异步启动自动分析
-        logger.info(f"处理消息，频道: {message.channel.name}，发送者: {message.author.name}")
         asyncio.create_task(process_message(message, guild_id))  # 异步处理消息
+    elif message.channel.id in route.monitor_channel_ids:
+        activity_tracker.record(message.channel.id, message.content)  # 计数并检测突增，达到阈值时提前触发分析
     await bot.process_commands(message)  # 处理其他命令
 
+@bot.event
+async def on_guild_channel_delete(channel):
+    """
+    频道删除事件，Ticket 关闭后清理其分析状态，避免内存持续增长。
+    """
+    if event_recorder:
+        event_recorder.record_channel_delete(channel)
+    ticket_states.drop(channel.id)
+    ticket_creation_times.pop(channel.id, None)
+    ticket_last_activity.pop(channel.id, None)
+
+def get_guild_llm_config(guild_id):
+    """
+    获取服务器使用的 LLM 配置（优先使用服务器自定义配置），并将当前任务之后的 LLM 调用用量计入该服务器。
+    
+    Args:
+        guild_id (str): Discord 服务器 ID
+    
+    Returns:
+        dict: 包含 api_key、model_id、base_url 的 LLM 配置
+    """
+    set_usage_scope(guild_id)
+    return config_manager.get_llm_config(guild_id) or {
+        'api_key': DEFAULT_LLM_API_KEY,
+        'model_id': DEFAULT_MODEL_ID,
+        'base_url': DEFAULT_BASE_URL
+    }
+
+def get_fallback_llm_config(guild_id, llm_config):
+    """
+    获取 LLM 配置对应的备用配置：服务器接口较慢或失败时改用默认（或 FALLBACK_* 指定的）模型。
+    - 备用模型使用运营方密钥：需设置 LLM_FALLBACK=on；自带密钥的服务器还需通过 /set_llm_fallback 开启。
+    - 备用模型的用量单独统计，自带密钥的服务器同样受 DAILY_TOKEN_BUDGET 约束，当日用尽后不再使用备用模型。
+    
+    Args:
+        guild_id (str): Discord 服务器 ID
+        llm_config (dict): 主调用使用的 LLM 配置
+    
+    Returns:
+        dict: 备用 LLM 配置；未启用、与主配置相同、主配置已因预算降级或备用模型预算用尽时返回 None
+    """
+    if not LLM_FALLBACK or llm_config.get('degraded'):
+        return None
+    if config_manager.get_llm_config(guild_id) is not None and not config_manager.get_guild_config(guild_id).get('llm_fallback', False):
+        return None
+    if not fallback_budget_left(config_manager, guild_id, DEFAULT_DAILY_TOKEN_BUDGET):
+        return None
+    fallback = {
+        'api_key': FALLBACK_LLM_API_KEY or DEFAULT_LLM_API_KEY,
+        'model_id': FALLBACK_MODEL_ID or DEFAULT_MODEL_ID,
+        'base_url': FALLBACK_BASE_URL or DEFAULT_BASE_URL,
+    }
+    if not fallback['api_key'] or not fallback['model_id']:
+        return None
+    if (fallback['base_url'], fallback['model_id']) == (llm_config['base_url'], llm_config['model_id']):
+        return None
+    return fallback
+
+def get_triage_model_id(guild_id):
+    """
+    获取服务器的 Ticket 初筛模型。
+    - 服务器通过 /set_triage_model 设置过（含 off）时使用其设置。
+    - 否则仅在服务器使用默认 LLM 接口时回退到 TRIAGE_MODEL_ID；自定义接口上不一定有该模型，不启用初筛。
+    
+    Args:
+        guild_id (str): Discord 服务器 ID
+    
+    Returns:
+        str: 初筛模型 ID，None 表示不初筛
+    """
+    config = config_manager.get_guild_config(guild_id)
+    if 'triage_model_id' in config:
+        return config['triage_model_id']
+    return DEFAULT_TRIAGE_MODEL_ID if config_manager.get_llm_config(guild_id) is None else None
+
+async def apply_token_budget(guild_id, llm_config, manual=False):
+    """
+    按服务器今日的 token 预算调整 Ticket 分析使用的 LLM 配置，避免单个服务器耗尽默认密钥的额度。
+    - 接近预算时改用廉价的初筛模型（未配置时仍用原模型）。
+    - 预算用尽时跳过自动分析；手动 /warp_msg 仍然执行，但使用廉价模型。
+    
+    Args:
+        guild_id (str): Discord 服务器 ID
+        llm_config (dict): get_guild_llm_config() 返回的配置
+        manual (bool): 是否为手动触发的分析
+    
+    Returns:
+        dict: 调整后的 LLM 配置；预算用尽且为自动分析时返回 None
+    """
+    level, used, budget = budget_status(config_manager, guild_id, DEFAULT_DAILY_TOKEN_BUDGET)
+    if level == BUDGET_NORMAL:
+        return llm_config
+    if level == BUDGET_EXHAUSTED and not manual:
+        logger.warning(f"服务器 {guild_id} 今日 token 用量 {used}/{budget} 已达预算，跳过自动 Ticket 分析")
+        config_manager.increment_stat(guild_id, 'budget_skipped')
+        return None
+    cheap_model_id = get_triage_model_id(guild_id)  # 自定义接口未设置初筛模型时不降级
+    if cheap_model_id and cheap_model_id != llm_config['model_id']:
+        logger.info(f"服务器 {guild_id} 今日 token 用量 {used}/{budget} 接近预算，Ticket 分析改用廉价模型 {cheap_model_id}")
+        config_manager.increment_stat(guild_id, 'budget_degraded')
+        return {**llm_config, 'model_id': cheap_model_id, 'degraded': True}  # 降级后不再对冲到备用模型
+    return llm_config
+
+async def token_usage_flush_task():
+    """每分钟将 LLM 回调累计的 token 用量和内存中的分析统计合并到配置文件"""
+    while True:
+        await asyncio.sleep(60)
+        usage = TOKEN_METER.drain()
+        if usage:
+            await config_manager.add_token_usage(usage)
+        await config_manager.flush_stats()
+
+async def config_sync_task():
+    """共享配置库模式下定期加载其他进程写入的配置（激活状态、其他分片服务器的配置等）"""
+    while True:
+        await asyncio.sleep(CONFIG_SYNC_SECONDS)
+        try:
+            changed = await config_manager.sync()
+            if changed:
+                logger.info(f"已加载其他进程写入的 {changed} 项配置")
+        except Exception as e:
+            logger.error(f"加载共享配置库失败: {e}")
+
 async def auto_analyze_ticket(channel, guild_id):
     """
-    自动分析 Ticket 频道，等待1小时后执行。
+    自动分析 Ticket 频道，频道空闲一段时间后执行（防抖），最长等待时间封顶。
     - 如果 Bot 未激活，则跳过分析。
     - 使用服务器绑定的 LLM 配置或默认配置进行分析。
+    - 分析失败（如 LLM 接口故障或断路）时按 TICKET_RETRY_DELAYS 重试，重试耗尽后放弃并计入统计。
     
     Args:
         channel (discord.Channel): Ticket 频道对象
@@ -129,43 +372,504 @@ async def auto_analyze_ticket(channel, guild_id):
     if not config_manager.is_bot_activated():
         logger.info(f"Bot 未激活，跳过自动分析 Ticket 频道: {channel.name}")
         return
-    logger.info(f"开始自动分析 Ticket 频道: {channel.name}，等待 1 小时")
-    await asyncio.sleep(3600)  # 等待1小时（3600秒）
-    conversation = await get_conversation(channel)  # 获取频道对话内容
-    creation_time = ticket_creation_times.get(channel.id)  # 获取频道创建时间
-    if creation_time:
-        # 获取 LLM 配置，优先使用服务器自定义配置
-        llm_config = config_manager.get_llm_config(guild_id) or {
-            'api_key': DEFAULT_LLM_API_KEY,
-            'model_id': DEFAULT_MODEL_ID,
-            'base_url': DEFAULT_BASE_URL
-        }
-        # 在单独线程中运行 LLM 分析，避免阻塞主线程
-        problem = await asyncio.to_thread(
-            analyze_ticket_conversation, conversation, channel, guild_id,
-            config_manager.get_guild_config(guild_id), llm_config['api_key'],
-            llm_config['base_url'], llm_config['model_id'], creation_time
+    guild_config = config_manager.get_guild_config(guild_id)
+    idle_minutes = guild_config.get('ticket_idle_minutes', DEFAULT_TICKET_IDLE_MINUTES)
+    max_wait_minutes = guild_config.get('ticket_max_wait_minutes', DEFAULT_TICKET_MAX_WAIT_MINUTES)
+    logger.info(f"开始自动分析 Ticket 频道: {channel.name}，空闲 {idle_minutes} 分钟或最长 {max_wait_minutes} 分钟后执行")
+    await wait_for_ticket_idle(channel.id, idle_minutes * 60, max_wait_minutes * 60)
+    for attempt, delay in enumerate((*TICKET_RETRY_DELAYS, None)):
+        creation_time = ticket_creation_times.get(channel.id)  # 获取频道创建时间
+        if not creation_time:
+            if attempt == 0:
+                logger.error(f"无法获取频道 {channel.name} 的创建时间")
+            return  # 重试前 Ticket 已关闭
+        try:
+            await run_ticket_analysis(channel, guild_id, creation_time)
+            return
+        except Exception as e:
+            # LLM 接口故障或断路时稍后重试，单个 Ticket 或接口的故障不影响其他分析
+            if delay is None:
+                logger.error(f"自动分析 Ticket 频道 {channel.name} 失败，已放弃: {e}")
+                config_manager.increment_stat(guild_id, 'analysis_failed')
+                return
+            if isinstance(e, CircuitOpenError):
+                delay = max(delay, e.retry_at - time.monotonic())
+            logger.warning(f"自动分析 Ticket 频道 {channel.name} 失败，{delay:.0f} 秒后重试: {e}")
+            await asyncio.sleep(delay)
+
+async def run_ticket_analysis(channel, guild_id, creation_time):
+    """
+    执行一次 Ticket 自动分析：预过滤、去重、初筛后进行完整分析或增量更新，有效问题发布到 Telegram。
+    
+    Args:
+        channel (discord.Channel): Ticket 频道对象
+        guild_id (str): Discord 服务器 ID
+        creation_time (datetime): 频道创建时间
+    """
+    # 获取 LLM 配置，优先使用服务器自定义配置；按今日 token 预算降级或跳过
+    llm_config = await apply_token_budget(guild_id, get_guild_llm_config(guild_id))
+    if llm_config is None:
+        return
+    conversation = None
+    shadow = None  # 预过滤影子模式下的判断结果
+    state = ticket_states.get(channel.id)
+    # 在频道锁内判断草稿并完成分析，避免与同时进行的 /warp_msg 或后台更新重复做完整分析
+    async with state.lock:
+        if state.problem is None:
+            # 尚无问题草稿时，先经过本地预过滤和初筛
+            conversation = await get_conversation(channel)  # 获取频道对话内容
+            # 本地预过滤：明显无效的 Ticket（无用户回复、仅问候或表情等）不调用 LLM
+            prefilter_config = get_prefilter_config(config_manager.get_guild_config(guild_id))
+            prefilter_passed, prefilter_reason = prefilter_ticket(conversation, prefilter_config)
+            if prefilter_config['mode'] == 'on' and not prefilter_passed:
+                logger.info(f"频道 {channel.name} 被本地预过滤拦截（{prefilter_reason}），跳过 LLM 分析")
+                config_manager.increment_stat(guild_id, 'prefilter_rejected')
+                return
+            if prefilter_config['mode'] == 'shadow':
+                shadow = (prefilter_passed, prefilter_reason)
+            # 与近期问题高度相似的 Ticket 直接关联到已有问题，跳过 LLM 分析
+            if await publish_duplicate_ticket(channel, guild_id, conversation, creation_time):
+                return
+            # 级联分析第一级：廉价模型初筛，无效 Ticket 不再进入完整分析
+            if not await triage_ticket(conversation, guild_id, llm_config, channel.id):
+                logger.info(f"频道 {channel.name} 未通过初筛，跳过完整分析")
+                if shadow:
+                    await record_prefilter_shadow(channel, guild_id, *shadow, False)
+                return
+        # 已有草稿时直接发布或增量更新，否则进行完整分析
+        problem = await analyze_ticket_with_state(channel, guild_id, llm_config, creation_time, conversation, locked=True)
+    if shadow:
+        await record_prefilter_shadow(channel, guild_id, *shadow, bool(problem and problem['is_valid']))
+    if problem and problem['is_valid']:  # 如果分析结果有效
+        await publish_ticket_problem(channel, problem, guild_id)  # 分配 ID、推送到 Telegram 并写入问题库
+    else:
+        logger.info(f"频道 {channel.name} 不构成有效问题")
+
+async def publish_ticket_problem(channel, problem, guild_id):
+    """
+    发布 Ticket 的有效问题。草稿自上次发布（/warp_msg 或自动分析）后没有变化时不再重复发布，
+    沿用上次分配的问题 ID，避免同一问题重复推送到 Telegram 和写入问题库。
+    
+    Args:
+        channel (discord.Channel): Ticket 频道对象
+        problem (dict): analyze_ticket_with_state() 返回的问题字典
+        guild_id (str): Discord 服务器 ID
+    
+    Returns:
+        bool: 是否发布了新问题；problem['id'] 为问题 ID
+    """
+    state = ticket_states.get(channel.id)
+    if state.published_draft is not None and state.published_draft == problem:
+        problem['id'] = state.published_id
+        logger.info(f"Ticket 频道 {channel.name} 的问题草稿自上次发布后未变化，沿用问题 ID {state.published_id}")
+        return False
+    draft = dict(problem)
+    previous = state.published_draft, state.published_id
+    state.published_draft = draft  # 发布前先登记，同时进行的另一次发布会直接跳过
+    try:
+        state.published_id = await publish_problem(problem, guild_id)
+    except BaseException:
+        state.published_draft, state.published_id = previous
+        raise
+    return True
+
+async def publish_problem(problem, guild_id, notify=True, created_at=None):
+    """
+    发布有效问题：分配唯一问题 ID，推送到 Telegram，并写入本地问题库。
+    实时分析与历史回填共用此流程，问题 ID 始终由全局计数器分配，不会重复。
+    - 开启去重时与近期问题比较相似度，重复问题关联到所属簇的首个问题 ID；suppress 模式下不推送重复问题。
+    
+    Args:
+        problem (dict): 问题字典
+        guild_id (str): Discord 服务器 ID
+        notify (bool): 是否推送到 Telegram
+        created_at (float): 可选，写入问题库的 Unix 时间戳（回填时为 Ticket 创建时间）
+    
+    Returns:
+        int: 分配的问题 ID
+    """
+    config = config_manager.get_guild_config(guild_id)
+    dedup_config = get_dedup_config(config)
+    created_at = created_at or time.time()
+    index = None
+    if dedup_config['mode'] != 'off':
+        index = await get_similarity_index(guild_id)
+        if not problem.get('duplicate_of'):
+            slot, score = index.query(problem_text(problem), created_at - dedup_config['window_days'] * 86400)
+            if slot is not None and score >= dedup_config['threshold']:
+                problem['duplicate_of'] = int(index.roots[slot])
+                logger.info(f"问题与 #{problem['duplicate_of']} 相似（{score:.2f}），标记为重复")
+        if problem.get('duplicate_of'):
+            config_manager.increment_stat(guild_id, 'duplicates')
+            notify = notify and dedup_config['mode'] != 'suppress'
+    problem['id'] = await config_manager.get_next_problem_id()  # 分配唯一问题 ID
+    if index is not None:
+        index.add(problem['id'], problem.get('duplicate_of'), problem_text(problem), created_at, {
+            'problem_type': problem['problem_type'], 'summary': problem['summary'], 'details': problem['details']
+        })
+    tg_channel_id = config.get('tg_channel_id')
+    if notify and tg_channel_id:
+        await telegram_bot.send_problem_form(problem, tg_channel_id)  # 发送问题到 Telegram
+        logger.info(f"问题反馈已发送到 Telegram 频道 {tg_channel_id}")
+    try:
+        await asyncio.to_thread(problem_store.add_problem, guild_id, problem, config.get('timezone', 0), created_at)
+    except Exception as e:
+        logger.error(f"写入问题库失败，问题 ID: {problem['id']}，错误: {e}")
+    return problem['id']
+
+def backfill_llm_runner(llm_config):
+    """回填的 LLM 调用与定时总结同属后台优先级，不影响实时分析；接口断路时由 call_llm_with_retry 退避重试"""
+    return functools.partial(llm_scheduler.run, PRIORITY_SUMMARY, endpoint=guard_key(llm_config['base_url'], llm_config['api_key']))
+
+async def backfill_ticket_channel(channel, guild_id, notify):
+    """
+    回填单个历史 Ticket 频道：经过与实时流程相同的预过滤、初筛和完整分析后发布。
+    - 问题库中已有该频道的问题时跳过，重复回填不会产生重复问题。
+    
+    Args:
+        channel (discord.TextChannel): 历史 Ticket 频道
+        guild_id (str): Discord 服务器 ID
+        notify (bool): 是否推送到 Telegram
+    
+    Returns:
+        bool: 是否产生了有效问题
+    """
+    link = f"https://discord.com/channels/{guild_id}/{channel.id}"  # 与 finalize_problem 生成的链接一致
+    if await asyncio.to_thread(problem_store.has_link, guild_id, link):
+        return False
+    config = config_manager.get_guild_config(guild_id)
+    llm_config = await apply_token_budget(guild_id, get_guild_llm_config(guild_id))
+    if llm_config is None:
+        raise RuntimeError("今日 token 预算已用尽，稍后重新执行 /backfill 继续")
+    conversation = await get_conversation(channel)
+    prefilter_config = get_prefilter_config(config)
+    prefilter_passed, _ = prefilter_ticket(conversation, prefilter_config)
+    if prefilter_config['mode'] == 'on' and not prefilter_passed:
+        return False
+    triage_model_id = get_triage_model_id(guild_id)
+    if triage_model_id and not await call_llm_with_retry(
+        triage_ticket_conversation, conversation, llm_config['api_key'], llm_config['base_url'], triage_model_id, run=backfill_llm_runner(llm_config)
+    ):
+        return False
+    problem = await call_llm_with_retry(
+        analyze_ticket_conversation, conversation, channel, guild_id, config,
+        llm_config['api_key'], llm_config['base_url'], llm_config['model_id'], channel.created_at, run=backfill_llm_runner(llm_config)
+    )
+    if not problem['is_valid']:
+        return False
+    await publish_problem(problem, guild_id, notify, channel.created_at.timestamp())
+    logger.info(f"历史 Ticket 频道 {channel.name} 回填完成，问题 ID: {problem['id']}")
+    return True
+
+async def backfill_monitor_window(channel, guild_id, start, end, notify):
+    """
+    回填监控频道的一个历史窗口：与定时分析相同，按服务器的抽样方式从窗口内取 monitor_max_messages 条消息生成总结。
+    - 窗口内没有消息或已有该窗口的总结时跳过。
+    
+    Args:
+        channel (discord.TextChannel): 监控频道
+        guild_id (str): Discord 服务器 ID
+        start (datetime): 窗口开始时间
+        end (datetime): 窗口结束时间
+        notify (bool): 是否推送到 Telegram
+    
+    Returns:
+        bool: 是否产生了总结
+    """
+    if await asyncio.to_thread(problem_store.has_summary, channel.id, end.timestamp()):
+        return False
+    config = config_manager.get_guild_config(guild_id)
+    llm_config = get_guild_llm_config(guild_id)
+    level, _, _ = budget_status(config_manager, guild_id, DEFAULT_DAILY_TOKEN_BUDGET)
+    if level == BUDGET_EXHAUSTED:
+        raise RuntimeError("今日 token 预算已用尽，稍后重新执行 /backfill 继续")
+    conversation, total_messages = await sample_channel_history(
+        channel, monitor_sample_size(config, level), start, end, config.get('monitor_sampling', DEFAULT_SAMPLING_MODE)
+    )
+    if not conversation:
+        return False
+    summary = await call_llm_with_retry(
+        analyze_general_conversation, conversation, channel, guild_id, config,
+        llm_config['api_key'], llm_config['base_url'], llm_config['model_id'], run=backfill_llm_runner(llm_config)
+    )
+    await telegram_bot.publish_general_summary(
+        guild_id, channel, config, summary, config.get('monitor_period', 2), total_messages, len(conversation), end, notify
+    )
+    return True
+
+async def get_similarity_index(guild_id):
+    """
+    获取服务器的相似度索引，首次使用时从问题库加载最近的问题。
+    内存中最多保留 SIMILARITY_MAX_GUILDS 个服务器的索引，超出时淘汰最久未使用的。
+    
+    Args:
+        guild_id (str): Discord 服务器 ID
+    
+    Returns:
+        SimilarityIndex: 相似度索引
+    """
+    index = similarity_indexes.get(guild_id)
+    if index is None:
+        rows = await asyncio.to_thread(problem_store.recent_problems, guild_id, SIMILARITY_CAPACITY)
+        index = similarity_indexes.setdefault(guild_id, SimilarityIndex())
+        if not index.size:
+            for row in rows:
+                index.add(row['id'], row['duplicate_of'], problem_text(row), row['created_at'], {
+                    'problem_type': row['problem_type'], 'summary': row['summary'], 'details': row['details']
+                })
+            logger.info(f"服务器 {guild_id} 的相似度索引已加载，共 {len(rows)} 个近期问题")
+    similarity_indexes.move_to_end(guild_id)
+    while len(similarity_indexes) > SIMILARITY_MAX_GUILDS:
+        evicted, _ = similarity_indexes.popitem(last=False)
+        logger.info(f"服务器 {evicted} 的相似度索引最久未使用，已从内存中淘汰")
+    return index
+
+async def find_duplicate_ticket(guild_id, conversation):
+    """
+    判断 Ticket 是否明显重复：开启 skip_analysis 时，用户发言与近期问题的相似度达到 skip_threshold。
+    
+    Args:
+        guild_id (str): Discord 服务器 ID
+        conversation (list): 对话列表（按时间倒序）
+    
+    Returns:
+        tuple: (相似度索引, 槽位, 相似度)，不重复时返回 None
+    """
+    dedup_config = get_dedup_config(config_manager.get_guild_config(guild_id))
+    if dedup_config['mode'] == 'off' or not dedup_config['skip_analysis']:
+        return None
+    user_text = " ".join(msg['content'] for msg in reversed(conversation) if not msg.get('is_bot'))
+    if not user_text.strip():
+        return None
+    index = await get_similarity_index(guild_id)
+    slot, score = index.query(user_text, time.time() - dedup_config['window_days'] * 86400)
+    if slot is None or score < dedup_config['skip_threshold']:
+        return None
+    return index, slot, score
+
+async def publish_duplicate_ticket(channel, guild_id, conversation, creation_time):
+    """
+    跳过明显重复 Ticket 的完整分析，直接复用所属簇首个问题的类型、简述和详情发布为关联问题。
+    
+    Args:
+        channel (discord.Channel): Ticket 频道对象
+        guild_id (str): Discord 服务器 ID
+        conversation (list): 对话列表（按时间倒序）
+        creation_time (datetime): 频道创建时间
+    
+    Returns:
+        bool: True 表示已作为重复问题发布，无需再分析
+    """
+    duplicate = await find_duplicate_ticket(guild_id, conversation)
+    if not duplicate:
+        return False
+    index, slot, score = duplicate
+    config = config_manager.get_guild_config(guild_id)
+    user_messages = [msg for msg in reversed(conversation) if not msg.get('is_bot')]
+    root_id = int(index.roots[slot])
+    meta = index.meta[slot]
+    problem = finalize_problem(Problem(
+        problem_type=meta['problem_type'], summary=meta['summary'], details=meta['details'],
+        source='', user=user_messages[0]['user'], timestamp='', is_valid=True,
+        original="\n".join(f"{msg['user']}: {msg['content']}" for msg in reversed(conversation))
+    ), channel, guild_id, config, creation_time)
+    problem['duplicate_of'] = root_id
+    config_manager.increment_stat(guild_id, 'dedup_skipped')
+    logger.info(f"频道 {channel.name} 与问题 #{root_id} 高度相似（{score:.2f}），跳过完整分析")
+    await publish_problem(problem, guild_id)
+    return True
+
+async def wait_for_ticket_idle(channel_id, idle_seconds, max_wait_seconds):
+    """
+    等待 Ticket 频道空闲：距最近一条消息超过 idle_seconds，或总等待超过 max_wait_seconds。
+    - 只在可能到期的时间点醒来检查，新消息不会产生额外任务。
+    
+    Args:
+        channel_id (int): Ticket 频道 ID
+        idle_seconds (float): 空闲触发时长（秒）
+        max_wait_seconds (float): 最长等待时长（秒）
+    """
+    deadline = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=max_wait_seconds)
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        last_activity = ticket_last_activity.get(channel_id, now)
+        idle_remaining = idle_seconds - (now - last_activity).total_seconds()
+        max_remaining = (deadline - now).total_seconds()
+        if idle_remaining <= 0 or max_remaining <= 0:
+            return
+        await asyncio.sleep(min(idle_remaining, max_remaining))
+
+async def record_prefilter_shadow(channel, guild_id, prefilter_passed, prefilter_reason, llm_valid):
+    """
+    预过滤影子模式：记录本地预过滤与 LLM 判断是否一致，用于评估阈值。
+    
+    Args:
+        channel (discord.Channel): Ticket 频道对象
+        guild_id (str): Discord 服务器 ID
+        prefilter_passed (bool): 预过滤是否放行
+        prefilter_reason (str): 预过滤判断原因
+        llm_valid (bool): LLM 是否判断为有效问题
+    """
+    if prefilter_passed == llm_valid:
+        config_manager.increment_stat(guild_id, 'prefilter_shadow_agree')
+    else:
+        config_manager.increment_stat(guild_id, 'prefilter_shadow_disagree')
+        logger.info(f"预过滤影子模式与 LLM 判断不一致，频道: {channel.name}，预过滤: {prefilter_passed}（{prefilter_reason}），LLM: {llm_valid}")
+
+async def triage_ticket(conversation, guild_id, llm_config, channel_id):
+    """
+    级联分析的第一级：使用服务器配置的初筛模型判断 Ticket 是否值得完整分析。
+    - 未配置初筛模型时直接放行。
+    - 初筛调用失败时放行，由完整分析兜底。
+    - 判定无效后若频道没有新消息，不重复初筛。
+    
+    Args:
+        conversation (list): 对话列表（按时间倒序）
+        guild_id (str): Discord 服务器 ID
+        llm_config (dict): 当前服务器使用的 LLM 配置
+        channel_id (int): Ticket 频道 ID
+    
+    Returns:
+        bool: True 表示需要进行完整分析
+    """
+    triage_model_id = get_triage_model_id(guild_id)
+    if not triage_model_id:
+        return True
+    state = ticket_states.get(channel_id)
+    latest_message_id = conversation[0]['id'] if conversation else None
+    if latest_message_id is not None and state.triage_rejected_id == latest_message_id:
+        return False
+    try:
+        is_valid = await analysis_jobs.run(
+            JOB_TICKET_TRIAGE, {'guild_id': guild_id, 'channel_id': channel_id, 'last_message_id': latest_message_id, 'conversation': conversation},
+            {**llm_config, 'model_id': triage_model_id}
         )
-        if problem and problem['is_valid']:  # 如果分析结果有效
-            problem['id'] = await config_manager.get_next_problem_id()  # 分配唯一问题 ID
-            tg_channel_id = config_manager.get_guild_config(guild_id).get('tg_channel_id')
-            if tg_channel_id:
-                await telegram_bot.send_problem_form(problem, tg_channel_id)  # 发送问题到 Telegram
-                logger.info(f"问题反馈已发送到 Telegram 频道 {tg_channel_id}")
+    except Exception as e:
+        logger.error(f"Ticket 初筛失败，继续完整分析: {e}")
+        return True
+    config_manager.increment_stat(guild_id, 'triage_calls')
+    if not is_valid:
+        state.triage_rejected_id = latest_message_id
+        config_manager.increment_stat(guild_id, 'triage_rejected')
+    return is_valid
+
+async def analyze_ticket_with_state(channel, guild_id, llm_config, creation_time, conversation=None, on_partial=None, priority=PRIORITY_TICKET, locked=False):
+    """
+    基于预计算状态分析 Ticket 频道。
+    - 问题草稿已覆盖最新消息时直接返回草稿，不调用 LLM。
+    - 草稿落后时只把新增消息交给增量提示更新草稿。
+    - 没有草稿时进行完整分析并保存为草稿。
+    
+    Args:
+        channel (discord.Channel): Ticket 频道对象
+        guild_id (str): Discord 服务器 ID
+        llm_config (dict): 当前服务器使用的 LLM 配置
+        creation_time (datetime): 频道创建时间
+        conversation (list): 可选，已获取的完整对话（按时间倒序），避免重复拉取
+        on_partial (callable): 可选，完整分析时的流式回调
+        priority (int): LLM 调用的优先级类别，手动 /warp_msg 为 PRIORITY_INTERACTIVE
+        locked (bool): 调用方是否已持有该频道的 state.lock（在锁内先判断草稿再决定是否初筛）
+    
+    Returns:
+        dict: 问题字典（草稿的副本）
+    """
+    config = config_manager.get_guild_config(guild_id)
+    state = ticket_states.get(channel.id)
+    async with (contextlib.nullcontext() if locked else state.lock):
+        if state.problem is not None:
+            if state.last_message_id == channel.last_message_id:
+                config_manager.increment_stat(guild_id, 'draft_hits')
+                return dict(state.problem)
+            new_conversation = await get_conversation(channel, after=state.last_message_id)
+            if new_conversation:
+                config_manager.increment_stat(guild_id, 'delta_calls')
+                state.problem = await analysis_jobs.run(JOB_TICKET_DELTA, {
+                    'guild_id': guild_id, 'channel': channel_ref(channel), 'config': config, 'draft': state.problem,
+                    'conversation': new_conversation, 'creation_time': creation_time.isoformat(),
+                    'last_message_id': new_conversation[-1]['id']
+                }, llm_config, priority)
+                state.last_message_id = new_conversation[-1]['id']
+                logger.info(f"Ticket 频道 {channel.name} 问题草稿已增量更新，新增 {len(new_conversation)} 条消息")
+            else:
+                config_manager.increment_stat(guild_id, 'draft_hits')
+            return dict(state.problem)
+        if conversation is None:
+            conversation = await get_conversation(channel)
+        config_manager.increment_stat(guild_id, 'full_calls')
+        if on_partial is None:
+            # 交给分析进程（或本进程的工作线程）执行，避免阻塞事件循环
+            state.problem = await analysis_jobs.run(JOB_TICKET_FULL, {
+                'guild_id': guild_id, 'channel': channel_ref(channel), 'config': config, 'conversation': conversation,
+                'creation_time': creation_time.isoformat(), 'last_message_id': conversation[0]['id'] if conversation else None
+            }, llm_config, priority)
         else:
-            logger.info(f"频道 {channel.name} 不构成有效问题")
-    else:
-        logger.error(f"无法获取频道 {channel.name} 的创建时间")
+            # 流式输出需要逐段回调，在本进程中运行；对冲的备用请求不流式输出
+            primary = (analyze_ticket_conversation, (
+                conversation, channel, guild_id, config, llm_config['api_key'], llm_config['base_url'],
+                llm_config['model_id'], creation_time, on_partial
+            ), guard_key(llm_config['base_url'], llm_config['api_key']))
+            hedge = None
+            fallback = get_fallback_llm_config(guild_id, llm_config)
+            if fallback:
+                hedge = (call_as_fallback, (
+                    analyze_ticket_conversation, conversation, channel, guild_id, config, fallback['api_key'], fallback['base_url'],
+                    fallback['model_id'], creation_time
+                ), guard_key(fallback['base_url'], fallback['api_key']))
+            state.problem = await llm_scheduler.run_hedged(priority, JOB_TICKET_FULL, primary, hedge)
+        state.last_message_id = conversation[0]['id'] if conversation else None
+        return dict(state.problem)
+
+async def refresh_ticket_draft(channel, guild_id):
+    """
+    后台更新 Ticket 问题草稿，使 /warp_msg 和定时推送可以几乎即时发布。
+    - 等待一小段时间合并连续消息后再更新。
+    - 尚无草稿时同样经过本地预过滤和初筛，避免为无效 Ticket 调用完整分析。
+    
+    Args:
+        channel (discord.Channel): Ticket 频道对象
+        guild_id (str): Discord 服务器 ID
+    """
+    await asyncio.sleep(TICKET_DRAFT_DEBOUNCE_SECONDS)
+    creation_time = ticket_creation_times.get(channel.id)
+    if not creation_time:
+        return
+    if budget_status(config_manager, guild_id, DEFAULT_DAILY_TOKEN_BUDGET)[0] != BUDGET_NORMAL:
+        return  # 接近或超出今日 token 预算时不做后台预计算，由定时分析按降级策略处理
+    llm_config = get_guild_llm_config(guild_id)
+    state = ticket_states.get(channel.id)
+    try:
+        async with state.lock:
+            conversation = None
+            if state.problem is None:
+                conversation = await get_conversation(channel)
+                prefilter_config = get_prefilter_config(config_manager.get_guild_config(guild_id))
+                prefilter_passed, _ = prefilter_ticket(conversation, prefilter_config)
+                if prefilter_config['mode'] == 'on' and not prefilter_passed:
+                    return
+                if await find_duplicate_ticket(guild_id, conversation):
+                    return  # 明显重复的 Ticket 不生成草稿，由定时分析直接关联发布
+                if not await triage_ticket(conversation, guild_id, llm_config, channel.id):
+                    return
+            await analyze_ticket_with_state(channel, guild_id, llm_config, creation_time, conversation, locked=True)
+    except Exception as e:
+        logger.error(f"后台更新 Ticket 频道 {channel.name} 的问题草稿失败: {e}")
 
 async def process_message(message, guild_id):
     """
-    实时消息处理，当前为空，可根据需求扩展。
+    实时消息处理：为开启增量分析的服务器调度后台问题草稿更新。
+    - 同一频道同时只有一个后台更新任务，期间的新消息会在该任务中一并处理。
     
     Args:
         message (discord.Message): 收到的消息对象
         guild_id (str): Discord 服务器 ID
     """
-    pass  # 占位符，留给未来的功能扩展
+    if not config_manager.is_bot_activated():
+        return
+    if not config_manager.get_guild_config(guild_id).get('ticket_incremental', DEFAULT_TICKET_INCREMENTAL):
+        return
+    state = ticket_states.get(message.channel.id)
+    if state.refresh_task is None or state.refresh_task.done():
+        state.refresh_task = asyncio.create_task(refresh_ticket_draft(message.channel, guild_id))
 
 def is_allowed(interaction: discord.Interaction):
     """
@@ -178,15 +882,10 @@ def is_allowed(interaction: discord.Interaction):
     Returns:
         bool: True 表示有权限，False 表示无权限
     """
-    guild_id = str(interaction.guild.id)
-    config = config_manager.get_guild_config(guild_id)
-    allowed_roles = config.get('allowed_roles', [])  # 获取允许的角色 ID 列表
     if interaction.user.guild_permissions.administrator:  # 检查是否为管理员
-        logger.info(f"用户 {interaction.user.name} 是管理员，允许执行命令")
         return True
-    has_permission = any(role.id in allowed_roles for role in interaction.user.roles)  # 检查用户角色
-    logger.info(f"用户 {interaction.user.name} 检查权限，结果: {has_permission}")
-    return has_permission
+    route = routing_index.get(interaction.guild.id)  # 允许的角色 ID 已编译为集合
+    return route.has_any_role(route.allowed_role_ids, interaction.user.roles)  # 检查用户角色
 
 def is_warp_msg_allowed(interaction: discord.Interaction):
     """
@@ -200,15 +899,10 @@ def is_warp_msg_allowed(interaction: discord.Interaction):
     Returns:
         bool: True 表示有权限，False 表示无权限
     """
-    guild_id = str(interaction.guild.id)
-    config = config_manager.get_guild_config(guild_id)
-    warp_msg_allowed_roles = config_manager.get_warp_msg_allowed_roles(guild_id)
     if interaction.user.guild_permissions.administrator:
-        logger.info(f"用户 {interaction.user.name} 是管理员，允许使用 warp_msg")
         return True
-    has_permission = any(role.id in warp_msg_allowed_roles for role in interaction.user.roles)
-    logger.info(f"用户 {interaction.user.name} 检查 warp_msg 权限，结果: {has_permission}")
-    return has_permission
+    route = routing_index.get(interaction.guild.id)
+    return route.has_any_role(route.warp_msg_role_ids, interaction.user.roles)
 
 @bot.tree.command(name="activate_key", description="使用密钥激活 Bot")
 @app_commands.describe(key="激活密钥")
@@ -389,22 +1083,31 @@ async def check_monitor_channels(interaction: discord.Interaction):
     await interaction.response.send_message(response, ephemeral=True)
 
 @bot.tree.command(name="set_monitor_params", description="设置监控周期和最大消息条数")
-@app_commands.describe(period_hours="监控周期（小时）", max_messages="最大消息条数")
+@app_commands.describe(
+    period_hours="监控周期（小时）",
+    max_messages="最大消息条数",
+    sampling="消息超过最大条数时的取样方式：stratified 在整个周期内分层抽样（默认）；recent 只取最新的消息"
+)
+@app_commands.choices(sampling=[app_commands.Choice(name=m, value=m) for m in SAMPLING_MODES])
 @app_commands.check(is_allowed)
 @check_activation()
-async def set_monitor_params(interaction: discord.Interaction, period_hours: int, max_messages: int):
+async def set_monitor_params(interaction: discord.Interaction, period_hours: int, max_messages: int, sampling: app_commands.Choice[str] = None):
     """
-    设置 General Chat 监控的周期和最大消息数。
+    设置 General Chat 监控的周期、最大消息数和取样方式。
     
     Args:
         interaction (discord.Interaction): Discord 交互对象
         period_hours (int): 监控周期（小时）
         max_messages (int): 每次分析的最大消息数
+        sampling (app_commands.Choice[str]): 可选的取样方式，不指定时保持当前设置
     """
     guild_id = str(interaction.guild.id)
     await config_manager.set_guild_config(guild_id, 'monitor_period', period_hours)
     await config_manager.set_guild_config(guild_id, 'monitor_max_messages', max_messages)
-    await interaction.response.send_message(f'已设置监控周期为 {period_hours} 小时，最大消息条数为 {max_messages}', ephemeral=True)
+    if sampling:
+        await config_manager.set_guild_config(guild_id, 'monitor_sampling', sampling.value)
+    sampling_mode = config_manager.get_guild_config(guild_id).get('monitor_sampling', DEFAULT_SAMPLING_MODE)
+    await interaction.response.send_message(f'已设置监控周期为 {period_hours} 小时，最大消息条数为 {max_messages}，取样方式: {sampling_mode}', ephemeral=True)
 
 @bot.tree.command(name="check_monitor_params", description="查看当前监控参数")
 @app_commands.check(is_allowed)
@@ -420,7 +1123,55 @@ async def check_monitor_params(interaction: discord.Interaction):
     config = config_manager.get_guild_config(guild_id)
     period = config.get('monitor_period', 2)  # 默认 2 小时
     max_messages = config.get('monitor_max_messages', 100)  # 默认 100 条
-    await interaction.response.send_message(f'当前监控周期: {period} 小时，最大消息条数: {max_messages}', ephemeral=True)
+    cadence = get_cadence_config(config)
+    sampling = config.get('monitor_sampling', DEFAULT_SAMPLING_MODE)
+    response = f'当前监控周期: {period} 小时，最大消息条数: {max_messages}，取样方式: {sampling}\n监控节奏: {cadence["mode"]}'
+    if cadence['mode'] == 'adaptive':
+        response += (
+            f'\n- 周期内少于 {cadence["min_messages"]} 条消息时跳过，最多合并 {cadence["max_merge_periods"]} 个周期'
+            f'\n- 消息量达到平时一个周期的 {cadence["burst_factor"]} 倍（至少 {cadence["burst_messages"]} 条），'
+            f'或负面关键词消息达到 {cadence["negative_min"]} 条且占比 {cadence["negative_ratio"]:.0%} 时提前分析'
+            f'（间隔至少 {cadence["min_interval_minutes"]} 分钟）'
+        )
+    await interaction.response.send_message(response, ephemeral=True)
+
+@bot.tree.command(name="set_monitor_cadence", description="设置监控频道的自适应分析节奏")
+@app_commands.describe(
+    mode="fixed: 按监控周期固定分析；adaptive: 跳过冷清周期，突增时提前分析",
+    min_messages="周期内消息数低于该值时跳过并入下一周期（默认 5）",
+    max_merge_periods="最多合并的周期数（默认 4）",
+    burst_factor="消息量达到平时一个周期的多少倍时提前分析（默认 3）",
+    negative_ratio="负面关键词消息占比达到该值时提前分析（0~1，默认 0.15）"
+)
+@app_commands.choices(mode=[app_commands.Choice(name=m, value=m) for m in CADENCE_MODES])
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_monitor_cadence(interaction: discord.Interaction, mode: app_commands.Choice[str], min_messages: int = 5, max_merge_periods: int = 4, burst_factor: float = 3.0, negative_ratio: float = 0.15):
+    """
+    设置监控频道的分析节奏：按频道消息速率跳过冷清周期，并在消息量或负面关键词突增时提前分析。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        mode (app_commands.Choice[str]): 节奏模式
+        min_messages (int): 跳过周期的消息数阈值
+        max_merge_periods (int): 最多合并的周期数
+        burst_factor (float): 提前分析的消息量倍数
+        negative_ratio (float): 提前分析的负面关键词消息占比
+    """
+    if min_messages < 0 or max_merge_periods < 1 or burst_factor <= 1 or not 0 < negative_ratio <= 1:
+        await interaction.response.send_message("参数无效：max_merge_periods 至少为 1，burst_factor 须大于 1，negative_ratio 须在 0~1 之间", ephemeral=True)
+        return
+    guild_id = str(interaction.guild.id)
+    cadence = config_manager.get_guild_config(guild_id).get('monitor_cadence', {})
+    await config_manager.set_guild_config(guild_id, 'monitor_cadence', {
+        **cadence,
+        'mode': mode.value,
+        'min_messages': min_messages,
+        'max_merge_periods': max_merge_periods,
+        'burst_factor': burst_factor,
+        'negative_ratio': negative_ratio
+    })
+    await interaction.response.send_message(f'监控节奏已设置为: {mode.value}', ephemeral=True)
 
 @bot.tree.command(name="set_access", description="设置允许使用 Bot 命令的身份组")
 @app_commands.describe(role="允许的身份组（@身份组）")
@@ -592,26 +1343,54 @@ async def warp_msg(interaction: discord.Interaction):
     # defer 响应，避免超时
     await interaction.response.defer(ephemeral=True)
     
-    # 获取对话内容并分析
-    conversation = await get_conversation(channel)
+    # 获取频道创建时间和 LLM 配置
     creation_time = channel.created_at or datetime.datetime.now(datetime.timezone.utc)
-    llm_config = config_manager.get_llm_config(guild_id) or {
-        'api_key': DEFAULT_LLM_API_KEY,
-        'model_id': DEFAULT_MODEL_ID,
-        'base_url': DEFAULT_BASE_URL
-    }
-    problem = await asyncio.to_thread(
-        analyze_ticket_conversation, conversation, channel, guild_id,
-        config, llm_config['api_key'], llm_config['base_url'], llm_config['model_id'], creation_time
-    )
+    llm_config = await apply_token_budget(guild_id, get_guild_llm_config(guild_id), manual=True)
+    
+    # 流式分析：problem_type、summary 等字段生成完毕后立即更新 defer 的响应，缩短等待感知
+    loop = asyncio.get_running_loop()
+    last_preview = ''
+    pending_edits = []
+    finished = False  # 对冲请求胜出后，未胜出的主调用可能仍在流式输出，不再更新预览
+    def on_partial(fields):
+        nonlocal last_preview
+        if finished:
+            return
+        preview = "\n".join(
+            f"{label}: {fields[key]}" for key, label in (('problem_type', 'Type'), ('summary', 'Summary'))
+            if isinstance(fields.get(key), str) and fields[key]
+        )
+        if preview and preview != last_preview:
+            last_preview = preview
+            pending_edits.append(asyncio.run_coroutine_threadsafe(
+                interaction.edit_original_response(content=f"Analyzing...\n{preview}"), loop
+            ))
+    
+    # 优先发布后台预计算的问题草稿，草稿落后时只做增量更新
+    try:
+        problem = await analyze_ticket_with_state(channel, guild_id, llm_config, creation_time, on_partial=on_partial, priority=PRIORITY_INTERACTIVE)
+    except Exception as e:
+        finished = True
+        logger.error(f"手动分析 Ticket 频道 {channel.name} 失败: {e}")
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in pending_edits), return_exceptions=True)
+        if isinstance(e, CircuitOpenError):
+            message = "LLM endpoint is temporarily unavailable, please try again later."
+        elif isinstance(e, TimeoutError):
+            message = "Analysis timed out, please try again later."
+        else:
+            message = "Analysis failed, please try again later."
+        await interaction.followup.send(message, ephemeral=True)
+        return
+    # 等待预览编辑完成，避免其覆盖最终结果
+    finished = True
+    await asyncio.gather(*(asyncio.wrap_future(f) for f in pending_edits), return_exceptions=True)
     
     # 处理分析结果
     if problem['is_valid']:
-        problem['id'] = await config_manager.get_next_problem_id()
-        tg_channel_id = config.get('tg_channel_id')
-        if tg_channel_id:
-            await telegram_bot.send_problem_form(problem, tg_channel_id)
-        await interaction.followup.send(f"Ticket is successfully warpped to the Team, ID: {problem['id']}", ephemeral=True)
+        if await publish_ticket_problem(channel, problem, guild_id):
+            await interaction.followup.send(f"Ticket is successfully warpped to the Team, ID: {problem['id']}", ephemeral=True)
+        else:
+            await interaction.followup.send(f"Ticket has already been warpped to the Team with no new messages since, ID: {problem['id']}", ephemeral=True)
     else:
         await interaction.followup.send("No vaild issue is detected.", ephemeral=True)
 
@@ -631,6 +1410,453 @@ async def set_timezone(interaction: discord.Interaction, offset: int):
     await config_manager.set_guild_config(guild_id, 'timezone', offset)
     await interaction.response.send_message(f'时区偏移已设置为 UTC+{offset}', ephemeral=True)
 
+@bot.tree.command(name="set_ticket_timing", description="设置 Ticket 自动分析的空闲触发时间和最长等待时间")
+@app_commands.describe(idle_minutes="频道空闲多少分钟后触发分析", max_wait_minutes="首条消息后最长等待多少分钟")
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_ticket_timing(interaction: discord.Interaction, idle_minutes: int, max_wait_minutes: int):
+    """
+    设置 Ticket 自动分析的触发时机：频道空闲 idle_minutes 后分析，最长不超过 max_wait_minutes。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        idle_minutes (int): 空闲触发时长（分钟）
+        max_wait_minutes (int): 最长等待时长（分钟）
+    """
+    if idle_minutes <= 0 or max_wait_minutes < idle_minutes:
+        await interaction.response.send_message("参数无效：空闲时间须大于 0，且不超过最长等待时间。", ephemeral=True)
+        return
+    guild_id = str(interaction.guild.id)
+    await config_manager.set_guild_config(guild_id, 'ticket_idle_minutes', idle_minutes)
+    await config_manager.set_guild_config(guild_id, 'ticket_max_wait_minutes', max_wait_minutes)
+    await interaction.response.send_message(f'Ticket 将在空闲 {idle_minutes} 分钟后分析，最长等待 {max_wait_minutes} 分钟', ephemeral=True)
+
+@bot.tree.command(name="set_ticket_incremental", description="开启或关闭 Ticket 后台增量分析")
+@app_commands.describe(enabled="是否在 Ticket 有新消息时后台更新问题草稿")
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_ticket_incremental(interaction: discord.Interaction, enabled: bool):
+    """
+    开启或关闭 Ticket 后台增量分析。开启后 /warp_msg 和定时推送可直接发布预计算的问题草稿。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        enabled (bool): 是否开启
+    """
+    guild_id = str(interaction.guild.id)
+    await config_manager.set_guild_config(guild_id, 'ticket_incremental', enabled)
+    await interaction.response.send_message(f'Ticket 后台增量分析已{"开启" if enabled else "关闭"}', ephemeral=True)
+
+@bot.tree.command(name="set_llm_fallback", description="开启或关闭备用模型（自带 LLM 密钥的服务器）")
+@app_commands.describe(enabled="自定义接口较慢或失败时是否改用运营方提供的备用模型")
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_llm_fallback(interaction: discord.Interaction, enabled: bool):
+    """
+    开启或关闭自带 LLM 密钥的服务器使用备用模型。备用模型使用运营方密钥，当日用量受默认密钥的每日预算约束。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        enabled (bool): 是否开启
+    """
+    guild_id = str(interaction.guild.id)
+    await config_manager.set_guild_config(guild_id, 'llm_fallback', enabled)
+    note = '' if LLM_FALLBACK else '（本 Bot 未启用备用模型，设置暂不生效）'
+    await interaction.response.send_message(f'备用模型已{"开启" if enabled else "关闭"}{note}', ephemeral=True)
+
+@bot.tree.command(name="set_output_mode", description="设置 LLM 结构化输出模式")
+@app_commands.describe(mode="json: JSON mode；tool: 工具调用；parser: 完整格式说明（兼容性最好）")
+@app_commands.choices(mode=[app_commands.Choice(name=m, value=m) for m in STRUCTURED_OUTPUT_MODES])
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_output_mode(interaction: discord.Interaction, mode: app_commands.Choice[str]):
+    """
+    设置服务器的 LLM 结构化输出模式。
+    - json/tool 模式提示更短，端点不支持时会自动回退到 parser 模式。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        mode (app_commands.Choice[str]): 结构化输出模式
+    """
+    guild_id = str(interaction.guild.id)
+    await config_manager.set_guild_config(guild_id, 'structured_output', mode.value)
+    await interaction.response.send_message(f'结构化输出模式已设置为: {mode.value}', ephemeral=True)
+
+@bot.tree.command(name="set_triage_model", description="设置 Ticket 初筛使用的廉价模型")
+@app_commands.describe(model_id="初筛模型 ID，填 off 关闭初筛")
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_triage_model(interaction: discord.Interaction, model_id: str):
+    """
+    设置 Ticket 级联分析的初筛模型，与服务器当前 LLM 配置共用 API Key 和 Base URL。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        model_id (str): 初筛模型 ID，"off" 表示关闭初筛
+    """
+    guild_id = str(interaction.guild.id)
+    value = None if model_id.strip().lower() == 'off' else model_id.strip()
+    await config_manager.set_guild_config(guild_id, 'triage_model_id', value)
+    response = f'Ticket 初筛模型已设置为: {value}' if value else 'Ticket 初筛已关闭'
+    await interaction.response.send_message(response, ephemeral=True)
+
+@bot.tree.command(name="set_prefilter", description="设置 Ticket 本地预过滤模式和阈值")
+@app_commands.describe(
+    mode="off: 关闭；shadow: 仅记录与 LLM 的一致性；on: 直接拦截",
+    min_user_messages="用户消息数下限",
+    min_user_chars="用户有效字符数下限（中文字符计 2）"
+)
+@app_commands.choices(mode=[app_commands.Choice(name=m, value=m) for m in PREFILTER_MODES])
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_prefilter(interaction: discord.Interaction, mode: app_commands.Choice[str], min_user_messages: int = 1, min_user_chars: int = 8):
+    """
+    设置 Ticket 本地预过滤，明显无效的 Ticket 在调用 LLM 之前即被拦截。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        mode (app_commands.Choice[str]): 预过滤模式
+        min_user_messages (int): 用户消息数下限
+        min_user_chars (int): 用户有效字符数下限
+    """
+    guild_id = str(interaction.guild.id)
+    await config_manager.set_guild_config(guild_id, 'prefilter', {
+        'mode': mode.value,
+        'min_user_messages': min_user_messages,
+        'min_user_chars': min_user_chars
+    })
+    await interaction.response.send_message(
+        f'预过滤已设置为: {mode.value}，用户消息数下限 {min_user_messages}，有效字符数下限 {min_user_chars}',
+        ephemeral=True
+    )
+
+@bot.tree.command(name="set_dedup", description="设置重复问题检测")
+@app_commands.describe(
+    mode="off: 关闭；link: 标注关联的首个问题；suppress: 重复问题不推送到 Telegram",
+    threshold="判定为重复的相似度阈值（0~1，默认 0.75）",
+    skip_analysis="是否跳过明显重复 Ticket 的 LLM 分析（默认否）",
+    skip_threshold="跳过分析的相似度阈值（0~1，默认 0.8）"
+)
+@app_commands.choices(mode=[app_commands.Choice(name=m, value=m) for m in DEDUP_MODES])
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_dedup(interaction: discord.Interaction, mode: app_commands.Choice[str], threshold: float = 0.75, skip_analysis: bool = False, skip_threshold: float = 0.8):
+    """
+    设置重复问题检测：基于近期问题简述、详情和原始对话的 TF-IDF 余弦相似度。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        mode (app_commands.Choice[str]): 去重模式
+        threshold (float): 判定为重复的相似度阈值
+        skip_analysis (bool): 是否跳过明显重复 Ticket 的 LLM 分析
+        skip_threshold (float): 跳过分析的相似度阈值
+    """
+    if not (0 < threshold <= 1 and 0 < skip_threshold <= 1):
+        await interaction.response.send_message("相似度阈值必须在 0~1 之间", ephemeral=True)
+        return
+    guild_id = str(interaction.guild.id)
+    await config_manager.set_guild_config(guild_id, 'dedup', {
+        'mode': mode.value,
+        'threshold': threshold,
+        'skip_analysis': skip_analysis,
+        'skip_threshold': skip_threshold
+    })
+    if mode.value == 'off':
+        similarity_indexes.pop(guild_id, None)  # 释放索引内存，重新开启时从问题库重建
+    await interaction.response.send_message(
+        f'重复问题检测已设置为: {mode.value}，相似度阈值 {threshold}，'
+        f'跳过分析: {"开启（阈值 " + str(skip_threshold) + "）" if skip_analysis else "关闭"}',
+        ephemeral=True
+    )
+
+@bot.tree.command(name="set_token_budget", description="设置每日 LLM token 预算")
+@app_commands.describe(
+    daily_tokens="每日 token 预算（UTC 自然日），0 表示不限",
+    degrade_at="用量达到预算的该比例时开始降级（0~1，默认 0.8）"
+)
+@app_commands.check(is_allowed)
+@check_activation()
+async def set_token_budget(interaction: discord.Interaction, daily_tokens: int, degrade_at: float = 0.8):
+    """
+    设置当前服务器的每日 LLM token 预算。接近预算时监控样本减半、Ticket 分析改用廉价模型，用尽后跳过自动分析。
+    使用默认 LLM 密钥的服务器，实际预算不超过 DAILY_TOKEN_BUDGET。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        daily_tokens (int): 每日 token 预算
+        degrade_at (float): 开始降级的用量比例
+    """
+    if daily_tokens < 0 or not 0 < degrade_at <= 1:
+        await interaction.response.send_message("预算不能为负数，降级比例必须在 0~1 之间", ephemeral=True)
+        return
+    guild_id = str(interaction.guild.id)
+    await config_manager.set_guild_config(guild_id, 'token_budget', {'daily_tokens': daily_tokens, 'degrade_at': degrade_at})
+    _, used, budget = budget_status(config_manager, guild_id, DEFAULT_DAILY_TOKEN_BUDGET)
+    await interaction.response.send_message(
+        f'每日 token 预算已设置为: {daily_tokens or "不限"}，用量达到 {degrade_at:.0%} 时降级\n'
+        f'实际生效预算: {budget or "不限"}，今日已用: {used}',
+        ephemeral=True
+    )
+
+@bot.tree.command(name="token_usage", description="查看每日 LLM token 用量")
+@app_commands.describe(days="查看最近多少天（默认 7）")
+@app_commands.check(is_allowed)
+@check_activation()
+async def token_usage(interaction: discord.Interaction, days: int = 7):
+    """
+    查看当前服务器最近几天的 LLM token 用量和今日预算状态。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        days (int): 查看最近多少天
+    """
+    guild_id = str(interaction.guild.id)
+    level, used, budget = budget_status(config_manager, guild_id, DEFAULT_DAILY_TOKEN_BUDGET)
+    usage = dict(config_manager.get_token_usage(guild_id))
+    today = usage_day()
+    pending = TOKEN_METER.pending_tokens(guild_id, today)
+    lines = [
+        f"今日用量: {used}" + (f" / {budget}（{used / budget:.0%}）" if budget else "（不限预算）") + f"，预算状态: {level}",
+        f"降级阈值: {get_budget_config(config_manager.get_guild_config(guild_id))['degrade_at']:.0%}",
+        "",
+        "日期 | 输入 | 输出 | 调用次数（其中估算）"
+    ]
+    for day in sorted(usage, reverse=True)[:max(days, 1)]:
+        entry = usage[day]
+        lines.append(f"{day} | {entry.get('prompt', 0)} | {entry.get('completion', 0)} | {entry.get('calls', 0)}（{entry.get('estimated', 0)}）")
+    if pending:
+        lines.append(f"另有 {pending} token 尚未写入统计（每分钟合并一次）")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+def describe_parse_stats(guild_id, days=7):
+    """汇总服务器最近几天的结构化输出解析统计（随 token 用量按日保存，含尚未合并的计数）"""
+    today = datetime.datetime.now(datetime.timezone.utc)
+    recent = {usage_day(today - datetime.timedelta(days=i)) for i in range(days)}
+    totals = Counter()
+    for day, entry in config_manager.get_token_usage(guild_id).items():
+        if day in recent:
+            totals.update({key: value for key, value in entry.items() if key.startswith('parse_')})
+    totals.update({key: value for key, value in TOKEN_METER.pending_counts(guild_id, usage_day(today)).items() if key.startswith('parse_')})
+    calls = totals['parse_calls']
+    if not calls:
+        return f"近 {days} 天尚未调用"
+    failed = totals['parse_json_failed'] + totals['parse_tool_failed']
+    return (f"近 {days} 天 {calls} 次，平均提示 {totals['parse_prompt_chars'] / calls:.0f} 字符，"
+            f"JSON/工具模式成功 {totals['parse_json_ok'] + totals['parse_tool_ok']} 次，解析失败 {failed} 次（{failed / calls:.1%}），"
+            f"端点不支持 {totals['parse_json_unsupported'] + totals['parse_tool_unsupported']} 次，"
+            f"回退旧方案成功 {totals['parse_parser_ok']} 次（本地修复 {totals['parse_parser_repaired']} 次）")
+
+def describe_hedging(snapshot):
+    """格式化对冲请求统计"""
+    if not snapshot['calls']:
+        return "本进程尚未调用"
+    return (f"对冲 {snapshot['hedged']}/{snapshot['calls']} 次（{snapshot['hedged'] / snapshot['calls']:.1%}），"
+            f"失败改用备用 {snapshot['fallbacks']} 次，备用胜出 {snapshot['fallback_wins']} 次，"
+            f"节省 {snapshot['saved_seconds']:.0f} 秒，超过截止时长 {snapshot['deadline_exceeded']} 次")
+
+def describe_endpoint(snapshot):
+    """格式化 LLM 接口的自适应并发与断路器状态"""
+    if snapshot is None:
+        return "本进程尚未调用"
+    state = {'closed': '正常', 'open': f"断路中（{snapshot['retry_in']:.0f} 秒后探测）", 'half_open': '探测中'}[snapshot['state']]
+    return (f"{state}，并发上限 {snapshot['limit']}（进行中 {snapshot['in_flight']}），"
+            f"延迟为基线的 {snapshot['latency_ratio']:.1f} 倍，调用 {snapshot['calls']} 次，接口故障 {snapshot['errors']} 次")
+
+@bot.tree.command(name="check_llm_stats", description="查看 LLM 分析各阶段的调用统计")
+@app_commands.check(is_allowed)
+@check_activation()
+async def check_llm_stats(interaction: discord.Interaction):
+    """
+    查看当前服务器 Ticket 级联分析各阶段的调用次数及节省的完整分析次数。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+    """
+    guild_id = str(interaction.guild.id)
+    stats = config_manager.get_stats(guild_id)
+    triage_model_id = get_triage_model_id(guild_id)
+    prefilter_config = get_prefilter_config(config_manager.get_guild_config(guild_id))
+    llm_config = get_guild_llm_config(guild_id)
+    response = (
+        f"本地预过滤模式: {prefilter_config['mode']}\n"
+        f"预过滤拦截（节省 LLM 调用）: {stats.get('prefilter_rejected', 0)}\n"
+        f"预过滤影子模式一致/不一致: {stats.get('prefilter_shadow_agree', 0)}/{stats.get('prefilter_shadow_disagree', 0)}\n"
+        f"初筛模型: {triage_model_id or '未启用'}\n"
+        f"初筛调用次数: {stats.get('triage_calls', 0)}\n"
+        f"初筛拦截（节省完整分析）: {stats.get('triage_rejected', 0)}\n"
+        f"完整分析调用次数: {stats.get('full_calls', 0)}\n"
+        f"增量更新调用次数: {stats.get('delta_calls', 0)}\n"
+        f"直接发布草稿次数: {stats.get('draft_hits', 0)}\n"
+        f"去重模式: {get_dedup_config(config_manager.get_guild_config(guild_id))['mode']}\n"
+        f"标记为重复的问题: {stats.get('duplicates', 0)}\n"
+        f"重复 Ticket 跳过分析: {stats.get('dedup_skipped', 0)}\n"
+        f"监控频道跳过的冷清周期: {stats.get('monitor_skipped', 0)}\n"
+        f"监控频道突增提前分析: {stats.get('monitor_early', 0)}\n"
+        f"预算降级改用廉价模型: {stats.get('budget_degraded', 0)}\n"
+        f"预算用尽跳过分析: {stats.get('budget_skipped', 0)}\n"
+        f"自动分析失败放弃: {stats.get('analysis_failed', 0)}\n"
+        f"监控总结失败: {stats.get('monitor_failed', 0)}\n"
+        f"结构化输出: {describe_parse_stats(guild_id)}\n"
+        f"LLM 接口状态: {describe_endpoint(llm_scheduler.endpoint_snapshot(guard_key(llm_config['base_url'], llm_config['api_key'])))}\n"
+        f"备用模型（所有服务器）: {describe_hedging(llm_scheduler.hedges.snapshot())}\n"
+        f"本进程 LLM 调度（所有服务器，排队耗时 p50/p99）: " + '；'.join(
+            f"{name} 运行 {item['running']} 排队 {item['waiting']} 等待 {item['wait_p50']:.1f}/{item['wait_p99']:.1f} 秒"
+            for name, item in llm_scheduler.snapshot().items()
+        )
+    )
+    await interaction.response.send_message(response, ephemeral=True)
+
+@bot.tree.command(name="problem_stats", description="查看问题分布统计")
+@app_commands.describe(days="统计最近多少天（默认 30，0 表示全部）")
+@app_commands.check(is_allowed)
+@check_activation()
+async def problem_stats(interaction: discord.Interaction, days: int = 30):
+    """
+    查看当前服务器的问题类型分布、每日问题数和问题来源排行，数据来自本地问题库的预聚合表。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        days (int): 统计最近多少天，0 表示全部
+    """
+    guild_id = str(interaction.guild.id)
+    timezone_offset = config_manager.get_guild_config(guild_id).get('timezone', 0)
+    days = days if days > 0 else None
+    types = await asyncio.to_thread(problem_store.type_histogram, guild_id, days, timezone_offset)
+    daily = await asyncio.to_thread(problem_store.daily_counts, guild_id, min(days or 14, 14), timezone_offset)
+    sources = await asyncio.to_thread(problem_store.top_sources, guild_id, days, 5, timezone_offset)
+    if not types:
+        await interaction.response.send_message("统计周期内没有问题记录", ephemeral=True)
+        return
+    total = sum(count for _, count in types)
+    response = (
+        f"**问题统计（{f'最近 {days} 天' if days else '全部'}，共 {total} 个）**\n"
+        "类型分布:\n" + "\n".join(f"- {name}: {count} ({count * 100 / total:.0f}%)" for name, count in types) + "\n"
+        "每日数量:\n" + "\n".join(f"- {day}: {count}" for day, count in daily) + "\n"
+        "来源排行:\n" + "\n".join(f"- {source}: {count}" for source, count in sources)
+    )
+    await interaction.response.send_message(response[:2000], ephemeral=True)
+
+@bot.tree.command(name="activity_trend", description="查看监控频道的消息量与情绪趋势")
+@app_commands.describe(channel="监控频道", freq="汇总粒度", count="显示最近多少个区间（默认 12）")
+@app_commands.choices(freq=[app_commands.Choice(name=f, value=f) for f in ROLLUP_FREQS])
+@app_commands.check(is_allowed)
+@check_activation()
+async def activity_trend(interaction: discord.Interaction, channel: discord.TextChannel, freq: app_commands.Choice[str], count: int = 12):
+    """
+    按日/周/月汇总监控频道的消息量、平均情绪、重点事件与消息量突增。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        channel (discord.TextChannel): 监控频道
+        freq (app_commands.Choice[str]): 汇总粒度（day / week / month）
+        count (int): 显示最近多少个区间
+    """
+    guild_id = str(interaction.guild.id)
+    timezone_offset = config_manager.get_guild_config(guild_id).get('timezone', 0)
+    records = await asyncio.to_thread(timeseries_store.load, guild_id, channel.id)
+    if not len(records):
+        await interaction.response.send_message(f"频道 {channel.name} 暂无监控记录", ephemeral=True)
+        return
+    spikes, _ = volume_anomalies(records)
+    trend = rollup(records, freq.value, timezone_offset, spikes)
+    lines = [f"**{channel.name} 趋势（{freq.value}）**", "区间 | 消息数 | 情绪 | 重点事件 | 突增"]
+    for i in range(max(len(trend['bucket']) - max(count, 1), 0), len(trend['bucket'])):
+        sentiment = trend['sentiment'][i]
+        label = SENTIMENT_LABELS[int(round(sentiment))]
+        lines.append(
+            f"{trend['bucket'][i]} | {trend['volume'][i]} | {label} ({sentiment:+.2f}) | "
+            f"{trend['key_events'][i]} | {'⚠️ ' if trend['spikes'][i] else ''}{trend['spikes'][i]}"
+        )
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+@bot.tree.command(name="backfill", description="回填 Bot 启动前的历史 Ticket 和监控频道")
+@app_commands.describe(
+    days="回填最近多少天（从断点恢复时沿用上次的范围）",
+    notify="是否将回填结果推送到 Telegram（默认否，只写入问题库）",
+    concurrency="最大并发分析数（默认 3）",
+    reset="丢弃未完成的进度，重新开始"
+)
+@app_commands.check(is_allowed)
+@check_activation()
+async def backfill(interaction: discord.Interaction, days: int, notify: bool = False, concurrency: int = DEFAULT_BACKFILL_CONCURRENCY, reset: bool = False):
+    """
+    在后台回填历史数据：Ticket 类别下 Bot 启动前创建的频道，以及监控频道按监控周期划分的历史窗口。
+    - 进度保存在检查点文件中，Bot 重启后再次执行即可从断点继续。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+        days (int): 回填最近多少天
+        notify (bool): 是否推送到 Telegram
+        concurrency (int): 最大并发分析数
+        reset (bool): 是否丢弃已有进度
+    """
+    guild = interaction.guild
+    guild_id = str(guild.id)
+    task = backfill_tasks.get(guild_id)
+    if task and not task.done():
+        await interaction.response.send_message("回填任务正在进行中，可使用 `/backfill_status` 查看进度", ephemeral=True)
+        return
+    config = config_manager.get_guild_config(guild_id)
+    since = bot_start_time - datetime.timedelta(days=max(days, 1))
+    progress = backfill_checkpoint.start(guild_id, since, bot_start_time, reset)
+    since = datetime.datetime.fromisoformat(progress['since'])
+    ticket_channels = []
+    for category_id in config.get('ticket_category_ids', []):
+        category = guild.get_channel(category_id)
+        if isinstance(category, discord.CategoryChannel):
+            ticket_channels += [
+                channel for channel in category.text_channels
+                if since <= channel.created_at < bot_start_time and channel.id not in ticket_creation_times
+            ]
+    monitor_channels = [channel for channel in map(guild.get_channel, config.get('monitor_channels', [])) if channel]
+    runner = BackfillRunner(
+        guild_id, backfill_checkpoint, progress,
+        lambda channel: backfill_ticket_channel(channel, guild_id, notify),
+        lambda channel, start, end: backfill_monitor_window(channel, guild_id, start, end, notify),
+        concurrency
+    )
+    backfill_tasks[guild_id] = asyncio.create_task(
+        runner.run(ticket_channels, monitor_channels, config.get('monitor_period', 2))
+    )
+    logger.info(f"用户 {interaction.user.name} 启动回填，服务器: {guild.name}，起始时间: {since}")
+    await interaction.response.send_message(
+        f"{'从断点继续' if progress['resumed'] else '开始'}回填 {since:%Y-%m-%d %H:%M} UTC 起的历史数据："
+        f"{len(ticket_channels)} 个 Ticket 频道，{len(monitor_channels)} 个监控频道，并发 {max(concurrency, 1)}",
+        ephemeral=True
+    )
+
+@bot.tree.command(name="backfill_status", description="查看历史回填进度")
+@app_commands.check(is_allowed)
+@check_activation()
+async def backfill_status(interaction: discord.Interaction):
+    """
+    查看当前服务器的历史回填进度。
+    
+    Args:
+        interaction (discord.Interaction): Discord 交互对象
+    """
+    guild_id = str(interaction.guild.id)
+    progress = backfill_checkpoint.data.get(guild_id)
+    if not progress:
+        await interaction.response.send_message("尚未进行过回填", ephemeral=True)
+        return
+    task = backfill_tasks.get(guild_id)
+    if progress['done']:
+        state = '已完成'
+    elif task and not task.done():
+        state = '进行中'
+    else:
+        state = '未完成（已中断或有单元失败，再次执行 /backfill 从断点继续）'
+    stats = progress['stats']
+    await interaction.response.send_message(
+        f"回填状态: {state}\n"
+        f"范围: {progress['since'][:16]} ~ {progress['until'][:16]} UTC\n"
+        f"Ticket 频道: {stats['tickets']}（有效问题 {stats['problems']}）\n"
+        f"监控窗口: {stats['windows']}（生成总结 {stats['summaries']}）\n"
+        f"失败: {stats['errors']}",
+        ephemeral=True
+    )
+
 @bot.tree.command(name="help", description="显示Bot命令帮助信息")
 @app_commands.check(is_allowed)
 async def help_command(interaction: discord.Interaction):
@@ -655,10 +1881,17 @@ async def help_command(interaction: discord.Interaction):
 - `/set_tg_channel tg_channel_id` 设置 Telegram 推送频道 ID  
 
 **选择性配置的命令**  
-- `/set_monitor_params period_hours max_messages` 设置监控参数
+- `/set_monitor_params period_hours max_messages sampling` 设置监控参数
+- `/set_monitor_cadence mode min_messages max_merge_periods burst_factor negative_ratio` 设置自适应监控节奏
 - `/set_access role` 设置命令权限角色
 - `/remove_access role` 移除权限角色
 - `/set_timezone offset` 设置时区偏移  
+- `/set_ticket_timing idle_minutes max_wait_minutes` 设置 Ticket 自动分析时机
+- `/set_ticket_incremental enabled` 开启或关闭 Ticket 后台增量分析
+- `/set_llm_fallback enabled` 开启或关闭备用模型（自带 LLM 密钥的服务器）
+- `/set_output_mode mode` 设置 LLM 结构化输出模式（json/tool/parser）
+- `/set_triage_model model_id` 设置 Ticket 初筛模型（off 关闭）
+- `/set_prefilter mode min_user_messages min_user_chars` 设置 Ticket 本地预过滤（off/shadow/on）
 
 **Warp_msg 权限管理（仅限管理员）**
 - `/add_warp_msg_access <role>` 增加允许使用 warp_msg 的身份组
@@ -668,22 +1901,78 @@ async def help_command(interaction: discord.Interaction):
 **其他命令**  
 - `/warp_msg` 手动分析 Ticket 频道并推送  
 - `/check_*` 查询各项配置  
+- `/check_llm_stats` 查看 LLM 分析各阶段的调用统计  
+- `/problem_stats days` 查看问题类型分布、每日数量和来源排行  
+- `/activity_trend channel freq count` 查看监控频道按日/周/月的消息量、情绪和突增趋势  
+- `/backfill days notify concurrency reset` 回填 Bot 启动前的历史 Ticket 和监控频道  
+- `/backfill_status` 查看历史回填进度  
+- `/set_dedup mode threshold skip_analysis skip_threshold` 设置重复问题检测  
+- `/set_token_budget daily_tokens degrade_at` 设置每日 LLM token 预算  
+- `/token_usage days` 查看每日 LLM token 用量  
 """
     await interaction.response.send_message(help_text, ephemeral=True)
 
+async def recover_analysis_job(job):
+    """
+    处理 Bot 重启前提交、重启后才完成的分析任务，避免已花费的 LLM 调用作废。
+    - Ticket 分析结果恢复为问题草稿（频道尚无草稿时），之后的定时分析或 /warp_msg 直接使用。
+    - 初筛判定无效的结果恢复到频道状态，无新消息时不重复初筛。
+    - 监控频道总结照常发布。
+    
+    Args:
+        job (Job): 已完成的任务
+    """
+    if job.status != STATUS_DONE:
+        return
+    payload = job.payload
+    if job.kind in (JOB_TICKET_FULL, JOB_TICKET_DELTA):
+        state = ticket_states.get(payload['channel']['id'])
+        if state.problem is None:
+            state.problem = job.result
+            state.last_message_id = payload['last_message_id']
+            logger.info(f"已恢复 Ticket 频道 {payload['channel']['name']} 重启前的分析结果作为问题草稿")
+    elif job.kind == JOB_TICKET_TRIAGE:
+        if not job.result:
+            ticket_states.get(payload['channel_id']).triage_rejected_id = payload['last_message_id']
+    elif job.kind == JOB_MONITOR_SUMMARY:
+        await telegram_bot.recover_monitor_summary(job)
+
+# 分析任务入口：设置 ANALYSIS_WORKERS 或 ANALYSIS_QUEUE 时经本地任务队列交给分析进程执行
+analysis_jobs = AnalysisDispatcher(
+    JobQueue() if ANALYSIS_QUEUE else None, owner=shard_plan.label, cipher=config_manager.cipher, recover=recover_analysis_job,
+    scheduler=llm_scheduler, fallback=get_fallback_llm_config
+)
+analysis_workers = WorkerPool(ANALYSIS_WORKERS, config_manager.encryption_key) if ANALYSIS_WORKERS > 0 else None
+
 # 创建 Telegram Bot 实例，传入默认 LLM 配置
-telegram_bot = TelegramBot(TELEGRAM_TOKEN, config_manager, bot, DEFAULT_LLM_API_KEY, DEFAULT_BASE_URL, DEFAULT_MODEL_ID)
+telegram_bot = TelegramBot(
+    TELEGRAM_TOKEN, config_manager, bot, DEFAULT_LLM_API_KEY, DEFAULT_BASE_URL, DEFAULT_MODEL_ID, problem_store, timeseries_store,
+    activity_tracker=activity_tracker,
+    default_token_budget=DEFAULT_DAILY_TOKEN_BUDGET,
+    webhook_url=TELEGRAM_WEBHOOK_URL,
+    webhook_listen=TELEGRAM_WEBHOOK_LISTEN,
+    webhook_port=TELEGRAM_WEBHOOK_PORT,
+    webhook_secret=TELEGRAM_WEBHOOK_SECRET,
+    api_base_url=TELEGRAM_API_BASE_URL,
+    receive_updates=TELEGRAM_UPDATES == 'on' or (TELEGRAM_UPDATES == 'auto' and shard_plan.is_primary),
+    owns_guild=shard_plan.owns_guild,
+    heartbeat_file=shard_plan.scoped_path('heartbeat.log'),
+    analysis_jobs=analysis_jobs
+)
 
 async def heartbeat_task():
     """
-    心跳任务，每分钟记录一次日志以确认 Bot 运行状态，使用固定 UTC+8 时区。
+    心跳任务，每分钟记录一次日志以确认 Bot 运行状态（含常驻内存），使用固定 UTC+8 时区；
+    每 MEMORY_REPORT_MINUTES 分钟在 bot.log 中记录内存与 discord.py 缓存规模。
     """
     tz = pytz.timezone('Asia/Shanghai')  # 设置时区为 UTC+8
     lasting_mins = 0
     while True:
         local_time = datetime.datetime.now(tz).strftime("%Y-%m-%d %H:%M") + " UTC+8"
         lasting_mins += 1
-        heartbeat_logger.info(f"Bot alive at {local_time}, lasting for {lasting_mins} mins")
+        heartbeat_logger.info(f"Bot alive at {local_time}, lasting for {lasting_mins} mins, RSS {rss_mb():.1f} MB")
+        if lasting_mins % MEMORY_REPORT_MINUTES == 0:
+            logger.info(f"内存（{GATEWAY_PROFILE}）: {describe_memory(bot)}")  # 定期记录内存和缓存规模，观察随服务器数的增长
         await asyncio.sleep(60)  # 每 60 秒记录一次
 
 async def main():
@@ -693,12 +1982,23 @@ async def main():
     logger.info(f"启动 Discord Bot，Token: {DISCORD_TOKEN[:5]}...")
     logger.info(f"启动 Telegram Bot，Token: {TELEGRAM_TOKEN[:5]}...")
     logger.info(f"激活密钥配置: {MY_ACTIVE_KEY[:5]}...（已隐藏后缀）")  # 仅记录密钥前5位
+    if shard_plan.auto:
+        logger.info(f"分片模式: 共 {shard_plan.shard_count or '自动'} 个分片，本进程负责 {shard_plan.shard_ids or '全部'}")
     
-    # 在事件循环运行后保存初始配置（如果有新生成的 encryption_key）
-    await config_manager.save_config()
-    logger.info("初始配置已保存至 config.json")
+    if config_manager.store is None:
+        # 在事件循环运行后保存初始配置（如果有新生成的 encryption_key）；共享配置库在初始化时已写入
+        await config_manager.save_config()
+        logger.info("初始配置已保存至 config.json")
+    else:
+        asyncio.create_task(config_sync_task())
     
     asyncio.create_task(heartbeat_task())
+    asyncio.create_task(token_usage_flush_task())
+    if analysis_jobs.queue is not None:
+        asyncio.create_task(analysis_jobs.poll())
+    if analysis_workers:
+        analysis_workers.start()
+        asyncio.create_task(analysis_workers.supervise())
     
     # 独立运行 Telegram Bot
     telegram_task = asyncio.create_task(telegram_bot.run())
@@ -711,6 +2011,14 @@ async def main():
         telegram_task.cancel()  # 如果 Discord 失败，取消 Telegram 任务
         raise
     finally:
+        usage = TOKEN_METER.drain()
+        if usage:
+            await config_manager.add_token_usage(usage)  # 保存尚未合并的 token 用量
+        await config_manager.flush_stats()
+        if event_recorder:
+            event_recorder.close()  # 写入尚未落盘的录制事件
+        if analysis_workers:
+            analysis_workers.stop()
         await telegram_task  # 确保 Telegram 任务完成
 
 if __name__ == "__main__":
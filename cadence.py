@@ -0,0 +1,230 @@
+import re
+import asyncio
+import logging
+import datetime
+
+logger = logging.getLogger(__name__)
+
+# 监控节奏模式：fixed 按固定周期分析全部监控频道；adaptive 根据频道消息量跳过冷清周期、在突增时提前分析
+CADENCE_MODES = ('fixed', 'adaptive')
+
+# 默认参数，可通过服务器配置 monitor_cadence 覆盖
+DEFAULT_CADENCE_CONFIG = {
+    'mode': 'adaptive',
+    'min_messages': 5,  # 周期内消息数低于该值时跳过本周期，并入下一周期一起分析
+    'max_merge_periods': 4,  # 最多合并的周期数，达到后即使消息较少也进行分析
+    'burst_factor': 3.0,  # 距上次分析的消息数达到该频道平时一个周期消息量的倍数时提前分析
+    'burst_messages': 50,  # 提前分析的消息数下限，避免冷清频道几条消息就触发
+    'negative_min': 10,  # 负面关键词消息数达到该值、且占比达到 negative_ratio 时提前分析
+    'negative_ratio': 0.15,
+    'min_interval_minutes': 15,  # 两次分析的最短间隔，避免持续刷屏时频繁调用 LLM
+}
+
+MAX_CHECK_INTERVAL = 600  # 调度循环最长休眠时间（秒），保证配置变更和新增频道能及时生效
+
+# 事件类负面关键词：被盗、诈骗、宕机等，命中率突增通常意味着需要尽快关注的事件。
+# 只收录指向安全事件或资金损失的词和短语；down、lost、stuck、无法、失败等单词在日常聊天中很常见（"calm down"、"无法理解"），
+# 只在与站点、资金、提现等对象组成短语时计入
+NEGATIVE_KEYWORDS = (
+    'scam', 'scammer', 'hacked', 'exploit', 'exploited', 'rug', 'rugged', 'rug pull', 'stolen', 'drained', 'phishing',
+    'site down', 'site is down', 'app is down', 'website down', 'is down again', 'lost funds', 'lost my funds',
+    'funds stuck', 'withdrawal stuck', 'withdrawals stuck', 'withdrawal failed', 'refund',
+    '被盗', '盗号', '诈骗', '骗子', '跑路', '崩了', '宕机', '无法提现', '无法登录', '无法访问', '提现失败', '交易失败',
+    '资产丢失', '资金丢失', '币丢了', '退款', '归零', '割韭菜', '钓鱼',
+)
+NEGATIVE_RE = re.compile(
+    r'\b(?:' + '|'.join(re.escape(k).replace(r'\ ', r'\s+') for k in NEGATIVE_KEYWORDS if k.isascii()) + r')\b|'
+    + '|'.join(re.escape(k) for k in NEGATIVE_KEYWORDS if not k.isascii()),
+    re.IGNORECASE
+)
+
+# 调度决策
+ANALYZE = 'analyze'  # 到期分析
+EARLY = 'early'  # 消息量或负面关键词突增，提前分析
+SKIP = 'skip'  # 冷清周期，并入下一周期
+WAIT = 'wait'  # 未到期
+HOLD = 'hold'  # 到期但暂缓分析（如 token 预算用尽），窗口保留并入下一周期
+
+def get_cadence_config(config):
+    """合并服务器配置与默认监控节奏参数
+    参数:
+        config: 服务器配置
+    返回:
+        dict: 完整的监控节奏配置
+    """
+    return {**DEFAULT_CADENCE_CONFIG, **config.get('monitor_cadence', {})}
+
+class ChannelActivity:
+    """单个监控频道自上次分析以来的消息计数"""
+    __slots__ = ('window_start', 'periods', 'count', 'negative', 'known', 'last_analysis', 'baseline', 'trigger', 'notified')
+
+    def __init__(self, window_start):
+        self.window_start = window_start  # 当前未分析窗口的起点
+        self.periods = 1  # 当前窗口包含的周期数（冷清周期合并后增加）
+        self.count = 0  # 窗口内消息数
+        self.negative = 0  # 窗口内命中负面关键词的消息数
+        self.known = False  # 计数是否覆盖整个窗口（Bot 启动后的第一个窗口包含启动前的消息，计数不完整）
+        self.last_analysis = None  # 上次分析时间
+        self.baseline = None  # 平时的消息速率（条/小时，指数滑动平均），突增窗口不计入
+        self.trigger = None  # 提前分析阈值 (消息数阈值, negative_min, negative_ratio)，fixed 模式为 None
+        self.notified = False  # 本窗口是否已唤醒过调度循环
+
+    def triggered(self):
+        """消息量或负面关键词是否达到提前分析阈值"""
+        if self.trigger is None:
+            return False
+        burst_threshold, negative_min, negative_ratio = self.trigger
+        if burst_threshold is not None and self.count >= burst_threshold:
+            return True
+        return self.negative >= negative_min and self.negative >= self.count * negative_ratio
+
+    def reset(self, now):
+        """开始新窗口"""
+        self.window_start = now
+        self.periods = 1
+        self.count = 0
+        self.negative = 0
+        self.known = True
+        self.notified = False
+
+    def update_baseline(self, now):
+        """用刚结束的完整窗口更新平时消息速率"""
+        hours = (now - self.window_start).total_seconds() / 3600
+        if self.known and hours > 0:
+            rate = self.count / hours
+            self.baseline = rate if self.baseline is None else 0.7 * self.baseline + 0.3 * rate
+
+class ActivityTracker:
+    """
+    监控频道的活动计数与自适应调度。
+    - on_message 对监控频道只做计数和一次正则匹配，达到提前分析阈值时唤醒调度循环。
+    - 调度循环按频道调用 decide() 决定分析、提前分析、跳过或等待，并据此计算下次唤醒时间。
+    """
+    def __init__(self):
+        self.channels = {}  # 频道 ID -> ChannelActivity
+        self.wakeup = asyncio.Event()
+
+    def record(self, channel_id, content):
+        """
+        记录监控频道的一条新消息。
+
+        Args:
+            channel_id (int): 监控频道 ID
+            content (str): 消息内容
+        """
+        activity = self.channels.get(channel_id)
+        if activity is None:
+            return  # 调度循环尚未处理该频道，首个窗口按完整回溯分析
+        activity.count += 1
+        if content and NEGATIVE_RE.search(content):
+            activity.negative += 1
+        if not activity.notified and activity.triggered():
+            activity.notified = True
+            self.wakeup.set()
+
+    def decide(self, channel_id, now, period_s, cadence, hold=False):
+        """
+        决定频道本轮的调度动作。决定分析时立即开始新窗口，分析期间到达的消息计入下一窗口。
+
+        Args:
+            channel_id (int): 监控频道 ID
+            now (datetime): 当前时间（UTC）
+            period_s (int): 监控周期（秒）
+            cadence (dict): get_cadence_config() 返回的配置
+            hold (bool): 暂不分析（如 token 预算用尽）：到期的窗口不重置而是并入下一周期，也不提前分析
+
+        Returns:
+            tuple: (动作, 窗口起点, 窗口内消息数（计数不完整时为 None）, 距下次需要检查的秒数)
+        """
+        activity = self.channels.get(channel_id)
+        if activity is None:
+            activity = self.channels[channel_id] = ChannelActivity(now - datetime.timedelta(seconds=period_s))
+        adaptive = cadence['mode'] == 'adaptive'
+        activity.trigger = None
+        if adaptive:
+            # 消息量阈值相对于频道平时的活跃度：平时每周期 500 条的频道与每周期 5 条的频道分别判断；尚无基线时只按负面关键词触发
+            burst_threshold = None
+            if activity.baseline is not None:
+                burst_threshold = max(cadence['burst_messages'], cadence['burst_factor'] * activity.baseline * period_s / 3600)
+            activity.trigger = (burst_threshold, cadence['negative_min'], cadence['negative_ratio'])
+        start, count = activity.window_start, activity.count if activity.known else None
+        elapsed = (now - start).total_seconds()
+        if elapsed >= activity.periods * period_s:
+            if hold:
+                activity.periods += 1  # 窗口内的消息保留到恢复分析后一起分析
+                return HOLD, start, count, activity.periods * period_s - elapsed
+            if adaptive and activity.known and activity.count < cadence['min_messages']:
+                if activity.count == 0:
+                    activity.update_baseline(now)
+                    activity.reset(now)  # 窗口内没有消息，直接开始新窗口
+                elif activity.periods < cadence['max_merge_periods']:
+                    activity.periods += 1  # 并入下一周期，窗口起点不变
+                else:
+                    return self.start_analysis(activity, now, ANALYZE, start, count, period_s)
+                return SKIP, start, count, activity.periods * period_s - (now - activity.window_start).total_seconds()
+            return self.start_analysis(activity, now, ANALYZE, start, count, period_s)
+        wait = activity.periods * period_s - elapsed
+        if activity.triggered() and not hold:
+            cooldown = cadence['min_interval_minutes'] * 60 - (now - (activity.last_analysis or start)).total_seconds()
+            if cooldown <= 0:
+                return self.start_analysis(activity, now, EARLY, start, count, period_s)
+            wait = min(wait, cooldown)
+        return WAIT, start, count, wait
+
+    def start_analysis(self, activity, now, action, start, count, period_s):
+        """记录分析时间并开始新窗口"""
+        activity.last_analysis = now
+        if action == ANALYZE:
+            activity.update_baseline(now)
+        activity.reset(now)
+        return action, start, count, period_s
+
+    async def wait(self, timeout):
+        """休眠到下次检查时间，或被突增的频道提前唤醒"""
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), min(max(timeout, 1), MAX_CHECK_INTERVAL))
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+def bench(days=7, period_hours=2, seed=0):
+    """
+    模拟一周内 5 个活跃度不同的频道（含一次突发事件），对比固定周期与自适应调度的 LLM 调用次数和事件发现延迟。
+    """
+    import random
+
+    random.seed(seed)
+    period_s = period_hours * 3600
+    base = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    rates = {1: 0.0, 2: 0.5, 3: 3.0, 4: 60.0, 5: 400.0}  # 每小时消息数：无人、冷清、较少、活跃、非常活跃
+    incident_at = base + datetime.timedelta(days=3, hours=5, minutes=7)  # 频道 3 在此时刻出现被盗事件
+    for mode in CADENCE_MODES:
+        cadence = {**DEFAULT_CADENCE_CONFIG, 'mode': mode}
+        tracker = ActivityTracker()
+        calls = skips = 0
+        detected = None
+        now = base
+        next_check = {channel_id: now for channel_id in rates}
+        while now < base + datetime.timedelta(days=days):
+            for channel_id, rate in rates.items():
+                in_incident = channel_id == 3 and incident_at <= now < incident_at + datetime.timedelta(hours=1)
+                for _ in range(int(rate / 60) + (random.random() < rate / 60 % 1)):
+                    tracker.record(channel_id, 'gm')
+                if in_incident:
+                    for _ in range(3):
+                        tracker.record(channel_id, 'my wallet got drained, is this a scam?')
+                if tracker.wakeup.is_set() or now >= next_check[channel_id]:
+                    action, _, _, wait = tracker.decide(channel_id, now, period_s, cadence)
+                    if action in (ANALYZE, EARLY):
+                        calls += 1
+                        if channel_id == 3 and detected is None and now >= incident_at:
+                            detected = now
+                    skips += action == SKIP
+                    next_check[channel_id] = now + datetime.timedelta(seconds=min(max(wait, 1), MAX_CHECK_INTERVAL))
+            tracker.wakeup.clear()
+            now += datetime.timedelta(minutes=1)
+        latency = (detected - incident_at).total_seconds() / 60 if detected else float('nan')
+        print(f"{mode}: LLM 调用 {calls} 次，跳过冷清周期 {skips} 次，事件发现延迟 {latency:.0f} 分钟")
+
+if __name__ == "__main__":
+    bench()
@@ -1,36 +1,206 @@
 import asyncio
 import json
 import os
+import uuid
+import sqlite3
+import threading
 from cryptography.fernet import Fernet  # 用于对称加密和解密 API key
 
 # 配置文件路径常量
 CONFIG_FILE = 'config.json'
+# 多进程部署时的共享配置库（CONFIG_STORE=sqlite）
+CONFIG_DB_FILE = 'config.db'
+# 共享配置库中其他进程写入的变化多久加载一次（秒）
+CONFIG_SYNC_SECONDS = 5
+# 按日保存的 LLM token 用量保留天数
+TOKEN_USAGE_DAYS = 31
 # 异步锁，用于确保并发写入配置文件时的线程安全
 config_lock = asyncio.Lock()
 
+def guild_key(guild_id):
+    """服务器配置在共享配置库中的行键"""
+    return f"guild:{guild_id}"
+
+class SharedConfigStore:
+    """
+    多进程共享的配置库（SQLite WAL），供分片部署的多个 Bot 进程共用。
+    - 配置按行保存：每个服务器一行，其余顶层键各一行；保存时只写入变化的行，进程之间不会整体覆盖。
+      服务器的事件只会发往其所在分片的进程，因此每个服务器行只由一个进程写入。
+    - 问题 ID 计数器在数据库中原子自增，多个进程分配的 ID 不会重复。
+    - 每次写入分配全局递增的修订号，其他进程按修订号增量加载变化的行。
+    """
+    def __init__(self, path=CONFIG_DB_FILE):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL, rev INTEGER NOT NULL, writer TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.lock = threading.Lock()  # 连接在事件循环线程和工作线程之间共用
+        self.writer = uuid.uuid4().hex  # 本进程的写入者标识，加载变化时跳过自己写入的行
+        self.rev = 0  # 已加载的最大修订号
+
+    def load(self, default, json_path=CONFIG_FILE):
+        """
+        加载全部配置。配置库为空时先导入 JSON 配置文件（不存在时使用默认配置），只有一个进程会执行导入。
+
+        Args:
+            default (dict): 默认配置
+            json_path (str): 待导入的 JSON 配置文件
+
+        Returns:
+            dict: 完整配置，结构与 config.json 相同
+        """
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self.conn.execute('SELECT COUNT(*) FROM config').fetchone()[0] == 0:
+                    config = default
+                    if os.path.exists(json_path):
+                        with open(json_path, 'r') as f:
+                            config = json.load(f)
+                    self.conn.execute('INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)',
+                                      ('problem_id', config.get('problem_id_counter', 0)))
+                    self.write_rows(self.rows(config))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            config = {'guilds': {}}
+            for key, value, rev in self.conn.execute('SELECT key, value, rev FROM config'):
+                self.apply(config, key, json.loads(value))
+                self.rev = max(self.rev, rev)
+            config['problem_id_counter'] = self.counter('problem_id')
+        return config
+
+    @staticmethod
+    def rows(config, keys=None):
+        """
+        将配置序列化为行。
+
+        Args:
+            config (dict): 完整配置
+            keys (list): 只序列化这些行键，None 表示全部
+
+        Returns:
+            dict: 行键 -> JSON 文本
+        """
+        if keys is None:
+            keys = [guild_key(guild_id) for guild_id in config.get('guilds', {})]
+            keys += [key for key in config if key not in ('guilds', 'problem_id_counter')]
+        rows = {}
+        for key in keys:
+            if key.startswith('guild:'):
+                value = config.get('guilds', {}).get(key[len('guild:'):], {})
+            else:
+                value = config.get(key)
+            rows[key] = json.dumps(value)
+        return rows
+
+    @staticmethod
+    def apply(config, key, value):
+        """将一行写回配置字典"""
+        if key.startswith('guild:'):
+            config.setdefault('guilds', {})[key[len('guild:'):]] = value
+        else:
+            config[key] = value
+
+    def write_rows(self, rows):
+        rev = self.conn.execute(
+            "INSERT INTO counters (name, value) VALUES ('config_rev', 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1 RETURNING value"
+        ).fetchone()[0]
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO config (key, value, rev, writer) VALUES (?, ?, ?, ?)',
+            [(key, value, rev, self.writer) for key, value in rows.items()]
+        )
+
+    def save(self, rows):
+        """在一个事务中写入若干行（在工作线程中调用）"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.write_rows(rows)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def changes(self):
+        """
+        读取其他进程在上次加载之后写入的行（在工作线程中调用）。
+
+        Returns:
+            dict: 行键 -> 值
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT key, value, rev, writer FROM config WHERE rev > ?', (self.rev,)).fetchall()
+        changes = {}
+        for key, value, rev, writer in rows:
+            self.rev = max(self.rev, rev)
+            if writer != self.writer:
+                changes[key] = json.loads(value)
+        return changes
+
+    def counter(self, name):
+        row = self.conn.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def increment(self, name):
+        """原子自增计数器并返回新值（在工作线程中调用）"""
+        with self.lock:
+            return self.conn.execute(
+                'INSERT INTO counters (name, value) VALUES (?, 1) '
+                'ON CONFLICT(name) DO UPDATE SET value = value + 1 RETURNING value', (name,)
+            ).fetchone()[0]
+
+    def get(self, key):
+        """读取一个顶层键的值，不存在时返回 None"""
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM config WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def setdefault(self, key, value):
+        """行不存在时写入 value，返回库中的值；多个进程同时启动时只有一个进程的值生效"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT value FROM config WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    self.write_rows({key: json.dumps(value)})
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return json.loads(row[0]) if row else value
+
 class ConfigManager:
-    def __init__(self):
+    def __init__(self, shared_store=None):
         """
         初始化配置管理器，加载配置并设置加密密钥。
         - 如果配置文件不存在，则创建默认配置。
         - 生成或加载用于加密 API key 的密钥，但不立即保存（留给调用者处理）。
+        - 传入 shared_store 时配置保存在多进程共享的配置库中（首次使用时自动导入 config.json）。
+        
+        Args:
+            shared_store (SharedConfigStore): 可选的共享配置库
         """
-        self.config = self.load_config()  # 同步加载配置
+        self.store = shared_store
+        self.config = self.store.load(self.default_config()) if self.store else self.load_config()  # 同步加载配置
+        self.config_version = 0  # 配置版本号，服务器配置变化时递增，供路由索引判断是否需要重建
         self.problem_id_counter = self.config.get('problem_id_counter', 0)
+        self.pending_stats = {}  # 服务器 ID -> {统计项: 计数}，尚未合并到配置的分析统计，由 flush_stats 定期合并
         # 获取或生成加密密钥
         self.encryption_key = self.config.get('encryption_key')
         if not self.encryption_key:
             # 生成新密钥，但不异步保存
             self.encryption_key = Fernet.generate_key().decode()
+            if self.store:
+                self.encryption_key = self.store.setdefault('encryption_key', self.encryption_key)  # 所有进程共用同一密钥
             self.config['encryption_key'] = self.encryption_key
             # 注意：这里不再调用 save_config，留给外部异步上下文处理
         self.cipher = Fernet(self.encryption_key.encode())
 
-    def load_config(self):
-        """从文件加载配置，若不存在则返回默认配置"""
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
+    @staticmethod
+    def default_config():
         return {
             'telegram_users': {},
             'guilds': {},
@@ -38,12 +208,44 @@ class ConfigManager:
             'is_activated': False
         }
 
-    async def save_config(self):
-        """异步保存配置到文件，使用锁防止并发写入冲突"""
+    def load_config(self):
+        """从文件加载配置，若不存在则返回默认配置"""
+        if os.path.exists(CONFIG_FILE):
+            with open(CONFIG_FILE, 'r') as f:
+                return json.load(f)
+        return self.default_config()
+
+    async def save_config(self, keys=None):
+        """
+        异步保存配置，使用锁防止并发写入冲突。
+        
+        Args:
+            keys (list): 共享配置库中需要写入的行键（guild_key() 或顶层键），None 表示全部；写 JSON 文件时忽略
+        """
+        if self.store:
+            rows = self.store.rows(self.config, keys)  # 在事件循环中序列化，写入时配置可能已被修改
+            await asyncio.to_thread(self.store.save, rows)
+            return
         async with config_lock:
             with open(CONFIG_FILE, 'w') as f:
                 json.dump(self.config, f, indent=4)
 
+    async def sync(self):
+        """
+        加载其他进程写入共享配置库的变化（未使用共享配置库时不做任何事）。
+        
+        Returns:
+            int: 变化的行数
+        """
+        if not self.store:
+            return 0
+        changes = await asyncio.to_thread(self.store.changes)
+        for key, value in changes.items():
+            self.store.apply(self.config, key, value)
+        if changes:
+            self.config_version += 1
+        return len(changes)
+
     def get_guild_config(self, guild_id):
         """
         获取指定 Discord 服务器的配置。
@@ -72,7 +274,8 @@ class ConfigManager:
             raise ValueError("时区偏移量必须为整数")  # 验证时区值合法性
         # 确保 guilds 和 guild_id 的字典存在，然后设置 key-value
         self.config.setdefault('guilds', {}).setdefault(guild_id, {})[key] = value
-        await self.save_config()  # 保存更新后的配置
+        self.config_version += 1
+        await self.save_config([guild_key(guild_id)])  # 保存更新后的配置
 
     async def get_next_problem_id(self):
         """
@@ -81,6 +284,10 @@ class ConfigManager:
         Returns:
             int: 新生成的问题 ID
         """
+        if self.store:
+            self.problem_id_counter = await asyncio.to_thread(self.store.increment, 'problem_id')  # 多进程共用的原子计数器
+            self.config['problem_id_counter'] = self.problem_id_counter
+            return self.problem_id_counter
         self.problem_id_counter += 1  # 自增计数器
         self.config['problem_id_counter'] = self.problem_id_counter  # 更新配置中的计数器
         await self.save_config()  # 保存更新
@@ -108,7 +315,7 @@ class ConfigManager:
         """
         if key == master_key and not self.is_bot_activated():
             self.config['is_activated'] = True  # 设置激活状态
-            await self.save_config()  # 保存配置
+            await self.save_config(['is_activated'])  # 保存配置
             return True
         return False
 
@@ -137,7 +344,8 @@ class ConfigManager:
         # 如果 Bot 未激活，则激活它
         if not self.config.get('is_activated', False):
             self.config['is_activated'] = True
-        await self.save_config()  # 保存更新后的配置
+        self.config_version += 1
+        await self.save_config([guild_key(guild_id), 'is_activated'])  # 保存更新后的配置
 
     def get_llm_config(self, guild_id):
         """
@@ -172,4 +380,105 @@ class ConfigManager:
         Returns:
             list: 允许的角色 ID 列表，若无则返回空列表
         """
-        return self.get_guild_config(guild_id).get('warp_msg_allowed_roles', [])
\ No newline at end of file
+        return self.get_guild_config(guild_id).get('warp_msg_allowed_roles', [])
+
+    def increment_stat(self, guild_id, key, amount=1):
+        """
+        累加指定服务器的分析统计计数（如初筛调用次数、节省的完整分析次数）。
+        只在内存中累加，由 flush_stats 随 token 用量每分钟合并保存，避免每次计数都重写配置文件。
+        
+        Args:
+            guild_id (str): Discord 服务器 ID
+            key (str): 统计项名称
+            amount (int): 累加值，默认 1
+        """
+        stats = self.pending_stats.setdefault(guild_id, {})
+        stats[key] = stats.get(key, 0) + amount
+
+    async def flush_stats(self):
+        """将内存中累加的分析统计合并到各服务器配置并保存"""
+        pending, self.pending_stats = self.pending_stats, {}
+        if not pending:
+            return
+        for guild_id, counts in pending.items():
+            stats = self.config.setdefault('guilds', {}).setdefault(guild_id, {}).setdefault('analysis_stats', {})
+            for key, value in counts.items():
+                stats[key] = stats.get(key, 0) + value
+        await self.save_config([guild_key(guild_id) for guild_id in pending])
+
+    def get_stats(self, guild_id):
+        """
+        获取指定服务器的分析统计计数（包含尚未合并保存的计数）。
+        
+        Args:
+            guild_id (str): Discord 服务器 ID
+        
+        Returns:
+            dict: 统计项名称到计数的映射，若无则返回空字典
+        """
+        stats = dict(self.get_guild_config(guild_id).get('analysis_stats', {}))
+        for key, value in self.pending_stats.get(guild_id, {}).items():
+            stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def get_command_fingerprint(self, scope):
+        """
+        获取上次同步斜杠命令时记录的命令树指纹。
+        
+        Args:
+            scope (str): 同步范围（应用 ID 加 global 或服务器 ID）
+        
+        Returns:
+            str: 指纹，若从未同步则返回 None
+        """
+        return self.config.get('command_fingerprints', {}).get(scope)
+
+    def get_command_scopes(self):
+        """
+        获取所有记录过斜杠命令指纹的同步范围。
+        
+        Returns:
+            list: 同步范围列表
+        """
+        return list(self.config.get('command_fingerprints', {}))
+
+    async def set_command_fingerprint(self, scope, fingerprint):
+        """
+        记录斜杠命令同步成功后的命令树指纹并保存。
+        
+        Args:
+            scope (str): 同步范围（应用 ID 加 global 或服务器 ID）
+            fingerprint (str): 命令树指纹
+        """
+        self.config.setdefault('command_fingerprints', {})[scope] = fingerprint
+        await self.save_config(['command_fingerprints'])
+
+    async def add_token_usage(self, usage):
+        """
+        将一批 LLM token 用量合并到各服务器的按日统计中并保存，每个服务器只保留最近 TOKEN_USAGE_DAYS 天。
+        
+        Args:
+            usage (dict): {(服务器 ID, 日期): {'prompt', 'completion', 'calls', 'estimated'}}
+        """
+        for (guild_id, day), counts in usage.items():
+            days = self.config.setdefault('guilds', {}).setdefault(guild_id, {}).setdefault('token_usage', {})
+            entry = days.setdefault(day, {})
+            for key, value in counts.items():
+                entry[key] = entry.get(key, 0) + value
+            for old_day in sorted(days)[:-TOKEN_USAGE_DAYS]:
+                del days[old_day]
+        await self.save_config([guild_key(guild_id) for guild_id in {guild_id for guild_id, _ in usage}])
+
+    def get_token_usage(self, guild_id, day=None):
+        """
+        获取指定服务器的 LLM token 用量。
+        
+        Args:
+            guild_id (str): Discord 服务器 ID
+            day (str): 可选，日期（YYYY-MM-DD，UTC）
+        
+        Returns:
+            dict: 指定日期的用量；未指定日期时返回 {日期: 用量}
+        """
+        days = self.get_guild_config(guild_id).get('token_usage', {})
+        return days.get(day, {}) if day else days
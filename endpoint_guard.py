@@ -0,0 +1,150 @@
+import time
+import hashlib
+import logging
+from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+
+logger = logging.getLogger(__name__)
+
+# 接口故障：限流、超时、连接失败和 5xx；LLM 输出无法解析等错误不计入
+ENDPOINT_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+INITIAL_LIMIT = 4  # 每个接口的初始并发上限
+MIN_LIMIT = 1
+MAX_LIMIT = 16
+DECREASE_FACTOR = 0.5  # 限流或延迟升高时并发上限乘以该系数
+LATENCY_TOLERANCE = 2.0  # 平滑延迟超过基线的该倍数时视为接口过载
+LATENCY_ALPHA = 0.2  # 延迟指数平滑系数
+BASELINE_DRIFT = 0.01  # 基线延迟每次调用允许上浮的比例，接口整体变慢后基线逐渐跟上
+FAILURE_THRESHOLD = 5  # 连续失败多少次后断路
+OPEN_SECONDS = (30, 120, 600)  # 断路时长，半开探测失败后逐级增加
+
+# 断路器状态：closed 正常；open 断路，直接失败；half_open 断路时长已过，放行一次探测调用
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(RuntimeError):
+    """接口处于断路状态，调用未发出"""
+    def __init__(self, endpoint, retry_at):
+        super().__init__(f"LLM 接口 {endpoint} 暂时不可用，{max(retry_at - time.monotonic(), 0):.0f} 秒后重试")
+        self.endpoint = endpoint
+        self.retry_at = retry_at  # time.monotonic() 时间
+
+class EndpointGuard:
+    """
+    单个 LLM 接口（base_url）的自适应并发与断路器，只在一个线程（事件循环或分析进程主循环）中使用。
+    - AIMD：调用成功且延迟正常时并发上限每轮加 1，遇到限流或平滑延迟超过基线 LATENCY_TOLERANCE 倍时减半；
+      延迟按调用类型分别统计，初筛与完整分析的耗时差异不会被误判为过载。
+    - 断路器：连续 FAILURE_THRESHOLD 次接口故障后断路，期间调用直接失败；断路时长过后放行一次探测，
+      成功则恢复，失败则以更长的时长再次断路。
+    """
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.limit = float(INITIAL_LIMIT)
+        self.in_flight = 0
+        self.latency = {}  # 调用类型 -> 平滑延迟（秒）
+        self.baseline = {}  # 调用类型 -> 基线延迟（秒），取平滑延迟的历史低点并缓慢上浮
+        self.state = CLOSED
+        self.failures = 0  # 连续接口故障次数
+        self.trips = 0  # 连续断路次数，决定断路时长
+        self.retry_at = 0.0  # 断路结束时间（time.monotonic()）
+        self.calls = 0
+        self.errors = 0
+
+    def check(self):
+        """调用前检查断路器，断路中抛出 CircuitOpenError；断路时长已过时进入半开状态"""
+        if self.state == OPEN:
+            if time.monotonic() < self.retry_at:
+                raise CircuitOpenError(self.endpoint, self.retry_at)
+            self.state = HALF_OPEN
+            logger.info(f"LLM 接口 {self.endpoint} 断路时长已过，放行一次探测调用")
+
+    def can_start(self):
+        """当前能否再发出一次调用：半开状态只允许一个探测调用"""
+        if self.state == HALF_OPEN:
+            return self.in_flight == 0
+        return self.state == CLOSED and self.in_flight < int(self.limit)
+
+    def on_start(self):
+        self.in_flight += 1
+        self.calls += 1
+
+    def on_finish(self, elapsed, error=None, kind=None):
+        """
+        记录一次调用的结果，更新并发上限和断路器。
+
+        Args:
+            elapsed (float): 调用耗时（秒）
+            error (Exception): 调用抛出的异常，成功时为 None
+            kind (str): 调用类型，延迟按类型分别统计
+        """
+        self.in_flight -= 1
+        if error is not None and not isinstance(error, ENDPOINT_ERRORS):
+            return  # 输出解析失败等与接口健康无关
+        if error is not None:
+            self.errors += 1
+            self.failures += 1
+            if isinstance(error, RateLimitError):
+                self.decrease('限流')
+            if self.state == HALF_OPEN or self.failures >= FAILURE_THRESHOLD:
+                self.trip()
+            return
+        self.failures = 0
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self.trips = 0
+            self.limit = float(INITIAL_LIMIT)
+            logger.info(f"LLM 接口 {self.endpoint} 探测成功，恢复正常")
+        latency = self.latency[kind] = (1 - LATENCY_ALPHA) * self.latency.get(kind, elapsed) + LATENCY_ALPHA * elapsed
+        baseline = self.baseline[kind] = min(latency, self.baseline.get(kind, latency) * (1 + BASELINE_DRIFT))
+        if latency > baseline * LATENCY_TOLERANCE:
+            self.decrease('延迟升高')
+            self.latency[kind] = baseline * LATENCY_TOLERANCE  # 本轮已退让，避免连续减半
+        else:
+            self.limit = min(self.limit + 1 / self.limit, MAX_LIMIT)  # 每轮（limit 次成功）加 1
+
+    def decrease(self, reason):
+        old = int(self.limit)
+        self.limit = max(self.limit * DECREASE_FACTOR, MIN_LIMIT)
+        if int(self.limit) != old:
+            logger.warning(f"LLM 接口 {self.endpoint} {reason}，并发上限 {old} -> {int(self.limit)}")
+
+    def trip(self):
+        """断路"""
+        open_seconds = OPEN_SECONDS[min(self.trips, len(OPEN_SECONDS) - 1)]
+        self.state = OPEN
+        self.trips += 1
+        self.failures = 0
+        self.retry_at = time.monotonic() + open_seconds
+        logger.error(f"LLM 接口 {self.endpoint} 连续故障，断路 {open_seconds} 秒")
+
+    def snapshot(self):
+        """接口状态，供统计命令展示"""
+        return {
+            'state': self.state, 'limit': int(self.limit), 'in_flight': self.in_flight,
+            'latency_ratio': max((self.latency[kind] / self.baseline[kind] for kind in self.latency if self.baseline[kind]), default=1.0),
+            'calls': self.calls, 'errors': self.errors,
+            'retry_in': max(self.retry_at - time.monotonic(), 0.0) if self.state == OPEN else 0.0,
+        }
+
+def guard_key(base_url, api_key):
+    """
+    接口保护器的键：base_url 加 API 密钥摘要。限流和配额按密钥计算，
+    共用同一 base_url（如官方接口）的不同密钥各自独立，一个服务器的密钥被限流不会让其他服务器断路。
+
+    Returns:
+        tuple: (base_url, 密钥 SHA-256 的前 8 位十六进制)
+    """
+    return base_url, hashlib.sha256((api_key or '').encode()).hexdigest()[:8]
+
+class EndpointRegistry:
+    """按 guard_key() 懒创建 EndpointGuard，服务器通过 /activate_llm 配置的接口和密钥各自独立"""
+    def __init__(self):
+        self.guards = {}
+
+    def get(self, key):
+        guard = self.guards.get(key)
+        if guard is None:
+            base_url, digest = key
+            guard = self.guards[key] = EndpointGuard(f"{base_url}（密钥 {digest}）")
+        return guard
@@ -0,0 +1,161 @@
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from problem_store import ProblemStore, PROBLEM_DB_FILE, EXPORT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# 支持的导出格式；parquet 需要额外安装 pyarrow
+EXPORT_FORMATS = ('jsonl', 'csv', 'parquet')
+EXPORT_EXTENSIONS = {'jsonl': '.jsonl.gz', 'csv': '.csv.gz', 'parquet': '.parquet'}
+
+class JsonlWriter:
+    """gzip 压缩的 JSON Lines 写入器，每行一个对象"""
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+
+    def write(self, rows):
+        self.file.writelines(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False) + '\n' for row in rows)
+
+    def close(self):
+        self.file.close()
+
+class CsvWriter:
+    """gzip 压缩的 CSV 写入器，首行为列名"""
+    def __init__(self, path, columns):
+        self.file = gzip.open(path, 'wt', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    """Parquet 写入器，每个分块写为一个 row group"""
+    def __init__(self, path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("导出 Parquet 需要安装 pyarrow（pip install pyarrow），或改用 jsonl/csv 格式")
+        self.pa = pa
+        self.columns = columns
+        self.writer = None
+        self.path = path
+        self.pq = pq
+
+    def write(self, rows):
+        table = self.pa.Table.from_pydict({name: [row[i] for row in rows] for i, name in enumerate(self.columns)})
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema, compression='zstd')
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+WRITERS = {'jsonl': JsonlWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+
+def watermark_name(table, fmt, guild_id):
+    """增量导出水位的键，按表、格式和服务器区分"""
+    return f"{table}:{fmt}:{guild_id or '*'}"
+
+def export_table(store, table, fmt, out_dir, guild_id=None, since=None, until=None, incremental=False, chunk_size=5000):
+    """
+    将一张表流式导出到文件，按分块读取和写入，内存占用与总行数无关。
+    先写入 .part 临时文件，全部完成后再重命名并推进水位，中途失败不会产生残缺文件或跳过数据。
+
+    Args:
+        store (ProblemStore): 本地问题库
+        table (str): 表名（problems 或 summaries）
+        fmt (str): 导出格式，见 EXPORT_FORMATS
+        out_dir (str): 输出目录
+        guild_id (str): 可选，只导出指定服务器
+        since (int): 可选，created_at 下限（Unix 时间戳，含）
+        until (int): 可选，created_at 上限（Unix 时间戳，不含）
+        incremental (bool): 是否只导出上次导出水位之后的新数据，不能与 since/until 同时使用
+        chunk_size (int): 每个分块的行数
+
+    Returns:
+        tuple: (输出文件路径, 导出行数)，没有数据时路径为 None
+
+    Raises:
+        ValueError: 增量导出同时指定了时间范围
+    """
+    if incremental and (since is not None or until is not None):
+        # 水位按行号推进，带时间过滤的增量导出会把范围外、行号较小的数据永久跳过（回填的数据行号新但时间早）
+        raise ValueError("增量导出不能与时间范围同时使用")
+    columns = EXPORT_COLUMNS[table]
+    name = watermark_name(table, fmt, guild_id)
+    after_rowid = store.get_watermark(name) if incremental else 0
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    path = os.path.join(out_dir, f"{table}-{guild_id or 'all'}-{stamp}{EXPORT_EXTENSIONS[fmt]}")
+    part_path = path + '.part'
+    writer = WRITERS[fmt](part_path, columns)
+    count, last_rowid = 0, after_rowid
+    try:
+        for rows in store.iter_chunks(table, guild_id, since, until, after_rowid, chunk_size):
+            writer.write(rows)
+            count += len(rows)
+            last_rowid = rows[-1][0]
+    finally:
+        writer.close()
+    if not count:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        logger.info(f"{table} 没有需要导出的新数据")
+        return None, 0
+    os.replace(part_path, path)
+    if incremental:
+        store.set_watermark(name, last_rowid)
+    logger.info(f"{table} 已导出 {count} 行到 {path}")
+    return path, count
+
+def parse_time(value):
+    """解析 ISO 日期/时间（未指定时区按 UTC），返回 Unix 时间戳"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def main(argv=None):
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="流式导出本地问题库中的问题和 General Chat 总结")
+    parser.add_argument('--db', default=PROBLEM_DB_FILE, help="问题库路径（默认 problems.db）")
+    parser.add_argument('--table', choices=('problems', 'summaries', 'all'), default='all', help="导出的数据表")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help="导出格式")
+    parser.add_argument('--out-dir', default='exports', help="输出目录")
+    parser.add_argument('--guild', help="只导出指定服务器 ID")
+    parser.add_argument('--since', type=parse_time, help="起始时间（含），如 2025-01-01 或 2025-01-01T08:00+08:00")
+    parser.add_argument('--until', type=parse_time, help="结束时间（不含）")
+    parser.add_argument('--incremental', action='store_true', help="只导出上次增量导出之后的新数据")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="每个分块的行数")
+    args = parser.parse_args(argv)
+    if args.incremental and (args.since is not None or args.until is not None):
+        parser.error("--incremental 不能与 --since/--until 同时使用")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    os.makedirs(args.out_dir, exist_ok=True)
+    store = ProblemStore(args.db)
+    try:
+        tables = ('problems', 'summaries') if args.table == 'all' else (args.table,)
+        for table in tables:
+            export_table(store, table, args.format, args.out_dir, args.guild, args.since, args.until,
+                         args.incremental, args.chunk_size)
+    except RuntimeError as e:
+        logger.error(str(e))
+        return 1
+    finally:
+        store.close()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import logging
+import discord
+
+logger = logging.getLogger(__name__)
+
+# 网关与缓存配置：
+# - standard: discord.Intents.default() 加 message_content，discord.py 默认缓存最近 1000 条消息（现有部署方式）
+# - lean: 只订阅 Bot 实际处理的事件（服务器/频道、服务器消息），不缓存消息、表情和其他成员，适合服务器较多的部署
+PROFILE_STANDARD = 'standard'
+PROFILE_LEAN = 'lean'
+GATEWAY_PROFILES = (PROFILE_STANDARD, PROFILE_LEAN)
+
+STANDARD_MESSAGE_CACHE_SIZE = 1000  # discord.py 默认值
+LEAN_MESSAGE_CACHE_SIZE = 0  # Bot 不处理消息编辑、删除和表情回应事件，分析时通过 API 拉取历史，无需缓存消息
+MEMORY_REPORT_MINUTES = 10  # 定期记录常驻内存和缓存规模的间隔
+
+def build_intents(profile):
+    """
+    按配置构建网关 intents。
+
+    Args:
+        profile (str): standard 或 lean
+
+    Returns:
+        discord.Intents: lean 只保留 guilds（频道、类别、身份组及频道删除事件）、
+            guild_messages 和 message_content；standard 为 Intents.default() 加 message_content
+    """
+    if profile == PROFILE_LEAN:
+        intents = discord.Intents.none()
+    else:
+        intents = discord.Intents.default()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.message_content = True
+    return intents
+
+def client_kwargs(profile, message_cache_size=None):
+    """
+    创建 commands.Bot / AutoShardedBot 的 intents 与缓存参数。
+
+    Args:
+        profile (str): standard 或 lean
+        message_cache_size (int): 可选，消息缓存条数，0 表示不缓存；默认按配置取值
+
+    Returns:
+        dict: intents、max_messages，lean 另含 member_cache_flags 和 chunk_guilds_at_startup
+    """
+    if profile not in GATEWAY_PROFILES:
+        raise ValueError(f"未知的网关配置: {profile}，可选: {', '.join(GATEWAY_PROFILES)}")
+    if message_cache_size is None:
+        message_cache_size = LEAN_MESSAGE_CACHE_SIZE if profile == PROFILE_LEAN else STANDARD_MESSAGE_CACHE_SIZE
+    kwargs = {
+        'intents': build_intents(profile),
+        'max_messages': message_cache_size or None,  # discord.py 把 0 视为默认的 1000 条，关闭缓存需要传 None
+    }
+    if profile == PROFILE_LEAN:
+        kwargs['member_cache_flags'] = discord.MemberCacheFlags.none()  # 只缓存 Bot 自身，斜杠命令的权限检查使用交互中携带的成员信息
+        kwargs['chunk_guilds_at_startup'] = False
+    return kwargs
+
+def rss_mb():
+    """当前进程的常驻内存（MB）；无 /proc 的系统返回历史峰值"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def cache_stats(client):
+    """
+    统计 discord.py 客户端的缓存规模。
+
+    Returns:
+        dict: guilds、channels、members、emojis、messages（缓存的对象数）
+    """
+    guilds = client.guilds
+    return {
+        'guilds': len(guilds),
+        'channels': sum(len(guild.channels) + len(guild.threads) for guild in guilds),
+        'members': sum(len(guild.members) for guild in guilds),
+        'emojis': len(client.emojis) + len(client.stickers),
+        'messages': len(client.cached_messages),
+    }
+
+def describe_memory(client):
+    """格式化常驻内存与缓存规模，供定期日志使用"""
+    rss = rss_mb()
+    stats = cache_stats(client)
+    per_guilds = f"，每 100 个服务器 {rss / stats['guilds'] * 100:.1f} MB" if stats['guilds'] else ''
+    return (f"常驻内存 {rss:.1f} MB{per_guilds}；缓存: 服务器 {stats['guilds']}，频道 {stats['channels']}，"
+            f"成员 {stats['members']}，表情和贴纸 {stats['emojis']}，消息 {stats['messages']}")
+
+def bench(guilds=500, messages=20000, profiles=GATEWAY_PROFILES):
+    """
+    按各配置订阅的事件构造模拟网关负载（GUILD_CREATE、服务器消息，以及 standard 额外收到的语音状态、表情回应和输入提示），
+    喂给 discord.py 的连接状态，测量稳定后每 100 个服务器占用的常驻内存。每个配置在独立进程中运行，互不影响基线。
+    """
+    from multiprocessing import get_context
+
+    context = get_context('spawn')
+    results = {}
+    for profile in profiles:
+        with context.Pool(1) as pool:
+            results[profile] = pool.apply(bench_profile, (profile, guilds, messages))
+    for profile, (base, steady, events, stats) in results.items():
+        print(f"{profile}: 常驻内存 {base:.1f} -> {steady:.1f} MB，每 100 个服务器 {(steady - base) / guilds * 100:.2f} MB；"
+              f"处理网关事件 {events} 个；缓存 频道 {stats['channels']} 成员 {stats['members']} "
+              f"表情和贴纸 {stats['emojis']} 消息 {stats['messages']}")
+    if PROFILE_STANDARD in results and PROFILE_LEAN in results:
+        standard = results[PROFILE_STANDARD][1] - results[PROFILE_STANDARD][0]
+        lean = results[PROFILE_LEAN][1] - results[PROFILE_LEAN][0]
+        print(f"lean 相比 standard 每 100 个服务器节省 {(standard - lean) / guilds * 100:.2f} MB（{1 - lean / standard:.0%}）")
+
+def bench_profile(profile, guilds, messages):
+    """在当前进程中模拟一个配置的网关负载，返回 (基线内存, 稳定后内存, 处理的事件数, 缓存规模)"""
+    import gc
+    import random
+
+    rng = random.Random(0)
+    client = discord.Client(**client_kwargs(profile))
+    intents = client.intents
+    state = client._connection
+    self_id = 10 ** 17
+    state.user = discord.ClientUser(state=state, data={'id': self_id, 'username': 'bot', 'discriminator': '0', 'avatar': None, 'bot': True})
+    timestamp = '2025-01-01T00:00:00+00:00'
+
+    def user(user_id):
+        return {'id': user_id, 'username': f'user{user_id}', 'discriminator': '0', 'global_name': f'User {user_id}', 'avatar': 'a' * 32}
+
+    def member(user_id, guild_id):
+        return {'user': user(user_id), 'roles': [guild_id + 1 + i for i in range(3)], 'joined_at': timestamp, 'nick': None,
+                'deaf': False, 'mute': False, 'flags': 0}
+
+    def guild_payload(guild_id):
+        text_channels = [guild_id + 100 + i for i in range(30)]
+        voice_channels = [guild_id + 200 + i for i in range(8)]
+        data = {
+            'id': guild_id, 'name': f'guild {guild_id}', 'member_count': 5000, 'owner_id': self_id + 1,
+            'roles': [{'id': guild_id + i, 'name': f'role {i}', 'permissions': '0', 'position': i, 'color': 0, 'hoist': False,
+                       'managed': False, 'mentionable': False, 'flags': 0} for i in range(30)],
+            'channels': [{'id': guild_id + 50 + i, 'type': 4, 'name': f'category {i}', 'position': i, 'permission_overwrites': []} for i in range(5)]
+                + [{'id': channel_id, 'type': 0, 'name': f'channel {channel_id}', 'position': i, 'parent_id': guild_id + 50 + i % 5,
+                    'topic': 'topic ' * 10, 'permission_overwrites': [{'id': guild_id, 'type': 0, 'allow': '0', 'deny': '1024'}]}
+                   for i, channel_id in enumerate(text_channels)]
+                + [{'id': channel_id, 'type': 2, 'name': f'voice {channel_id}', 'position': i, 'bitrate': 64000, 'user_limit': 0,
+                    'permission_overwrites': []} for i, channel_id in enumerate(voice_channels)],
+            'emojis': [{'id': guild_id + 300 + i, 'name': f'emoji{i}', 'roles': [], 'require_colons': True, 'managed': False,
+                        'animated': False, 'available': True} for i in range(50)],
+            'stickers': [{'id': guild_id + 400 + i, 'name': f'sticker{i}', 'tags': 'tag', 'type': 2, 'format_type': 1,
+                          'description': 'sticker', 'available': True, 'guild_id': guild_id} for i in range(5)],
+            'threads': [], 'members': [member(self_id, guild_id)], 'voice_states': [], 'guild_scheduled_events': [],
+        }
+        if intents.voice_states:
+            # 大服务器的 GUILD_CREATE 只携带 Bot 自身和语音频道中的成员
+            for i in range(15):
+                user_id = guild_id + 1000 + i
+                data['voice_states'].append({'user_id': user_id, 'channel_id': voice_channels[i % len(voice_channels)], 'session_id': 's',
+                                             'deaf': False, 'mute': False, 'self_deaf': False, 'self_mute': False, 'self_video': False,
+                                             'suppress': False, 'request_to_speak_timestamp': None})
+                data['members'].append(member(user_id, guild_id))
+        if intents.guild_scheduled_events:
+            data['guild_scheduled_events'] = [{'id': guild_id + 500 + i, 'guild_id': guild_id, 'name': f'event {i}', 'description': 'event ' * 20,
+                                               'scheduled_start_time': timestamp, 'privacy_level': 2, 'status': 1, 'entity_type': 3,
+                                               'entity_metadata': {'location': 'online'}, 'channel_id': None, 'creator_id': self_id + 1}
+                                              for i in range(3)]
+        return data
+
+    gc.collect()
+    base = rss_mb()
+    guild_ids = [(i + 1) << 22 for i in range(guilds)]
+    events = 0
+    for guild_id in guild_ids:
+        state.parse_guild_create(guild_payload(guild_id))
+        events += 1
+    weights = [1 / (rank + 1) for rank in range(guilds)]  # 服务器活跃度长尾分布
+    for i, guild_id in enumerate(rng.choices(guild_ids, weights, k=messages)):
+        channel_id = guild_id + 100 + rng.randrange(30)
+        user_id = guild_id + 2000 + rng.randrange(500)
+        message_id = (guild_id << 1) + i
+        if intents.typing:
+            state.parse_typing_start({'channel_id': channel_id, 'guild_id': guild_id, 'user_id': user_id, 'timestamp': int(time.time()),
+                                      'member': member(user_id, guild_id)})
+            events += 1
+        state.parse_message_create({
+            'id': message_id, 'channel_id': channel_id, 'guild_id': guild_id, 'author': user(user_id), 'member': member(user_id, guild_id),
+            'content': 'my wallet shows pending after i signed the bridge transaction ' * 3, 'timestamp': timestamp,
+            'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [], 'mention_roles': [],
+            'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+        })
+        events += 1
+        if intents.guild_reactions and i % 3 == 0:
+            state.parse_message_reaction_add({'user_id': user_id + 1, 'channel_id': channel_id, 'message_id': message_id, 'guild_id': guild_id,
+                                              'emoji': {'id': None, 'name': '👍'}, 'member': member(user_id + 1, guild_id), 'burst': False, 'type': 0})
+            events += 1
+    gc.collect()
+    return base, rss_mb(), events, cache_stats(client)
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,606 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+import datetime
+import threading
+import subprocess
+import multiprocessing
+from types import SimpleNamespace
+from collections import namedtuple
+from cryptography.fernet import Fernet, InvalidToken
+from llm_analyzer import analyze_ticket_conversation, update_ticket_analysis, triage_ticket_conversation, analyze_general_conversation
+from token_usage import TOKEN_METER, set_usage_scope, usage_fallback, call_as_fallback
+from llm_scheduler import PRIORITY_TICKET, AGING_SECONDS, DEFAULT_DEADLINES
+from endpoint_guard import EndpointRegistry, CircuitOpenError, guard_key
+
+logger = logging.getLogger(__name__)
+
+JOB_DB_FILE = 'jobs.db'  # 本地持久化任务队列，同一台机器上的 Bot 进程和分析进程共用
+LEASE_SECONDS = 600  # 分析进程领取任务后的租约时长，超时未完成（进程崩溃等）时任务重新变为可领取
+MAX_ATTEMPTS = 3  # 每个任务最多执行次数，超过后标记为失败并交回 Bot 进程
+RETRY_BACKOFF_SECONDS = (10, 60)  # 执行失败后的重试间隔，按已执行次数逐级增加
+WORKER_POLL_SECONDS = 0.5  # 分析进程空闲时查询新任务的间隔
+RESULT_POLL_SECONDS = 0.5  # Bot 进程查询已完成任务的间隔
+JOB_RETENTION_SECONDS = 86400  # 已交付的任务保留时长，过期后清理
+WORKER_CHECK_SECONDS = 10  # 检查分析进程存活的间隔
+ENCRYPTION_KEY_ENV = 'ENCRYPTION_KEY'  # 分析进程从该环境变量读取 Fernet 密钥（须与 Bot 进程配置中的 encryption_key 相同）
+ANALYSIS_CONFIG_KEYS = ('timezone', 'structured_output', 'ticket_category_ids')  # 分析用到的服务器配置字段，只有这些字段写入任务
+
+# 任务类型
+JOB_TICKET_FULL = 'ticket_full'  # Ticket 完整分析
+JOB_TICKET_DELTA = 'ticket_delta'  # Ticket 问题草稿增量更新
+JOB_TICKET_TRIAGE = 'ticket_triage'  # Ticket 初筛
+JOB_MONITOR_SUMMARY = 'monitor_summary'  # 监控频道总结
+HEDGED_KINDS = (JOB_TICKET_FULL, JOB_TICKET_DELTA, JOB_MONITOR_SUMMARY)  # 使用备用模型的任务类型；初筛失败时直接放行，不需要备用模型
+
+# 任务状态：pending 待领取；running 执行中；done 已完成；failed 重试耗尽；delivered 结果已交回 Bot 进程
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_DELIVERED = 'delivered'
+
+Job = namedtuple('Job', ['id', 'kind', 'owner', 'payload', 'status', 'attempts', 'created_at', 'result', 'error', 'usage'])
+
+def channel_ref(channel):
+    """提取分析和 finalize_problem() 用到的频道字段，供任务在其他进程中还原频道"""
+    return {'id': channel.id, 'name': channel.name, 'category_id': getattr(channel, 'category_id', None)}
+
+def analysis_config(config):
+    """提取分析用到的服务器配置字段，任务中不保存完整的服务器配置（含自定义 LLM 配置等无关字段）"""
+    return {key: config[key] for key in ANALYSIS_CONFIG_KEYS if key in config}
+
+def run_analysis(kind, payload, api_key):
+    """
+    执行一个分析任务（在分析进程中，或未启用分析进程时在 Bot 进程的工作线程中）。
+
+    Args:
+        kind (str): 任务类型
+        payload (dict): 任务参数，llm 字段包含 base_url 和 model_id
+        api_key (str): 解密后的 LLM API 密钥
+
+    Returns:
+        任务结果：Ticket 分析为问题字典，初筛为 bool，监控总结为 GeneralSummary.dict()
+    """
+    llm = payload['llm']
+    channel = SimpleNamespace(**payload['channel']) if 'channel' in payload else None
+    if kind == JOB_TICKET_FULL:
+        return analyze_ticket_conversation(
+            payload['conversation'], channel, payload['guild_id'], payload['config'],
+            api_key, llm['base_url'], llm['model_id'], datetime.datetime.fromisoformat(payload['creation_time'])
+        )
+    if kind == JOB_TICKET_DELTA:
+        return update_ticket_analysis(
+            payload['draft'], payload['conversation'], channel, payload['guild_id'], payload['config'],
+            api_key, llm['base_url'], llm['model_id'], datetime.datetime.fromisoformat(payload['creation_time'])
+        )
+    if kind == JOB_TICKET_TRIAGE:
+        return triage_ticket_conversation(payload['conversation'], api_key, llm['base_url'], llm['model_id'])
+    if kind == JOB_MONITOR_SUMMARY:
+        return analyze_general_conversation(
+            payload['conversation'], channel, payload['guild_id'], payload['config'],
+            api_key, llm['base_url'], llm['model_id']
+        )
+    raise ValueError(f"未知的任务类型: {kind}")
+
+def drain_usage():
+    """取出本进程累计的 token 用量，转换为可 JSON 序列化的列表"""
+    return [[guild_id, day, counts] for (guild_id, day), counts in TOKEN_METER.drain().items()]
+
+class JobQueue:
+    """
+    基于 SQLite（WAL）的本地持久化任务队列，Bot 进程提交分析任务，分析进程领取执行并写回结果。
+    - 至少一次语义：领取任务时设置租约，执行进程崩溃后租约过期，任务由其他进程重新领取；
+      结果由提交任务的 Bot 进程（owner）取回并确认交付，Bot 进程重启后仍可取回重启前提交的任务结果。
+    - 领取和写回均为单条原子更新，多个分析进程并发领取不会重复执行同一任务（租约过期的除外）。
+    - 按优先级类别领取（见 llm_scheduler），排队每满 AGING_SECONDS 提升一级，低优先级任务不会饿死。
+    """
+    def __init__(self, path=JOB_DB_FILE):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_until REAL,
+            worker TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            result TEXT,
+            error TEXT,
+            usage TEXT,
+            priority INTEGER NOT NULL DEFAULT 1
+        )''')
+        try:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 1')  # 兼容旧版本创建的任务表
+        except sqlite3.OperationalError:
+            pass
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, status)')
+        self.lock = threading.Lock()  # 连接在事件循环线程和工作线程之间共用
+
+    def submit(self, kind, owner, payload, priority=PRIORITY_TICKET):
+        """
+        提交任务。
+
+        Args:
+            kind (str): 任务类型
+            owner (str): 提交者标识（分片标识），结果只交回该进程
+            payload (dict): 任务参数
+            priority (int): 优先级类别
+
+        Returns:
+            int: 任务 ID
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT INTO jobs (kind, owner, payload, status, available_at, created_at, priority) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (kind, owner, json.dumps(payload, ensure_ascii=False), STATUS_PENDING, now, now, priority)
+            )
+        return cursor.lastrowid
+
+    def claim(self, worker):
+        """
+        领取有效优先级最高的可执行任务：待领取且已到重试时间，或执行中但租约已过期。
+        租约多次过期（如任务导致分析进程崩溃）的任务不再领取，直接标记为失败。
+
+        Args:
+            worker (str): 分析进程标识
+
+        Returns:
+            Job: 领取到的任务，没有可执行任务时返回 None
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                (STATUS_FAILED, '执行超时或分析进程退出', now, STATUS_RUNNING, now, MAX_ATTEMPTS)
+            )
+            row = self.conn.execute(
+                '''UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, worker = ?
+                   WHERE id = (SELECT id FROM jobs WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?)
+                               ORDER BY created_at + priority * ?, id LIMIT 1)
+                   RETURNING id, kind, owner, payload, status, attempts, created_at, result, error, usage''',
+                (STATUS_RUNNING, now + LEASE_SECONDS, worker, STATUS_PENDING, now, STATUS_RUNNING, now, AGING_SECONDS)
+            ).fetchone()
+        return self.to_job(row) if row else None
+
+    def finish(self, job_id, worker, status, result=None, error=None, usage=None, retry_at=None):
+        """写回执行结果；租约已被其他进程接管时放弃写入，返回 False"""
+        with self.lock:
+            row = self.conn.execute('SELECT usage FROM jobs WHERE id = ? AND worker = ? AND status = ?',
+                                    (job_id, worker, STATUS_RUNNING)).fetchone()
+            if row is None:
+                return False
+            usage = json.loads(row[0] or '[]') + (usage or [])  # 失败重试的用量同样计入
+            cursor = self.conn.execute(
+                '''UPDATE jobs SET status = ?, result = ?, error = ?, usage = ?, available_at = COALESCE(?, available_at), finished_at = ?
+                   WHERE id = ? AND worker = ? AND status = ?''',
+                (status, json.dumps(result, ensure_ascii=False), error, json.dumps(usage), retry_at, time.time(),
+                 job_id, worker, STATUS_RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job, worker, result, usage=None):
+        """
+        标记任务完成。
+
+        Args:
+            job (Job): 领取到的任务
+            worker (str): 分析进程标识
+            result: 任务结果（可 JSON 序列化）
+            usage (list): drain_usage() 返回的 token 用量
+        """
+        return self.finish(job.id, worker, STATUS_DONE, result=result, usage=usage)
+
+    def fail(self, job, worker, error, usage=None):
+        """
+        记录执行失败：未达最大次数时按退避间隔重新排队，否则标记为失败。
+
+        Args:
+            job (Job): 领取到的任务
+            worker (str): 分析进程标识
+            error (str): 错误信息
+            usage (list): drain_usage() 返回的 token 用量
+        """
+        if job.attempts < MAX_ATTEMPTS:
+            delay = RETRY_BACKOFF_SECONDS[min(job.attempts, len(RETRY_BACKOFF_SECONDS)) - 1]
+            return self.finish(job.id, worker, STATUS_PENDING, error=error, usage=usage, retry_at=time.time() + delay)
+        return self.finish(job.id, worker, STATUS_FAILED, error=error, usage=usage)
+
+    def defer(self, job, worker, delay):
+        """
+        将已领取的任务放回队列、延后执行，不计入执行次数（如接口断路时）。
+
+        Args:
+            job (Job): 领取到的任务
+            worker (str): 分析进程标识
+            delay (float): 延后秒数
+        """
+        with self.lock:
+            self.conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts - 1, available_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                (STATUS_PENDING, time.time() + delay, job.id, worker, STATUS_RUNNING)
+            )
+
+    def finished(self, owner):
+        """
+        查询已完成或已失败、尚未交付的任务。
+
+        Args:
+            owner (str): 提交者标识
+
+        Returns:
+            list: Job 列表，按任务 ID 排序
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                '''SELECT id, kind, owner, payload, status, attempts, created_at, result, error, usage FROM jobs
+                   WHERE owner = ? AND status IN (?, ?) ORDER BY id''',
+                (owner, STATUS_DONE, STATUS_FAILED)
+            ).fetchall()
+        return [self.to_job(row) for row in rows]
+
+    def abandon(self, job_id, error):
+        """
+        放弃尚未被领取的任务（等待者已超时），分析进程不再执行；已在执行的任务不受影响，完成后照常取回。
+
+        Returns:
+            bool: 任务是否仍未被领取并已放弃
+        """
+        with self.lock:
+            cursor = self.conn.execute('UPDATE jobs SET status = ?, payload = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?',
+                                       (STATUS_DELIVERED, '{}', error, time.time(), job_id, STATUS_PENDING))
+        return cursor.rowcount == 1
+
+    def mark_delivered(self, job_id):
+        """确认任务结果已交回 Bot 进程"""
+        with self.lock:
+            self.conn.execute('UPDATE jobs SET status = ?, payload = ? WHERE id = ?', (STATUS_DELIVERED, '{}', job_id))
+
+    def purge(self, retention_seconds=JOB_RETENTION_SECONDS):
+        """删除交付已超过保留时长的任务，返回删除数"""
+        with self.lock:
+            cursor = self.conn.execute('DELETE FROM jobs WHERE status = ? AND finished_at < ?',
+                                       (STATUS_DELIVERED, time.time() - retention_seconds))
+        return cursor.rowcount
+
+    def stats(self):
+        """各状态的任务数"""
+        with self.lock:
+            return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    @staticmethod
+    def to_job(row):
+        job_id, kind, owner, payload, status, attempts, created_at, result, error, usage = row
+        return Job(job_id, kind, owner, json.loads(payload), status, attempts, created_at,
+                   json.loads(result) if result else None, error, json.loads(usage) if usage else [])
+
+class AnalysisDispatcher:
+    """
+    Bot 进程一侧的分析入口。
+    - 未设置任务队列时经 LLM 调度器按优先级在本进程执行（单进程部署的默认方式）。
+    - 设置任务队列时提交任务并等待分析进程写回结果，事件循环只负责 Discord/Telegram 收发；
+      分析进程中产生的 token 用量随结果交回，计入本进程的用量统计。
+    - 本进程重启前提交、重启后才完成的任务没有等待者，交给 recover 回调处理（如恢复问题草稿、发布监控总结）。
+    - 任务结果交给等待者并发布（publish 回调）之后才确认交付；确认前 Bot 进程退出时，任务保持 done 状态，
+      重启后由 recover 回调重新处理（至少一次交付）。
+    - 设置 fallback 时 HEDGED_KINDS 类型的任务带有备用 LLM 配置：本进程执行时主调用较慢则发出对冲请求
+      （见 LLMScheduler.run_hedged()），分析进程执行时主调用失败或主接口断路则改用备用配置。
+    """
+    def __init__(self, queue=None, owner='all', cipher=None, recover=None, scheduler=None, fallback=None):
+        """
+        Args:
+            queue (JobQueue): 任务队列，None 表示在本进程内执行
+            owner (str): 提交者标识，多进程分片部署时各进程只取回自己提交的任务
+            cipher (Fernet): 加密任务中的 LLM API 密钥，分析进程使用相同的密钥解密
+            recover (callable): 可选，异步回调 recover(job)，处理重启前提交的任务结果
+            scheduler (LLMScheduler): 本进程执行时使用的 LLM 调度器，None 表示直接在默认线程池中执行
+            fallback (callable): 可选，fallback(guild_id, llm_config) 返回备用 LLM 配置（格式同 llm_config）或 None
+        """
+        self.queue = queue
+        self.scheduler = scheduler
+        self.owner = owner
+        self.cipher = cipher
+        self.recover = recover
+        self.fallback = fallback
+        self.started_at = time.time()
+        self.waiters = {}  # 任务 ID -> 等待结果的 Future
+        self.handed = set()  # 结果已交给等待者、尚未确认交付的任务 ID
+        self.skipped = set()  # 本次运行中恢复失败的任务 ID，下次重启时再尝试
+        self.lock = asyncio.Lock()  # 提交任务与登记等待者之间不取回结果，避免结果先于等待者到达
+
+    async def run(self, kind, payload, llm_config, priority=PRIORITY_TICKET, publish=None):
+        """
+        执行分析任务并返回结果。
+
+        Args:
+            kind (str): 任务类型
+            payload (dict): 任务参数，config 字段只保留 ANALYSIS_CONFIG_KEYS
+            llm_config (dict): 包含 api_key、model_id、base_url 的 LLM 配置
+            priority (int): 优先级类别
+            publish (callable): 可选，异步回调 publish(result)，发布结果（如推送到 Telegram）；完成后才确认任务交付
+
+        Returns:
+            任务结果，见 run_analysis()
+
+        Raises:
+            RuntimeError: 任务重试耗尽后仍然失败
+            TimeoutError: 超过截止时长（按优先级类别取调度器的 deadlines）；交给分析进程的任务尚未被领取时一并放弃
+        """
+        payload = {**payload, 'llm': {'base_url': llm_config['base_url'], 'model_id': llm_config['model_id']}}
+        if 'config' in payload:
+            payload['config'] = analysis_config(payload['config'])
+        fallback = self.fallback(payload['guild_id'], llm_config) if self.fallback and kind in HEDGED_KINDS else None
+        if self.queue is None:
+            if self.scheduler is not None:
+                primary = (run_analysis, (kind, payload, llm_config['api_key']), guard_key(llm_config['base_url'], llm_config['api_key']))
+                hedge = None
+                if fallback:
+                    fallback_payload = {**payload, 'llm': {'base_url': fallback['base_url'], 'model_id': fallback['model_id']}}
+                    hedge = (call_as_fallback, (run_analysis, kind, fallback_payload, fallback['api_key']),
+                             guard_key(fallback['base_url'], fallback['api_key']))
+                result = await self.scheduler.run_hedged(priority, kind, primary, hedge)
+            else:
+                result = await asyncio.to_thread(run_analysis, kind, payload, llm_config['api_key'])
+            if publish is not None:
+                await publish(result)
+            return result
+        payload['llm']['api_key'] = self.cipher.encrypt(llm_config['api_key'].encode()).decode()
+        if fallback:
+            payload['fallback'] = {
+                'base_url': fallback['base_url'], 'model_id': fallback['model_id'],
+                'api_key': self.cipher.encrypt(fallback['api_key'].encode()).decode(),
+            }
+        future = asyncio.get_running_loop().create_future()
+        async with self.lock:
+            job_id = await asyncio.to_thread(self.queue.submit, kind, self.owner, payload, priority)
+            self.waiters[job_id] = future
+        deadline = (self.scheduler.deadlines if self.scheduler is not None else DEFAULT_DEADLINES)[priority]
+        try:
+            try:
+                result = await asyncio.wait_for(future, deadline)
+            except asyncio.TimeoutError:
+                abandoned = await asyncio.to_thread(self.queue.abandon, job_id, f"等待结果超过截止时长 {deadline} 秒")
+                logger.warning(f"分析任务 {job_id}（{kind}）超过截止时长 {deadline} 秒，"
+                               + ("尚未被领取，已放弃" if abandoned else "执行中，结果将被丢弃"))
+                raise TimeoutError(f"分析任务 {job_id}（{kind}）超过截止时长 {deadline} 秒") from None
+            except RuntimeError:
+                await asyncio.to_thread(self.queue.mark_delivered, job_id)  # 任务重试耗尽，失败结果已交给等待者
+                raise
+            finally:
+                self.waiters.pop(job_id, None)
+            if publish is not None:
+                try:
+                    await publish(result)
+                except BaseException:
+                    self.skipped.add(job_id)  # 发布失败或被取消时不确认交付，Bot 重启后由 recover 回调重新处理
+                    raise
+            await asyncio.to_thread(self.queue.mark_delivered, job_id)
+            return result
+        finally:
+            self.handed.discard(job_id)
+
+    async def collect(self):
+        """
+        取回已完成的任务：合并 token 用量并唤醒等待者，由等待者发布结果后确认交付；
+        重启前提交的任务交给 recover 回调处理后确认交付，等待者已取消的任务直接确认交付。
+        """
+        async with self.lock:
+            jobs = await asyncio.to_thread(self.queue.finished, self.owner)
+        for job in jobs:
+            if job.id in self.skipped or job.id in self.handed:
+                continue
+            future = self.waiters.get(job.id)
+            if future is None and job.created_at < self.started_at and self.recover:
+                try:
+                    await self.recover(job)
+                except Exception as e:
+                    logger.error(f"处理重启前提交的分析任务 {job.id}（{job.kind}）失败: {e}")
+                    self.skipped.add(job.id)
+                    continue
+            TOKEN_METER.merge(job.usage)
+            if future is not None and not future.done():
+                self.handed.add(job.id)
+                if job.status == STATUS_DONE:
+                    future.set_result(job.result)
+                else:
+                    future.set_exception(RuntimeError(f"分析任务 {job.id} 执行 {job.attempts} 次后失败: {job.error}"))
+                continue
+            await asyncio.to_thread(self.queue.mark_delivered, job.id)
+
+    async def poll(self):
+        """后台任务：定期取回已完成的任务，并清理过期记录"""
+        last_purge = 0
+        while True:
+            await asyncio.sleep(RESULT_POLL_SECONDS)
+            try:
+                await self.collect()
+                if time.monotonic() - last_purge >= 3600:
+                    last_purge = time.monotonic()
+                    await asyncio.to_thread(self.queue.purge)
+            except Exception as e:
+                logger.error(f"取回分析任务结果失败: {e}")
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def run_worker(encryption_key, path=JOB_DB_FILE, max_jobs=None):
+    """
+    分析进程主循环：领取任务、调用 LLM 并写回结果。
+    每个 LLM 接口有独立的断路器：接口断路期间领取到的任务放回队列延后执行，不消耗重试次数。
+    任务带有备用 LLM 配置时，主调用失败或主接口断路则立即改用备用配置（分析进程逐个执行任务，不发出并行的对冲请求）。
+
+    Args:
+        encryption_key (str): 解密任务中 API 密钥的 Fernet 密钥（与 Bot 进程的配置相同）
+        path (str): 任务队列数据库文件
+        max_jobs (int): 可选，执行该数量的任务后退出（用于测试）
+    """
+    queue = JobQueue(path)
+    cipher = Fernet(encryption_key.encode())
+    worker = worker_id()
+    endpoints = EndpointRegistry()
+    logger.info(f"分析进程 {worker} 已启动")
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = queue.claim(worker)
+        if job is None:
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+        start = time.monotonic()
+        set_usage_scope(job.payload['guild_id'])
+        result, error, attempted = None, None, False
+        for llm in [job.payload['llm']] + ([job.payload['fallback']] if 'fallback' in job.payload else []):
+            try:
+                api_key = cipher.decrypt(llm['api_key'].encode()).decode()
+            except InvalidToken:
+                attempted = True
+                error = RuntimeError(f"无法解密 {llm['model_id']} 的 API 密钥，分析进程的加密密钥与 Bot 进程不同")
+                continue
+            guard = endpoints.get(guard_key(llm['base_url'], api_key))
+            try:
+                guard.check()
+            except CircuitOpenError as e:
+                error = e if error is None or (isinstance(error, CircuitOpenError) and e.retry_at < error.retry_at) else error
+                continue
+            attempted = True
+            call_start = time.monotonic()
+            usage_fallback.set(llm is not job.payload['llm'])  # 备用模型的用量另计，受默认密钥的每日预算约束
+            guard.on_start()
+            try:
+                result = run_analysis(job.kind, {**job.payload, 'llm': llm}, api_key)
+            except Exception as e:
+                guard.on_finish(time.monotonic() - call_start, e, job.kind)
+                logger.warning(f"分析任务 {job.id}（{job.kind}）调用 {llm['model_id']} 失败: {e}")
+                error = e
+                continue
+            guard.on_finish(time.monotonic() - call_start, None, job.kind)
+            error = None
+            break
+        if error is not None and not attempted:
+            queue.defer(job, worker, error.retry_at - time.monotonic())  # 主接口和备用接口均已断路
+            continue
+        if error is not None:
+            logger.error(f"分析任务 {job.id}（{job.kind}）第 {job.attempts} 次执行失败: {error}")
+            queue.fail(job, worker, f"{type(error).__name__}: {error}", drain_usage())
+        else:
+            if not queue.complete(job, worker, result, drain_usage()):
+                logger.warning(f"分析任务 {job.id} 的租约已被其他进程接管，结果未写入")
+            logger.info(f"分析任务 {job.id}（{job.kind}）完成，耗时 {time.monotonic() - start:.1f} 秒")
+        done += 1
+
+def worker_main(encryption_key, path):
+    """分析进程入口（独立进程，不继承 Bot 进程的日志配置和事件循环）"""
+    from logging_setup import LOG_FORMAT
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    try:
+        run_worker(encryption_key, path)
+    except KeyboardInterrupt:
+        pass
+
+class WorkerPool:
+    """
+    由 Bot 进程启动并监护的分析进程池，进程退出后自动重启。
+    分析进程以新的 Python 进程运行本模块（python job_queue.py），只导入本模块和分析依赖，不加载 Discord/Telegram 客户端；
+    不使用 multiprocessing 的 spawn 方式，它会以 __mp_main__ 重新导入主脚本，在每个分析进程中重复执行 bot.py 的模块级代码。
+    Fernet 密钥经环境变量传递，不出现在命令行参数中。
+    """
+    def __init__(self, count, encryption_key, path=JOB_DB_FILE):
+        self.count = count
+        self.encryption_key = encryption_key
+        self.path = path
+        self.processes = []
+
+    def spawn(self):
+        env = {**os.environ, ENCRYPTION_KEY_ENV: self.encryption_key}
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--workers', '1', '--db', self.path], env=env)
+
+    def start(self):
+        self.processes = [self.spawn() for _ in range(self.count)]
+        logger.info(f"已启动 {self.count} 个分析进程")
+
+    async def supervise(self):
+        """后台任务：定期检查分析进程，退出的进程立即重启（任务由租约机制重新执行）"""
+        while True:
+            await asyncio.sleep(WORKER_CHECK_SECONDS)
+            for i, process in enumerate(self.processes):
+                code = process.poll()
+                if code is not None:
+                    logger.error(f"分析进程 {process.pid} 退出（返回码 {code}），重新启动")
+                    self.processes[i] = await asyncio.to_thread(self.spawn)
+
+    def stop(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def load_encryption_key():
+    """
+    获取解密任务中 API 密钥的 Fernet 密钥，依次查找环境变量 ENCRYPTION_KEY、共享配置库（CONFIG_STORE=sqlite）和 config.json。
+    不生成新密钥：密钥与 Bot 进程不同时无法解密任何任务。
+
+    Returns:
+        str: 密钥，未找到时返回 None
+    """
+    from config_manager import SharedConfigStore, CONFIG_DB_FILE, CONFIG_FILE
+    key = os.getenv(ENCRYPTION_KEY_ENV)
+    if key:
+        return key
+    if os.getenv('CONFIG_STORE', 'json').lower() == 'sqlite':
+        return SharedConfigStore().get('encryption_key') if os.path.exists(CONFIG_DB_FILE) else None
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f).get('encryption_key')
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='启动独立的分析进程，执行 Bot 提交到本地任务队列的 LLM 分析任务')
+    parser.add_argument('--workers', type=int, default=1, help='分析进程数')
+    parser.add_argument('--db', default=JOB_DB_FILE, help='任务队列数据库文件')
+    parser.add_argument('--stats', action='store_true', help='只输出各状态的任务数')
+    args = parser.parse_args(argv)
+    if args.stats:
+        for status, count in sorted(JobQueue(args.db).stats().items()):
+            print(f"{status}: {count}")
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+    encryption_key = load_encryption_key()
+    if not encryption_key:
+        parser.error(f"未找到加密密钥：请设置环境变量 {ENCRYPTION_KEY_ENV}，或先启动一次 Bot 生成 config.json / 共享配置库中的 encryption_key")
+    try:
+        Fernet(encryption_key.encode())
+    except ValueError as e:
+        parser.error(f"加密密钥无效: {e}")
+    if args.workers == 1:
+        worker_main(encryption_key, args.db)
+        return
+    processes = [multiprocessing.Process(target=worker_main, args=(encryption_key, args.db)) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    main()
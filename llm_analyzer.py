@@ -1,60 +1,312 @@
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 from langchain.output_parsers import PydanticOutputParser
+from langchain_core.exceptions import OutputParserException
+from langchain_core.utils.json import parse_partial_json
+from openai import BadRequestError
 from models import Problem, GeneralSummary
+import json
+import re
 import logging
 from utils import is_ticket_channel
+from token_usage import USAGE_CALLBACKS, record_parse_stat  # 按服务器记录每次调用的 token 用量和解析统计
 from datetime import datetime, timezone, timedelta
 
 logger = logging.getLogger(__name__)
 
-def analyze_ticket_conversation(conversation, channel, guild_id, config, llm_api_key, base_url, model_id, creation_time):
-    """使用 LLM 分析 Ticket 频道的对话，生成问题反馈
+# 结构化输出模式：
+# - json: 使用 JSON mode（response_format=json_object），提示中只携带精简字段说明
+# - tool: 使用 tool/function calling，字段约束放在工具 schema 中
+# - parser: 旧方案，提示中携带完整的 PydanticOutputParser 格式说明
+STRUCTURED_OUTPUT_MODES = ('json', 'tool', 'parser')
+DEFAULT_STRUCTURED_OUTPUT_MODE = 'json'
+
+# 不支持 JSON mode / tool calling 的端点，键为 (base_url, model_id, mode)，避免每次都先失败再回退
+unsupported_endpoints = set()
+
+LLM_REQUEST_TIMEOUT_SECONDS = 90  # 单次 HTTP 请求的超时，避免挂起的请求长期占用分析线程
+LLM_MAX_RETRIES = 1  # 超时、连接失败和 5xx 时 SDK 自动重试的次数，单次调用最长约为 (1 + 重试次数) * 超时
+
+def create_llm(llm_api_key, base_url, model_id, **kwargs):
+    """创建带请求超时和用量统计回调的 LLM 客户端
     参数:
-        conversation: 对话列表，每个元素包含 user, content, timestamp
-        channel: Discord 频道对象
-        guild_id: 服务器 ID
-        config: 服务器配置
         llm_api_key: LLM API Key
         base_url: LLM 基础 URL
         model_id: LLM 模型 ID
-        creation_time: 频道创建时间（datetime对象）
+        **kwargs: 其他 ChatOpenAI 参数（如 max_tokens）
     返回:
-        problem: 问题字典，符合用户指定格式
+        ChatOpenAI 实例
     """
-    # 将对话列表转换为文本格式，供 LLM 分析
-    conversation_text = "\n".join([f"{msg['user']}: {msg['content']}" for msg in conversation])
-    
-    # 初始化 LLM 客户端
-    llm = ChatOpenAI(openai_api_key=llm_api_key, base_url=base_url, model=model_id)
-    
-    # 创建 Pydantic 解析器，确保 LLM 输出符合 Problem 模型
-    parser = PydanticOutputParser(pydantic_object=Problem)
-    
-    # 系统提示，指导 LLM 分析对话并生成结构化输出
-    system_prompt = (
-        "你是一个自身的Discord社区管理员，尤其拥有丰富的web3社区和项目管理经验，熟悉各种Crypto和Discord的俚语与专有名词。"
-        "你的任务是分析 Discord 社区内  Ticket 中的对话内容，判断其是否构成有效问题。"
-        "如果内容属于有效的问题，请使用专业的媒体风格的中文，以 JSON 格式返回以下字段："
-        "- problem_type（问题类型，如功能建议、Bug 报告等）"
-        "- summary（问题简述，简明扼要、一针见血）"
-        "- details（问题详情，客观转述对话内容）"
-        "- user（提出问题的用户）"
-        "- original（原始对话内容）"
-        "- is_valid（是否有效，true/false）"
-        "注意：timestamp 和 link 字段将由系统提供，不需要生成。"
-        "如果无效，返回 is_valid: false 并简要说明原因。"
+    return ChatOpenAI(
+        openai_api_key=llm_api_key, base_url=base_url, model=model_id,
+        timeout=LLM_REQUEST_TIMEOUT_SECONDS, max_retries=LLM_MAX_RETRIES, callbacks=USAGE_CALLBACKS, **kwargs
     )
+
+# 预编译的系统提示（模块加载时构建一次，避免每次调用重复拼接）
+TICKET_SYSTEM_PROMPT = (
+    "你是一个自身的Discord社区管理员，尤其拥有丰富的web3社区和项目管理经验，熟悉各种Crypto和Discord的俚语与专有名词。"
+    "你的任务是分析 Discord 社区内  Ticket 中的对话内容，判断其是否构成有效问题。"
+    "如果内容属于有效的问题，请使用专业的媒体风格的中文，以 JSON 格式返回以下字段："
+    "- problem_type（问题类型，如功能建议、Bug 报告等）"
+    "- summary（问题简述，简明扼要、一针见血）"
+    "- details（问题详情，客观转述对话内容）"
+    "- user（提出问题的用户）"
+    "- original（原始对话内容）"
+    "- is_valid（是否有效，true/false）"
+    "注意：timestamp 和 link 字段将由系统提供，不需要生成。"
+    "如果无效，返回 is_valid: false 并简要说明原因。"
+)
+
+GENERAL_SYSTEM_PROMPT = (
+    "你是一个自身的Discord社区管理员和，尤其拥有丰富的web3社区和项目管理经验。"
+    "你熟悉各种Crypto和Discord的俚语与专有名词，并且精通舆情控制和品牌形象管理。"
+    "你的任务是分析 Discord 社区内日常讨论频道的对话内容，理解讨论焦点、当下舆情、社区情绪。"
+    "主要目的是帮助团队进行社区管理与舆情监控，报告应使用专业的中文，需包括："
+    "- emotion（整体情绪，如积极、消极、中立等）"
+    "- discussion_summary（讨论概述，新闻播报风格，简明扼要）"
+    "- key_events（重点关注事件，如产品问题、情绪性发言等，默认‘无’）"
+    "- suggestion（针对当前情况的一针见血的建议，通常无特殊情况保持为空）"
+)
+
+TICKET_SYSTEM_MESSAGE = SystemMessage(content=TICKET_SYSTEM_PROMPT)
+GENERAL_SYSTEM_MESSAGE = SystemMessage(content=GENERAL_SYSTEM_PROMPT)
+
+# 由系统填充、无需 LLM 生成的字段及其默认值
+TICKET_SYSTEM_FIELDS = {'source': '', 'timestamp': '', 'id': 0, 'link': ''}
+
+# LLM 需要生成的字段（JSON mode 与 tool calling 共用）
+TICKET_OUTPUT_SCHEMA = {
+    'title': 'Problem',
+    'description': 'Ticket 问题分析结果',
+    'type': 'object',
+    'properties': {
+        'problem_type': {'type': 'string'},
+        'summary': {'type': 'string'},
+        'details': {'type': 'string'},
+        'user': {'type': 'string'},
+        'original': {'type': 'string'},
+        'is_valid': {'type': 'boolean'},
+    },
+    'required': ['problem_type', 'summary', 'details', 'user', 'original', 'is_valid'],
+}
+
+GENERAL_OUTPUT_SCHEMA = {
+    'title': 'GeneralSummary',
+    'description': 'General Chat 总结结果',
+    'type': 'object',
+    'properties': {
+        'emotion': {'type': 'string'},
+        'discussion_summary': {'type': 'string'},
+        'key_events': {'type': 'string'},
+        'suggestion': {'type': 'string'},
+    },
+    'required': ['emotion', 'discussion_summary', 'key_events', 'suggestion'],
+}
+
+def build_json_hint(schema):
+    """根据 schema 生成精简的 JSON 输出说明，替代冗长的 format instructions
+    参数:
+        schema: JSON schema 字典
+    返回:
+        str: 形如 `只输出一个 JSON 对象，键: a(string), b(boolean)` 的提示
+    """
+    fields = ", ".join(f"{name}({spec['type']})" for name, spec in schema['properties'].items())
+    return f"只输出一个 JSON 对象，不要输出其他内容。键: {fields}"
+
+TICKET_JSON_HINT = build_json_hint(TICKET_OUTPUT_SCHEMA)
+GENERAL_JSON_HINT = build_json_hint(GENERAL_OUTPUT_SCHEMA)
+
+# 旧方案的解析器与格式说明同样只构建一次
+TICKET_PARSER = PydanticOutputParser(pydantic_object=Problem)
+GENERAL_PARSER = PydanticOutputParser(pydantic_object=GeneralSummary)
+TICKET_FORMAT_INSTRUCTIONS = TICKET_PARSER.get_format_instructions()
+GENERAL_FORMAT_INSTRUCTIONS = GENERAL_PARSER.get_format_instructions()
+
+def repair_json(text):
+    """容错解析 LLM 返回的 JSON 文本
+    - 去除 ```json 代码块包裹和前后多余文字
+    - 修复尾随逗号、Python 风格的 True/False/None、被截断的括号
+    参数:
+        text: LLM 原始输出
+    返回:
+        dict: 解析后的字典
+    异常:
+        ValueError: 无法修复为 JSON 对象时抛出
+    """
+    if isinstance(text, dict):
+        return text
+    cleaned = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", text.strip(), flags=re.IGNORECASE)
+    start = cleaned.find('{')
+    if start == -1:
+        raise ValueError("LLM 输出中未找到 JSON 对象")
+    end = cleaned.rfind('}')
+    candidate = cleaned[start:end + 1] if end > start else cleaned[start:]
+    try:
+        data = json.loads(candidate, strict=False)
+    except json.JSONDecodeError:
+        fixed = re.sub(r",\s*([}\]])", r"\1", candidate)  # 尾随逗号
+        fixed = re.sub(r"(?<=[:\[,\s])True\b", "true", fixed)
+        fixed = re.sub(r"(?<=[:\[,\s])False\b", "false", fixed)
+        fixed = re.sub(r"(?<=[:\[,\s])None\b", "null", fixed)
+        if fixed.count('"') % 2 == 1:  # 字符串被截断
+            fixed += '"'
+        fixed += ']' * max(fixed.count('[') - fixed.count(']'), 0)
+        fixed += '}' * max(fixed.count('{') - fixed.count('}'), 0)
+        try:
+            data = json.loads(fixed, strict=False)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"无法修复 LLM 输出的 JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError("LLM 输出的 JSON 不是对象")
+    return data
+
+def completed_fields(buffer):
+    """从流式输出的缓冲区中提取已经完整生成的字段
+    - 某字段之后已出现下一个键时，视为该字段的值已生成完毕
+    参数:
+        buffer: 目前为止累积的 LLM 输出
+    返回:
+        dict: 已完整生成的字段
+    """
+    start = buffer.find('{')
+    if start == -1:
+        return {}
+    try:
+        partial = parse_partial_json(buffer[start:])
+    except Exception:
+        return {}
+    if not isinstance(partial, dict):
+        return {}
+    keys = list(partial.keys())
+    return {key: partial[key] for key in keys[:-1]}
+
+def invoke_content(llm, messages, on_partial=None):
+    """调用 LLM 并返回文本内容
+    - 未提供 on_partial 时直接 invoke
+    - 提供 on_partial 时改为流式调用，每当有新字段生成完毕就回调一次
+    参数:
+        llm: ChatOpenAI 或绑定了参数的 Runnable
+        messages: 消息列表
+        on_partial: 回调函数，参数为已完整生成的字段字典
+    返回:
+        str: LLM 输出的完整文本
+    """
+    if on_partial is None:
+        return llm.invoke(messages).content
+    buffer = ""
+    reported = 0
+    for chunk in llm.stream(messages):
+        text = chunk.content or ""
+        buffer += text
+        # 只有可能出现新键时才尝试增量解析，避免每个 token 都解析一次
+        if ':' not in text:
+            continue
+        fields = completed_fields(buffer)
+        if len(fields) > reported:
+            reported = len(fields)
+            try:
+                on_partial(fields)
+            except Exception as e:
+                logger.warning(f"流式回调执行失败: {e}")
+    return buffer
+
+# 判断 400 错误是否由结构化输出参数引起的关键词（错误码、参数名或错误信息中出现）
+UNSUPPORTED_MODE_MARKERS = {
+    'json': ('response_format', 'json_object', 'json mode'),
+    'tool': ('tools', 'tool_choice', 'function_call', 'function calling'),
+}
+
+def is_unsupported_mode_error(error, mode):
+    """判断 BadRequestError 是否表示端点不支持该结构化输出模式
+    参数:
+        error: openai.BadRequestError
+        mode: 结构化输出模式（json 或 tool）
+    返回:
+        bool: 错误的 code、param 或信息中提到 response_format / tools 等参数时为 True；
+            上下文超长、内容审核、模型不存在等其他 400 错误为 False
+    """
+    text = ' '.join(str(part) for part in (error.code, error.param, error.message, error.body) if part).lower()
+    return any(marker in text for marker in UNSUPPORTED_MODE_MARKERS.get(mode, ()))
+
+def invoke_structured(llm, system_message, conversation_text, model_cls, output_schema, json_hint,
+                      parser, format_instructions, mode, endpoint_key, defaults=None, on_partial=None):
+    """按结构化输出模式调用 LLM 并解析为 Pydantic 模型实例
+    - json/tool 模式失败（端点不支持或解析失败）时回退到 PydanticOutputParser 方案
+    - 所有路径都会经过 repair_json 容错解析
+    参数:
+        llm: ChatOpenAI 实例
+        system_message: 预编译的系统消息
+        conversation_text: 对话文本
+        model_cls: 目标 Pydantic 模型类
+        output_schema: LLM 需要生成的字段 schema
+        json_hint: 精简的 JSON 输出说明
+        parser: 旧方案的 PydanticOutputParser
+        format_instructions: 旧方案的格式说明
+        mode: 结构化输出模式，见 STRUCTURED_OUTPUT_MODES
+        endpoint_key: (base_url, model_id)，用于记录不支持的端点
+        defaults: 由系统填充字段的默认值
+        on_partial: 流式回调，提供时 json/parser 模式改为流式调用（tool 模式不支持流式）
+    返回:
+        model_cls 实例
+    """
+    defaults = defaults or {}
+    if mode not in STRUCTURED_OUTPUT_MODES:
+        mode = DEFAULT_STRUCTURED_OUTPUT_MODE
+    record_parse_stat('calls')  # 解析统计用于观察提示长度与解析失败率的变化，见 /check_llm_stats
+    if mode != 'parser' and (*endpoint_key, mode) not in unsupported_endpoints:
+        try:
+            if mode == 'tool':
+                structured_llm = llm.with_structured_output(output_schema, method='function_calling')
+                data = structured_llm.invoke([system_message, HumanMessage(content=f"对话内容：\n{conversation_text}")])
+                if not isinstance(data, dict):
+                    raise ValueError("LLM 未返回工具调用结果")
+            else:
+                user_prompt = f"{json_hint}\n对话内容：\n{conversation_text}"
+                record_parse_stat('prompt_chars', len(user_prompt))
+                content = invoke_content(
+                    llm.bind(response_format={'type': 'json_object'}),
+                    [system_message, HumanMessage(content=user_prompt)], on_partial
+                )
+                data = repair_json(content)
+            result = model_cls(**{**defaults, **data})
+            record_parse_stat(f'{mode}_ok')
+            return result
+        except ValueError as e:
+            # 解析或校验失败（pydantic ValidationError 也是 ValueError 子类）
+            record_parse_stat(f'{mode}_failed')
+            logger.warning(f"结构化输出解析失败，回退到 Parser 方案: {e}")
+        except BadRequestError as e:
+            # 端点不支持 response_format / tools 时记录下来，后续直接走旧方案；其他 400 错误（如上下文超长）照常抛出
+            if not is_unsupported_mode_error(e, mode):
+                raise
+            unsupported_endpoints.add((*endpoint_key, mode))
+            record_parse_stat(f'{mode}_unsupported')
+            logger.warning(f"端点 {endpoint_key[0]} ({endpoint_key[1]}) 不支持 {mode} 模式，回退到 Parser 方案: {e}")
     
-    # 用户提示，包含解析器格式说明和对话内容
-    user_prompt = f"{parser.get_format_instructions()}\n对话内容：\n{conversation_text}"
-    
-    # 调用 LLM，传入系统提示和用户提示
-    response = llm.invoke([SystemMessage(content=system_prompt), HumanMessage(content=user_prompt)])
-    
-    # 解析 LLM 的响应，生成 Problem 模型实例
-    problem = parser.parse(response.content)
-    
+    user_prompt = f"{format_instructions}\n对话内容：\n{conversation_text}"
+    record_parse_stat('prompt_chars', len(user_prompt))
+    content = invoke_content(llm, [system_message, HumanMessage(content=user_prompt)], on_partial)
+    try:
+        result = parser.parse(content)
+        record_parse_stat('parser_ok')
+        return result
+    except OutputParserException:
+        # 旧解析器失败时，尝试本地修复后再校验
+        result = model_cls(**{**defaults, **repair_json(content)})
+        record_parse_stat('parser_repaired')
+        return result
+
+def finalize_problem(problem, channel, guild_id, config, creation_time):
+    """填充由系统提供的字段（来源、时间戳、链接）
+    参数:
+        problem: Problem 模型实例
+        channel: Discord 频道对象
+        guild_id: 服务器 ID
+        config: 服务器配置
+        creation_time: 频道创建时间（datetime对象）
+    返回:
+        problem: 问题字典，符合用户指定格式
+    """
     # 设置来源（source）为频道名称
     problem.source = channel.name if is_ticket_channel(channel, config) else 'General Chat'
     
@@ -68,6 +320,7 @@ def analyze_ticket_conversation(conversation, channel, guild_id, config, llm_api
     
     # 新增：设置 Discord ticket channel 的链接
     problem.link = f"https://discord.com/channels/{guild_id}/{channel.id}"
+    problem.duplicate_of = 0  # 重复关联由去重流程填充，不采用 LLM 输出
     
     # 记录分析完成日志
     logger.info(f"对话分析完成，发现问题: {problem.problem_type}")
@@ -75,6 +328,79 @@ def analyze_ticket_conversation(conversation, channel, guild_id, config, llm_api
     # 返回问题字典
     return problem.dict()
 
+def analyze_ticket_conversation(conversation, channel, guild_id, config, llm_api_key, base_url, model_id, creation_time, on_partial=None):
+    """使用 LLM 分析 Ticket 频道的对话，生成问题反馈
+    参数:
+        conversation: 对话列表，每个元素包含 user, content, timestamp
+        channel: Discord 频道对象
+        guild_id: 服务器 ID
+        config: 服务器配置
+        llm_api_key: LLM API Key
+        base_url: LLM 基础 URL
+        model_id: LLM 模型 ID
+        creation_time: 频道创建时间（datetime对象）
+        on_partial: 可选的流式回调，problem_type、summary 等字段生成完毕时即被调用
+    返回:
+        problem: 问题字典，符合用户指定格式
+    """
+    # 将对话列表转换为文本格式，供 LLM 分析
+    conversation_text = "\n".join([f"{msg['user']}: {msg['content']}" for msg in conversation])
+    
+    # 初始化 LLM 客户端
+    llm = create_llm(llm_api_key, base_url, model_id)
+    
+    # 按服务器配置的结构化输出模式调用 LLM，并解析为 Problem 模型实例
+    problem = invoke_structured(
+        llm, TICKET_SYSTEM_MESSAGE, conversation_text, Problem, TICKET_OUTPUT_SCHEMA, TICKET_JSON_HINT,
+        TICKET_PARSER, TICKET_FORMAT_INSTRUCTIONS,
+        config.get('structured_output', DEFAULT_STRUCTURED_OUTPUT_MODE), (base_url, model_id),
+        defaults=TICKET_SYSTEM_FIELDS, on_partial=on_partial
+    )
+    
+    # 填充系统字段并返回问题字典
+    return finalize_problem(problem, channel, guild_id, config, creation_time)
+
+# 增量更新时 LLM 需要生成的字段：original 由系统在已有内容后追加新对话得到，无需重新生成
+TICKET_DELTA_OUTPUT_SCHEMA = {
+    **TICKET_OUTPUT_SCHEMA,
+    'properties': {k: v for k, v in TICKET_OUTPUT_SCHEMA['properties'].items() if k != 'original'},
+    'required': [k for k in TICKET_OUTPUT_SCHEMA['required'] if k != 'original'],
+}
+TICKET_DELTA_JSON_HINT = (
+    "下面给出该 Ticket 已有的分析结果和之后新增的对话，请结合新增对话更新分析结果（包括 is_valid）。"
+    + build_json_hint(TICKET_DELTA_OUTPUT_SCHEMA)
+)
+
+def update_ticket_analysis(draft, new_conversation, channel, guild_id, config, llm_api_key, base_url, model_id, creation_time):
+    """基于已有分析结果和新增对话，使用短小的增量提示更新 Ticket 问题草稿
+    参数:
+        draft: 已有的问题字典
+        new_conversation: 新增对话列表（按时间正序）
+        channel: Discord 频道对象
+        guild_id: 服务器 ID
+        config: 服务器配置
+        llm_api_key: LLM API Key
+        base_url: LLM 基础 URL
+        model_id: LLM 模型 ID
+        creation_time: 频道创建时间（datetime对象）
+    返回:
+        problem: 更新后的问题字典
+    """
+    previous = {key: draft[key] for key in TICKET_DELTA_OUTPUT_SCHEMA['properties']}
+    new_text = "\n".join([f"{msg['user']}: {msg['content']}" for msg in new_conversation])
+    conversation_text = f"已有分析结果：\n{json.dumps(previous, ensure_ascii=False)}\n新增对话：\n{new_text}"
+    original = f"{draft['original']}\n{new_text}".strip()
+    
+    llm = create_llm(llm_api_key, base_url, model_id)
+    problem = invoke_structured(
+        llm, TICKET_SYSTEM_MESSAGE, conversation_text, Problem, TICKET_DELTA_OUTPUT_SCHEMA, TICKET_DELTA_JSON_HINT,
+        TICKET_PARSER, TICKET_FORMAT_INSTRUCTIONS,
+        config.get('structured_output', DEFAULT_STRUCTURED_OUTPUT_MODE), (base_url, model_id),
+        defaults={**TICKET_SYSTEM_FIELDS, 'original': original}
+    )
+    problem.original = original
+    return finalize_problem(problem, channel, guild_id, config, creation_time)
+
 def analyze_general_conversation(conversation, channel, guild_id, config, llm_api_key, base_url, model_id):
     """使用 LLM 分析 General Chat 的对话，生成总结报告
     参数:
@@ -92,31 +418,57 @@ def analyze_general_conversation(conversation, channel, guild_id, config, llm_ap
     conversation_text = "\n".join([f"{msg['user']}: {msg['content']}" for msg in conversation])
     
     # 初始化 LLM 客户端
-    llm = ChatOpenAI(openai_api_key=llm_api_key, base_url=base_url, model=model_id)
-    
-    # 创建 Pydantic 解析器，确保输出符合 GeneralSummary 模型
-    parser = PydanticOutputParser(pydantic_object=GeneralSummary)
+    llm = create_llm(llm_api_key, base_url, model_id)
     
-    # 系统提示，指导 LLM 分析 General Chat 对话
-    system_prompt = (
-        "你是一个自身的Discord社区管理员和，尤其拥有丰富的web3社区和项目管理经验。"
-        "你熟悉各种Crypto和Discord的俚语与专有名词，并且精通舆情控制和品牌形象管理。"
-        "你的任务是分析 Discord 社区内日常讨论频道的对话内容，理解讨论焦点、当下舆情、社区情绪。"
-        "主要目的是帮助团队进行社区管理与舆情监控，报告应使用专业的中文，需包括："
-        "- emotion（整体情绪，如积极、消极、中立等）"
-        "- discussion_summary（讨论概述，新闻播报风格，简明扼要）"
-        "- key_events（重点关注事件，如产品问题、情绪性发言等，默认‘无’）"
-        "- suggestion（针对当前情况的一针见血的建议，通常无特殊情况保持为空）"
+    # 按服务器配置的结构化输出模式调用 LLM，并解析为 GeneralSummary 模型实例
+    summary = invoke_structured(
+        llm, GENERAL_SYSTEM_MESSAGE, conversation_text, GeneralSummary, GENERAL_OUTPUT_SCHEMA, GENERAL_JSON_HINT,
+        GENERAL_PARSER, GENERAL_FORMAT_INSTRUCTIONS,
+        config.get('structured_output', DEFAULT_STRUCTURED_OUTPUT_MODE), (base_url, model_id)
     )
     
-    # 用户提示，包含解析器格式说明和对话内容
-    user_prompt = f"{parser.get_format_instructions()}\n对话内容：\n{conversation_text}"
-    
-    # 调用 LLM
-    response = llm.invoke([SystemMessage(content=system_prompt), HumanMessage(content=user_prompt)])
-    
-    # 解析 LLM 响应，生成 GeneralSummary 模型实例
-    summary = parser.parse(response.content)
-    
     # 返回总结字典
-    return summary.dict()
\ No newline at end of file
+    return summary.dict()
+
+# 初筛提示：只判断是否有效，输出极短，供廉价模型快速过滤无效 Ticket
+TRIAGE_SYSTEM_MESSAGE = SystemMessage(content=(
+    "你是 web3 Discord 社区的 Ticket 初筛员。判断对话是否构成需要团队跟进的有效问题"
+    "（如 Bug、功能建议、账户/资产问题）。单纯情绪宣泄、催促发币（wen token）、闲聊、未描述问题的均为无效。"
+    "只输出 JSON：{\"is_valid\": true} 或 {\"is_valid\": false}"
+))
+TRIAGE_MAX_CHARS = 2000  # 初筛只看按时间正序的对话前 2000 个字符（用户最先描述问题的部分），进一步压缩成本
+
+def parse_bool(value):
+    """严格解析 LLM 输出的布尔值，接受 true/false（含字符串形式），其他值抛出 ValueError
+    参数:
+        value: JSON 中的字段值
+    返回:
+        bool
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ValueError(f"无法解析为布尔值: {value!r}")
+
+def triage_ticket_conversation(conversation, llm_api_key, base_url, model_id):
+    """使用廉价模型和短提示快速判断 Ticket 是否有效（级联分析的第一级）
+    参数:
+        conversation: 对话列表（按时间倒序，与 get_conversation 一致）
+        llm_api_key: LLM API Key
+        base_url: LLM 基础 URL
+        model_id: 初筛模型 ID
+    返回:
+        bool: 是否可能为有效问题；输出无法解析时返回 True，交由完整分析判断
+    """
+    # 按时间正序截断，保留 Ticket 开头的问题描述，而不是最新的几条回复
+    conversation_text = "\n".join([f"{msg['user']}: {msg['content']}" for msg in reversed(conversation)])[:TRIAGE_MAX_CHARS]
+    llm = create_llm(llm_api_key, base_url, model_id, max_tokens=16)
+    response = llm.invoke([TRIAGE_SYSTEM_MESSAGE, HumanMessage(content=conversation_text)])
+    try:
+        is_valid = parse_bool(repair_json(response.content).get('is_valid', True))
+    except ValueError:
+        logger.warning(f"初筛输出无法解析，交由完整分析判断: {response.content!r}")
+        return True
+    logger.info(f"Ticket 初筛完成，结果: {is_valid}")
+    return is_valid
@@ -0,0 +1,426 @@
+import time
+import asyncio
+import logging
+import functools
+import itertools
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from endpoint_guard import EndpointRegistry, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别，数值越小越优先
+PRIORITY_INTERACTIVE = 0  # 手动触发的分析（/warp_msg）
+PRIORITY_TICKET = 1  # Ticket 自动分析、初筛和后台草稿更新
+PRIORITY_SUMMARY = 2  # 监控频道定时总结和历史回填
+PRIORITY_NAMES = ('interactive', 'ticket', 'summary')
+
+DEFAULT_LLM_CONCURRENCY = 8  # 本进程同时进行的 LLM 调用数
+DEFAULT_RESERVATIONS = (2, 1, 0)  # 各类别预留的并发数，其他类别不能占用
+AGING_SECONDS = 30  # 排队每满该时长，等待者的优先级提升一级，保证后台任务不会饿死
+WAIT_SAMPLES = 500  # 每个类别保留的最近排队耗时样本数
+
+DEFAULT_HEDGE_PERCENTILE = 0.9  # 调用耗时超过同类调用该分位数时向备用模型发出对冲请求，0 表示关闭
+HEDGE_MIN_SAMPLES = 20  # 同类调用样本不足时使用 HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = 30.0  # 样本不足时的对冲等待时长（秒）
+HEDGE_MIN_DELAY = 2.0  # 对冲等待时长下限，避免快速调用几乎全部被对冲
+LATENCY_SAMPLES = 200  # 每种调用类型保留的最近主调用耗时样本数
+DEFAULT_DEADLINES = (120, 300, 600)  # 各类别调用（含排队和对冲）的截止时长（秒），超时抛出 TimeoutError
+
+def scale_reservations(concurrency, reservations=DEFAULT_RESERVATIONS):
+    """
+    按最大并发数缩减预留：预留总和必须小于 concurrency，不足时从低优先级类别开始逐个减少，
+    例如 concurrency 为 3 时 (2, 1, 0) 缩减为 (2, 0, 0)，为 1 时不预留。
+
+    Args:
+        concurrency (int): 最大并发 LLM 调用数，至少为 1
+        reservations (tuple): 各类别期望预留的并发数
+
+    Returns:
+        tuple: 可用于 LLMScheduler 的预留
+    """
+    if concurrency < 1:
+        raise ValueError(f"最大并发数必须至少为 1，当前为 {concurrency}")
+    scaled = list(reservations)
+    for p in reversed(range(len(scaled))):
+        while scaled[p] and sum(scaled) >= concurrency:
+            scaled[p] -= 1
+    return tuple(scaled)
+
+def percentile(values, q):
+    """按最近秩法计算分位数，values 为空时返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+class HedgeStats:
+    """对冲请求统计：按调用类型记录主调用耗时（决定对冲等待时长），以及对冲次数、备用胜出次数和节省的时间"""
+    def __init__(self, min_delay=HEDGE_MIN_DELAY, default_delay=HEDGE_DEFAULT_DELAY):
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.latencies = {}  # 调用类型 -> 最近的主调用耗时（秒）
+        self.calls = 0
+        self.hedged = 0  # 主调用超过分位数耗时后发出的对冲请求数
+        self.fallbacks = 0  # 主调用失败后改用备用模型的次数
+        self.fallback_wins = 0  # 备用请求先返回有效结果的次数
+        self.saved_seconds = 0.0  # 备用胜出且主调用随后完成时，主调用比备用多耗费的时间之和
+        self.deadline_exceeded = 0
+
+    def delay(self, call_type, q):
+        """该类调用的对冲等待时长：最近主调用耗时的 q 分位数"""
+        samples = self.latencies.get(call_type)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return self.default_delay
+        return max(percentile(samples, q), self.min_delay)
+
+    def record(self, call_type, seconds):
+        samples = self.latencies.get(call_type)
+        if samples is None:
+            samples = self.latencies[call_type] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append(seconds)
+
+    def snapshot(self):
+        return {
+            'calls': self.calls, 'hedged': self.hedged, 'fallbacks': self.fallbacks,
+            'fallback_wins': self.fallback_wins, 'saved_seconds': self.saved_seconds,
+            'deadline_exceeded': self.deadline_exceeded,
+        }
+
+class LLMScheduler:
+    """
+    本进程共享的 LLM 调用调度器：所有 LLM 调用在调度器的专用线程池中执行，并发数有上限。
+    - 按优先级类别分配空闲并发：交互请求优先，其次是 Ticket 自动分析，最后是定时总结和回填。
+    - 每个类别有预留并发，其他类别即使排队再多也不能占用，/warp_msg 不会排在一批监控总结之后。
+    - 老化：排队时间越长有效优先级越高，持续的 Ticket 流量下定时总结仍能按时完成。
+    - 每个 LLM 接口另有自适应并发上限和断路器（见 endpoint_guard），等待慢接口的调用不占用全局并发，
+      断路的接口直接失败，不影响其他接口的调用。
+    - run_hedged()：调用有截止时长；耗时超过同类调用的分位数时向备用模型发出对冲请求，先返回有效结果的一方胜出。
+    """
+    def __init__(self, concurrency=DEFAULT_LLM_CONCURRENCY, reservations=DEFAULT_RESERVATIONS, aging_seconds=AGING_SECONDS,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE, deadlines=DEFAULT_DEADLINES):
+        """
+        Args:
+            concurrency (int): 最大并发 LLM 调用数
+            reservations (tuple): 各类别预留的并发数，总和必须小于 concurrency
+            aging_seconds (float): 优先级提升一级所需的排队时长
+            hedge_percentile (float): 对冲分位数（0~1），0 表示不发出对冲请求（主调用失败时仍改用备用模型）
+            deadlines (tuple): 各类别 run_hedged() 的截止时长（秒）
+        """
+        if sum(reservations) >= concurrency:
+            raise ValueError(f"预留并发总数（{sum(reservations)}）必须小于最大并发数（{concurrency}）")
+        self.concurrency = concurrency
+        self.reservations = tuple(reservations)
+        self.aging_seconds = aging_seconds
+        self.running = [0] * len(PRIORITY_NAMES)
+        self.waiters = []  # [优先级, 入队时间, 序号, Future, EndpointGuard]
+        self.sequence = itertools.count()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='llm')
+        self.waits = [deque(maxlen=WAIT_SAMPLES) for _ in PRIORITY_NAMES]  # 各类别最近的排队耗时（秒）
+        self.completed = [0] * len(PRIORITY_NAMES)
+        self.endpoints = EndpointRegistry()
+        self.hedge_percentile = hedge_percentile
+        self.deadlines = tuple(deadlines)
+        self.hedges = HedgeStats()
+
+    def available(self, priority):
+        """该类别当前能否开始一次调用：空闲并发数需多于其他类别尚未用满的预留"""
+        free = self.concurrency - sum(self.running)
+        held = sum(max(reserved - running, 0) for p, (reserved, running) in enumerate(zip(self.reservations, self.running)) if p != priority)
+        return free > held
+
+    def dispatch(self):
+        """按有效优先级（类别 - 排队时长 / aging_seconds）依次唤醒可以开始的等待者；所在接口已断路的等待者直接失败"""
+        for waiter in self.waiters:
+            guard = waiter[4]
+            if guard is not None and not waiter[3].done():
+                try:
+                    guard.check()
+                except CircuitOpenError as e:
+                    waiter[3].set_exception(e)
+        self.waiters = [waiter for waiter in self.waiters if not waiter[3].done()]
+        now = time.monotonic()
+        while self.waiters:
+            eligible = [waiter for waiter in self.waiters if self.available(waiter[0]) and (waiter[4] is None or waiter[4].can_start())]
+            if not eligible:
+                return
+            waiter = min(eligible, key=lambda w: (w[0] - (now - w[1]) / self.aging_seconds, w[2]))
+            self.waiters.remove(waiter)
+            self.running[waiter[0]] += 1
+            if waiter[4] is not None:
+                waiter[4].on_start()
+            waiter[3].set_result(None)
+
+    async def acquire(self, priority, guard=None):
+        """等待一个并发名额（指定接口时同时需要该接口的名额）"""
+        future = asyncio.get_running_loop().create_future()
+        start = time.monotonic()
+        self.waiters.append([priority, start, next(self.sequence), future, guard])
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                if guard is not None:
+                    guard.in_flight -= 1
+                self.release(priority)  # 名额已分配但等待者被取消
+            else:
+                self.dispatch()
+            raise
+        self.waits[priority].append(time.monotonic() - start)
+
+    def release(self, priority):
+        self.running[priority] -= 1
+        self.dispatch()
+
+    async def run(self, priority, func, *args, endpoint=None, call_type=None, on_start=None):
+        """
+        按优先级排队后在专用线程池中执行同步 LLM 调用（代替 asyncio.to_thread，保留 token 用量归属等上下文）。
+
+        Args:
+            priority (int): 优先级类别
+            func (callable): 同步调用函数
+            *args: 调用参数
+            endpoint (tuple): 可选，调用的 LLM 接口（guard_key() 返回的 base_url 与密钥摘要），启用该接口的自适应并发和断路器
+            call_type (str): 调用类型，接口延迟按类型分别统计，默认取函数名
+            on_start (callable): 可选，取得名额、调用即将在线程池中执行时回调（之后取消任务无法中断调用）
+
+        Returns:
+            调用结果
+
+        Raises:
+            CircuitOpenError: 接口处于断路状态
+        """
+        guard = self.endpoints.get(endpoint) if endpoint else None
+        if guard is not None:
+            guard.check()  # 断路时直接失败，不排队
+        await self.acquire(priority, guard)
+        start = time.monotonic()
+        error = None
+        try:
+            if on_start is not None:
+                on_start()
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(context.run, func, *args))
+        except BaseException as e:
+            error = e  # 被取消（如对冲请求的另一方已胜出）时不计入接口健康和延迟
+            raise
+        finally:
+            if guard is not None:
+                guard.on_finish(time.monotonic() - start, error, call_type or func.__name__)
+            self.completed[priority] += 1
+            self.release(priority)
+
+    async def run_hedged(self, priority, call_type, primary, fallback=None, deadline=None):
+        """
+        带截止时长和对冲的 LLM 调用：主调用耗时超过同类调用的 hedge_percentile 分位数时，
+        向备用模型（如服务器自定义接口较慢时改用默认 MODEL_ID）发出同样的请求，先返回有效结果（解析成功）的一方胜出；
+        主调用失败时立即改用备用模型。超时或已有胜出结果时，仍在排队的调用直接取消，不再消耗 token；
+        已在执行的调用在后台完成（同步调用无法中断），结果丢弃，只用于统计。
+
+        Args:
+            priority (int): 优先级类别
+            call_type (str): 调用类型，对冲等待时长按类型分别统计
+            primary (tuple): 主调用 (func, args, endpoint)
+            fallback (tuple): 可选，备用调用 (func, args, endpoint)
+            deadline (float): 截止时长（秒），默认按优先级类别取 deadlines
+
+        Returns:
+            先返回的有效结果
+
+        Raises:
+            TimeoutError: 超过截止时长仍没有有效结果
+            Exception: 主调用和备用调用均失败时抛出最后一个异常
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        end = start + (deadline or self.deadlines[priority])
+        stats = self.hedges
+        stats.calls += 1
+
+        started = set()  # 已开始执行（不再能取消）的调用
+
+        def launch(call):
+            func, args, endpoint = call
+            task = asyncio.ensure_future(self.run(priority, func, *args, endpoint=endpoint, call_type=call_type,
+                                                  on_start=lambda: started.add(task)))
+            return task
+
+        def abandon(tasks):
+            for task in tasks:
+                if task in started:
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())  # 后台完成，避免未读取异常的警告
+                else:
+                    task.cancel()  # 仍在排队，取消后释放排队位置
+
+        primary_task = launch(primary)
+        hedge_at = start + stats.delay(call_type, self.hedge_percentile) if fallback and self.hedge_percentile else None
+        fallback_task = None
+        pending = {primary_task}
+        error = None
+        while True:
+            now = loop.time()
+            if now >= end:
+                stats.deadline_exceeded += 1
+                abandon(pending)
+                raise TimeoutError(f"LLM 调用（{call_type}）超过截止时长 {end - start:.0f} 秒")
+            timeout = end - now
+            if hedge_at is not None and fallback_task is None:
+                timeout = min(timeout, max(hedge_at - now, 0))
+            try:
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                abandon(pending)  # 调用方被取消
+                raise
+            for task in done:
+                try:
+                    result = task.result()
+                except Exception as e:
+                    error = e
+                    continue
+                elapsed = loop.time() - start
+                if task is primary_task:
+                    stats.record(call_type, elapsed)
+                else:
+                    stats.fallback_wins += 1
+                    primary_task.add_done_callback(lambda t: self.settle_primary(t, call_type, start, elapsed))
+                abandon(pending)
+                return result
+            if fallback and fallback_task is None and (primary_task.done() or (hedge_at is not None and loop.time() >= hedge_at)):
+                if primary_task.done():
+                    stats.fallbacks += 1
+                    logger.warning(f"LLM 调用（{call_type}）失败，改用备用模型: {error}")
+                else:
+                    stats.hedged += 1
+                    logger.info(f"LLM 调用（{call_type}）已耗时 {loop.time() - start:.1f} 秒，向备用模型发出对冲请求")
+                fallback_task = launch(fallback)
+                pending.add(fallback_task)
+            if not pending:
+                raise error
+
+    def settle_primary(self, task, call_type, start, fallback_elapsed):
+        """备用请求胜出后主调用完成：记录主调用耗时（慢调用同样计入分位数），累计节省的时间"""
+        if task.cancelled() or task.exception() is not None:
+            return
+        elapsed = asyncio.get_running_loop().time() - start
+        self.hedges.record(call_type, elapsed)
+        self.hedges.saved_seconds += max(elapsed - fallback_elapsed, 0)
+
+    def endpoint_snapshot(self, endpoint):
+        """LLM 接口的自适应并发与断路器状态，尚未调用过时返回 None"""
+        guard = self.endpoints.guards.get(endpoint)
+        return guard.snapshot() if guard else None
+
+    def snapshot(self):
+        """
+        各类别的调度状态。
+
+        Returns:
+            dict: 类别名 -> {'running', 'waiting', 'completed', 'wait_p50', 'wait_p99'}（排队耗时单位为秒）
+        """
+        waiting = [0] * len(PRIORITY_NAMES)
+        for waiter in self.waiters:
+            if not waiter[3].done():
+                waiting[waiter[0]] += 1
+        return {
+            name: {
+                'running': self.running[p], 'waiting': waiting[p], 'completed': self.completed[p],
+                'wait_p50': percentile(self.waits[p], 0.5), 'wait_p99': percentile(self.waits[p], 0.99),
+            }
+            for p, name in enumerate(PRIORITY_NAMES)
+        }
+
+class FifoScheduler:
+    """对照组：不区分优先级的先到先服务信号量（与 asyncio.to_thread 默认线程池排队等价），仅用于 bench()"""
+    def __init__(self, concurrency):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def run(self, priority, func, *args):
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+def bench(duration=60.0, concurrency=8, summary_batches=3, summaries_per_batch=40, ticket_rate=0.5, interactive_rate=0.5, latency=2.0, speed=10.0):
+    """
+    模拟监控周期集中触发大量总结、持续的 Ticket 自动分析和随机到达的 /warp_msg，
+    对比先到先服务与优先级调度下各类别的端到端耗时（排队加调用；模拟时间按 speed 倍加速，输出换算回实际秒数）。
+    """
+    import random
+
+    async def simulate(scheduler):
+        rng = random.Random(0)
+        latencies = {name: [] for name in PRIORITY_NAMES}
+        tasks = []
+
+        def call():
+            time.sleep(latency * rng.uniform(0.5, 1.5) / speed)
+
+        async def submit(priority, delay):
+            await asyncio.sleep(delay / speed)
+            start = time.monotonic()
+            await scheduler.run(priority, call)
+            latencies[PRIORITY_NAMES[priority]].append((time.monotonic() - start) * speed)
+
+        for batch in range(summary_batches):
+            tasks += [submit(PRIORITY_SUMMARY, batch * duration / summary_batches) for _ in range(summaries_per_batch)]
+        for priority, rate in ((PRIORITY_TICKET, ticket_rate), (PRIORITY_INTERACTIVE, interactive_rate)):
+            t = rng.expovariate(rate)
+            while t < duration:
+                tasks.append(submit(priority, t))
+                t += rng.expovariate(rate)
+        await asyncio.gather(*tasks)
+        return latencies
+
+    for name, factory in (('先到先服务', lambda: FifoScheduler(concurrency)), ('优先级调度', lambda: LLMScheduler(concurrency, aging_seconds=AGING_SECONDS / speed))):
+        latencies = asyncio.run(simulate(factory()))
+        print(f"{name}: " + '；'.join(
+            f"{cls} {len(values)} 次 p50 {percentile(values, 0.5):.1f}s p99 {percentile(values, 0.99):.1f}s"
+            for cls, values in latencies.items()
+        ))
+
+def bench_hedging(calls=400, rate=4.0, slow_ratio=0.1, speed=20.0, hedge_percentile=DEFAULT_HEDGE_PERCENTILE):
+    """
+    模拟服务器自定义接口偶发变慢（slow_ratio 的调用耗时 20~60 秒，其余 2~4 秒），备用模型稳定在 3~5 秒，
+    对比不对冲与按分位数对冲时的端到端耗时、对冲比例和节省的时间（模拟时间按 speed 倍加速，输出换算回实际秒数）。
+    """
+    import random
+
+    async def simulate(percentile_q):
+        rng = random.Random(0)
+        scheduler = LLMScheduler(64, hedge_percentile=percentile_q)
+        scheduler.hedges = HedgeStats(HEDGE_MIN_DELAY / speed, HEDGE_DEFAULT_DELAY / speed)
+        latencies = []
+
+        def primary(slow):
+            time.sleep((rng.uniform(20, 60) if slow else rng.uniform(2, 4)) / speed)
+            return 'primary'
+
+        def fallback():
+            time.sleep(rng.uniform(3, 5) / speed)
+            return 'fallback'
+
+        async def submit(delay, slow):
+            await asyncio.sleep(delay / speed)
+            start = time.monotonic()
+            await scheduler.run_hedged(PRIORITY_TICKET, 'ticket_full', (primary, (slow,), None), (fallback, (), None))
+            latencies.append((time.monotonic() - start) * speed)
+
+        t, tasks = 0.0, []
+        for _ in range(calls):
+            t += rng.expovariate(rate)
+            tasks.append(submit(t, rng.random() < slow_ratio))
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(60 / speed)  # 等待未胜出的主调用完成，计入节省的时间
+        scheduler.executor.shutdown()
+        return latencies, scheduler.hedges.snapshot()
+
+    for name, q in (('不对冲', 0), (f'p{hedge_percentile * 100:.0f} 对冲', hedge_percentile)):
+        latencies, stats = asyncio.run(simulate(q))
+        print(f"{name}: {len(latencies)} 次 p50 {percentile(latencies, 0.5):.1f}s p99 {percentile(latencies, 0.99):.1f}s；"
+              f"对冲 {stats['hedged']} 次（{stats['hedged'] / stats['calls']:.1%}），备用胜出 {stats['fallback_wins']} 次，"
+              f"节省 {stats['saved_seconds'] * speed:.0f}s")
+
+if __name__ == "__main__":
+    bench()
+    bench_hedging()
@@ -0,0 +1,182 @@
+import atexit
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_MAX_BYTES = 5 * 1024 * 1024  # 单个日志文件最大 5MB
+LOG_BACKUP_COUNT = 5  # 保留 5 个备份文件
+
+class JsonFormatter(logging.Formatter):
+    """结构化 JSON 日志格式，每行一个对象，便于日志平台采集"""
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    """
+    按调用位置（logger 名称 + 源码行）限速，每个位置在 interval 秒内最多输出 burst 条低于 WARNING 的日志。
+    - 本仓库日志普遍使用 f-string，同一位置的消息文本各不相同，因此按调用位置而非消息模板限速。
+    - 被丢弃的条数记录在该位置下一条放行日志的 suppressed 属性中，并追加到消息末尾。
+    - 只在 QueueListener 线程中调用，无需加锁。
+    """
+    def __init__(self, burst=30, interval=60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}  # (name, pathname, lineno) -> [窗口开始时间, 已放行条数, 已丢弃条数]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            suppressed = window[2] if window else 0
+            self.windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+                record.msg = f"{record.getMessage()}（前一周期内同位置日志被限速丢弃 {suppressed} 条）"
+                record.args = None
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+class FilteringQueueListener(QueueListener):
+    """在监听线程中统一应用过滤器后再分发给各个 Handler，过滤器只需挂载一次"""
+    def __init__(self, log_queue, *handlers, filters=(), respect_handler_level=True):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.filters = list(filters)
+
+    def handle(self, record):
+        if all(f.filter(record) for f in self.filters):
+            super().handle(record)
+
+    def stop(self):
+        if self._thread is not None:  # 允许重复调用（如手动停止后 atexit 再次调用）
+            super().stop()
+
+def start_queue_logging(target_logger, handlers, filters=()):
+    """
+    将 logger 的输出改为写入内存队列，由后台监听线程完成格式化和磁盘/控制台写入，
+    事件循环线程只做一次入队操作，磁盘阻塞不会再影响 Discord 网关延迟。
+
+    Args:
+        target_logger (logging.Logger): 目标 logger
+        handlers (list): 实际输出的 Handler（在监听线程中执行）
+        filters (list): 在监听线程中统一应用的过滤器
+
+    Returns:
+        FilteringQueueListener: 已启动的监听器，进程退出时自动停止并刷新剩余日志
+    """
+    log_queue = queue.SimpleQueue()
+    for handler in list(target_logger.handlers):
+        target_logger.removeHandler(handler)
+    target_logger.addHandler(QueueHandler(log_queue))
+    listener = FilteringQueueListener(log_queue, *handlers, filters=filters)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def setup_logging(log_file='bot.log', heartbeat_file='heartbeat.log', json_format=False, rate_limit=None, filters=()):
+    """
+    配置主日志与心跳日志的队列化输出。
+
+    Args:
+        log_file (str): 主日志文件路径
+        heartbeat_file (str): 心跳日志文件路径
+        json_format (bool): 是否使用结构化 JSON 格式
+        rate_limit (tuple): 可选的 (burst, interval)，对 INFO 及以下的高频日志按调用位置限速
+        filters (list): 额外的过滤器（如 NoGetUpdatesFilter），只在主日志监听线程中应用一次
+
+    Returns:
+        tuple: (主日志监听器, 心跳日志监听器)
+    """
+    formatter = JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT)
+    file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    all_filters = list(filters)
+    if rate_limit:
+        all_filters.append(RateLimitFilter(*rate_limit))
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    listener = start_queue_logging(root, [file_handler, stream_handler], all_filters)
+
+    # 心跳日志额外单独写文件
+    heartbeat_handler = RotatingFileHandler(heartbeat_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    heartbeat_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter('%(asctime)s - %(message)s'))
+    heartbeat_logger = logging.getLogger('heartbeat')
+    heartbeat_logger.setLevel(logging.INFO)
+    heartbeat_listener = start_queue_logging(heartbeat_logger, [heartbeat_handler])
+    return listener, heartbeat_listener
+
+def parse_rate_limit(value):
+    """解析 LOG_RATE_LIMIT 环境变量（如 "30/60" 表示每个调用位置 60 秒内最多 30 条），"off" 或空表示关闭"""
+    if not value or value.lower() == 'off':
+        return None
+    burst, _, interval = value.partition('/')
+    return int(burst), float(interval or 60)
+
+def bench(count=20000, stall_ms=5.0):
+    """
+    对比直接写文件与队列化日志在调用线程上的耗时，并模拟磁盘抖动（每 1000 条阻塞 stall_ms 毫秒）。
+
+    Args:
+        count (int): 日志条数
+        stall_ms (float): 模拟的磁盘阻塞时长（毫秒）
+    """
+    import os
+    import tempfile
+
+    class StallingHandler(RotatingFileHandler):
+        """每 1000 条模拟一次磁盘阻塞"""
+        def emit(self, record):
+            self.emitted = getattr(self, 'emitted', 0) + 1
+            if self.emitted % 1000 == 0:
+                time.sleep(stall_ms / 1000)
+            super().emit(record)
+
+    directory = tempfile.mkdtemp()
+    for name in ('直接写入', '队列写入'):
+        bench_logger = logging.getLogger(f'logging_setup.bench.{name}')
+        bench_logger.propagate = False
+        bench_logger.setLevel(logging.INFO)
+        handler = StallingHandler(os.path.join(directory, f'{name}.log'), maxBytes=LOG_MAX_BYTES, backupCount=1)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        listener = None
+        if name == '队列写入':
+            listener = start_queue_logging(bench_logger, [handler])
+        else:
+            bench_logger.addHandler(handler)
+        latencies = []
+        for i in range(count):
+            t = time.perf_counter()
+            bench_logger.info(f"处理消息，频道: ticket-{i}，发送者: user-{i}")
+            latencies.append(time.perf_counter() - t)
+            if i % 100 == 0:
+                time.sleep(0.001)  # 模拟事件循环的空闲间隙，让监听线程有机会写盘
+        if listener:
+            listener.stop()
+        latencies.sort()
+        print(f"{name}: 平均 {sum(latencies) / count * 1e6:.1f} us/条，p99 {latencies[int(count * 0.99)] * 1e6:.1f} us，"
+              f"阻塞超过 1 ms 的调用 {sum(1 for x in latencies if x > 0.001)} 次，最坏 {latencies[-1] * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    bench()
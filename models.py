@@ -13,6 +13,7 @@ class Problem(BaseModel):
     is_valid: bool  # 是否有效
     id: int = 0  # 问题 ID，默认值为 0
     link: str = ""  # 新增：Ticket channel 的跳转链接，格式为 Discord URL
+    duplicate_of: int = 0  # 重复问题关联的首个问题 ID，0 表示非重复
 
 # General Chat 总结模型
 class GeneralSummary(BaseModel):
@@ -0,0 +1,70 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 预过滤模式：off 关闭；shadow 只记录判断结果并与 LLM 对比，不拦截；on 直接拦截明显无效的 Ticket
+PREFILTER_MODES = ('off', 'shadow', 'on')
+
+# 默认阈值，可通过服务器配置 prefilter 覆盖；默认只以影子模式记录，确认与 LLM 判断的一致率后再通过 /set_prefilter 开启拦截
+DEFAULT_PREFILTER_CONFIG = {
+    'mode': 'shadow',
+    'min_user_messages': 1,  # 用户（非 Bot）消息数下限
+    'min_user_chars': 8,  # 去除表情、标点、空白后的用户文本长度下限（中文等非 ASCII 字符计 2）
+}
+
+# 问题关键词：命中任一即放行，避免误杀简短但有效的问题
+ISSUE_KEYWORDS = (
+    'bug', 'error', 'fail', 'failed', 'issue', 'problem', 'cannot', "can't", 'unable', 'stuck', 'missing',
+    'wallet', 'transaction', 'tx', 'withdraw', 'deposit', 'claim', 'bridge', 'stake', 'swap', 'scam', 'hack',
+    '报错', '错误', '失败', '无法', '不能', '异常', '卡住', '丢失', '没收到', '未到账', '钱包', '交易',
+    '提现', '充值', '领取', '跨链', '质押', '被盗', '诈骗', '建议', '问题',
+)
+
+# 噪音内容：问候、催促发币、感谢等，不构成问题
+NOISE_PATTERNS = (
+    r'hi+', r'hello+', r'hey+', r'gm+', r'gn+', r'yo+', r'sup', r'ok(ay)?', r'thx', r'thanks?( you)?', r'ty',
+    r'wen( token| airdrop| launch| tge| listing)?\??', r'when token\??', r'any (news|update)s?\??',
+    r'你好', r'您好', r'在吗', r'在不在', r'有人吗', r'哈+', r'谢谢', r'好的', r'嗯+', r'什么时候(发币|空投|上线)\??',
+)
+
+# 英文关键词按单词边界匹配（避免 tx 命中 context），中文关键词直接匹配子串
+ISSUE_KEYWORD_RE = re.compile(
+    r'\b(?:' + '|'.join(re.escape(k) for k in ISSUE_KEYWORDS if k.isascii()) + r')\b|'
+    + '|'.join(re.escape(k) for k in ISSUE_KEYWORDS if not k.isascii()),
+    re.IGNORECASE
+)
+NOISE_RE = re.compile(r'^(?:' + '|'.join(NOISE_PATTERNS) + r')[\s!?.,。！？~]*$', re.IGNORECASE)
+# 去除 Discord 自定义表情、@提及、Unicode 表情/符号、标点和空白后剩余的有效字符
+STRIP_RE = re.compile(r'<a?:\w+:\d+>|<[@#][!&]?\d+>|[\W_]+', re.UNICODE)
+
+def get_prefilter_config(config):
+    """合并服务器配置与默认阈值
+    参数:
+        config: 服务器配置
+    返回:
+        dict: 完整的预过滤配置
+    """
+    return {**DEFAULT_PREFILTER_CONFIG, **config.get('prefilter', {})}
+
+def prefilter_ticket(conversation, prefilter_config):
+    """基于规则、关键词与消息数/长度特征，在本地判断 Ticket 是否明显不构成问题
+    参数:
+        conversation: 对话列表，每个元素包含 user, content, is_bot
+        prefilter_config: 预过滤配置，见 DEFAULT_PREFILTER_CONFIG
+    返回:
+        tuple: (是否放行, 原因)
+    """
+    user_messages = [msg['content'] for msg in conversation if not msg.get('is_bot') and msg['content'].strip()]
+    if not user_messages:
+        return False, 'no_user_reply'  # 只有 Ticket Bot 打开的模板，用户未回复
+    if any(ISSUE_KEYWORD_RE.search(content) for content in user_messages):
+        return True, 'issue_keyword'
+    if all(NOISE_RE.match(content.strip()) for content in user_messages):
+        return False, 'noise_only'
+    if len(user_messages) < prefilter_config['min_user_messages']:
+        return False, 'too_few_messages'
+    user_chars = sum(1 if ch.isascii() else 2 for content in user_messages for ch in STRIP_RE.sub('', content))
+    if user_chars < prefilter_config['min_user_chars']:
+        return False, 'too_short'  # 只有表情、标点或极短的回复
+    return True, 'passed'
\ No newline at end of file
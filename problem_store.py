@@ -0,0 +1,347 @@
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# 问题库文件路径常量
+PROBLEM_DB_FILE = 'problems.db'
+
+# 可导出的表及其列（按导出顺序）
+EXPORT_COLUMNS = {
+    'problems': ('rowid', 'id', 'guild_id', 'problem_type', 'summary', 'details', 'source', 'user', 'original',
+                 'timestamp', 'link', 'created_at', 'duplicate_of'),
+    'summaries': ('rowid', 'guild_id', 'channel_id', 'channel_name', 'emotion', 'discussion_summary', 'key_events',
+                  'suggestion', 'monitor_period', 'monitored_messages', 'total_messages', 'publish_time', 'created_at'),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS problems (
+    rowid INTEGER PRIMARY KEY,
+    id INTEGER NOT NULL,
+    guild_id TEXT NOT NULL,
+    problem_type TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    details TEXT NOT NULL,
+    source TEXT NOT NULL,
+    user TEXT NOT NULL,
+    original TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    link TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    duplicate_of INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_problems_guild_time ON problems (guild_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_problems_guild_type ON problems (guild_id, problem_type);
+CREATE INDEX IF NOT EXISTS idx_problems_guild_source ON problems (guild_id, source);
+CREATE INDEX IF NOT EXISTS idx_problems_time ON problems (created_at);
+CREATE INDEX IF NOT EXISTS idx_problems_link ON problems (link);
+
+-- 预聚合表：写入问题时同步累加，统计查询只需扫描按天汇总后的少量行
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    guild_id TEXT NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_type (
+    guild_id TEXT NOT NULL, day TEXT NOT NULL, problem_type TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, day, problem_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_source (
+    guild_id TEXT NOT NULL, day TEXT NOT NULL, source TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, day, source)
+) WITHOUT ROWID;
+-- 来源基数高（Ticket 频道名各不相同），全量排行单独维护不分天的汇总
+CREATE TABLE IF NOT EXISTS rollup_source_total (
+    guild_id TEXT NOT NULL, source TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, source)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rollup_source_total_count ON rollup_source_total (guild_id, count);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    rowid INTEGER PRIMARY KEY,
+    guild_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    channel_name TEXT NOT NULL,
+    emotion TEXT NOT NULL,
+    discussion_summary TEXT NOT NULL,
+    key_events TEXT NOT NULL,
+    suggestion TEXT NOT NULL,
+    monitor_period TEXT NOT NULL,
+    monitored_messages INTEGER NOT NULL,
+    total_messages INTEGER NOT NULL,
+    publish_time TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_guild_time ON summaries (guild_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_summaries_time ON summaries (created_at);
+
+-- 导出水位：记录每个导出任务已导出的最大 rowid，用于增量导出
+CREATE TABLE IF NOT EXISTS export_watermarks (
+    name TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL, updated_at INTEGER NOT NULL
+);
+"""
+
+class ProblemStore:
+    """
+    本地问题库（SQLite），记录推送到 Telegram 的有效问题。
+    - 按服务器、问题类型、时间、来源建立索引。
+    - 写入时同步维护按天的预聚合表，统计命令在十万级数据下仍是毫秒级。
+    - 所有方法都是同步阻塞的，在事件循环中应通过 asyncio.to_thread 调用。
+    """
+    def __init__(self, path=PROBLEM_DB_FILE):
+        self.path = path
+        self.lock = threading.Lock()  # sqlite3 连接跨线程共享，使用锁串行化访问
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)  # 分片部署时多个进程共享问题库，写锁冲突时等待而不是立即报错
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        # 兼容旧版问题库：补充重复问题关联列
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(problems)')}
+        if 'duplicate_of' not in columns:
+            try:
+                self.conn.execute('ALTER TABLE problems ADD COLUMN duplicate_of INTEGER NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e):
+                    raise  # 其他进程已同时补充该列时忽略
+        self.conn.commit()
+    
+    def add_problem(self, guild_id, problem, timezone_offset=0, created_at=None):
+        """
+        写入一条问题记录并更新预聚合表。
+    
+        Args:
+            guild_id (str): Discord 服务器 ID
+            problem (dict): 问题字典（Problem.dict()，已分配 id）
+            timezone_offset (int): 服务器时区偏移，用于按本地日期汇总
+            created_at (float): 可选的 Unix 时间戳，默认当前时间
+        """
+        created_at = int(created_at if created_at is not None else time.time())
+        day = datetime.fromtimestamp(created_at, timezone(timedelta(hours=timezone_offset))).strftime('%Y-%m-%d')
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO problems (id, guild_id, problem_type, summary, details, source, user, original, '
+                'timestamp, link, created_at, day, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (problem['id'], guild_id, problem['problem_type'], problem['summary'], problem['details'],
+                 problem['source'], problem['user'], problem['original'], problem['timestamp'],
+                 problem.get('link', ''), created_at, day, problem.get('duplicate_of', 0))
+            )
+            self.conn.execute(
+                'INSERT INTO rollup_daily VALUES (?, ?, 1) ON CONFLICT DO UPDATE SET count = count + 1',
+                (guild_id, day)
+            )
+            self.conn.execute(
+                'INSERT INTO rollup_type VALUES (?, ?, ?, 1) ON CONFLICT DO UPDATE SET count = count + 1',
+                (guild_id, day, problem['problem_type'])
+            )
+            self.conn.execute(
+                'INSERT INTO rollup_source VALUES (?, ?, ?, 1) ON CONFLICT DO UPDATE SET count = count + 1',
+                (guild_id, day, problem['source'])
+            )
+            self.conn.execute(
+                'INSERT INTO rollup_source_total VALUES (?, ?, 1) ON CONFLICT DO UPDATE SET count = count + 1',
+                (guild_id, problem['source'])
+            )
+    
+    def add_summary(self, guild_id, channel_id, channel_name, summary, created_at=None):
+        """
+        写入一条 General Chat 总结记录。
+    
+        Args:
+            guild_id (str): Discord 服务器 ID
+            channel_id (int): 监控频道 ID
+            channel_name (str): 监控频道名称
+            summary (dict): 总结字典（GeneralSummary.dict() 及 publish_time 等发布字段）
+            created_at (float): 可选的 Unix 时间戳，默认当前时间
+        """
+        created_at = int(created_at if created_at is not None else time.time())
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO summaries (guild_id, channel_id, channel_name, emotion, discussion_summary, key_events, '
+                'suggestion, monitor_period, monitored_messages, total_messages, publish_time, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (guild_id, str(channel_id), channel_name, summary['emotion'], summary['discussion_summary'],
+                 summary['key_events'], summary['suggestion'], summary.get('monitor_period', ''),
+                 summary.get('monitored_messages', 0), summary.get('total_messages', 0),
+                 summary.get('publish_time', ''), created_at)
+            )
+    
+    def has_link(self, guild_id, link):
+        """判断问题链接（即 Ticket 频道）是否已有记录，用于回填去重"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT 1 FROM problems WHERE link = ? AND guild_id = ? LIMIT 1', (link, guild_id)
+            ).fetchone() is not None
+    
+    def recent_problems(self, guild_id, limit):
+        """
+        获取服务器最近的问题，用于重建相似度索引。
+    
+        Returns:
+            list: [dict]，按写入顺序升序，包含 id、duplicate_of、problem_type、summary、details、original、created_at
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, duplicate_of, problem_type, summary, details, original, created_at FROM problems '
+                'WHERE guild_id = ? ORDER BY rowid DESC LIMIT ?', (guild_id, limit)
+            ).fetchall()
+        keys = ('id', 'duplicate_of', 'problem_type', 'summary', 'details', 'original', 'created_at')
+        return [dict(zip(keys, row)) for row in reversed(rows)]
+    
+    def has_summary(self, channel_id, created_at):
+        """判断监控频道在指定时间点是否已有总结记录，用于回填去重"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT 1 FROM summaries WHERE channel_id = ? AND created_at = ? LIMIT 1', (str(channel_id), int(created_at))
+            ).fetchone() is not None
+    
+    def iter_chunks(self, table, guild_id=None, since=None, until=None, after_rowid=0, chunk_size=5000):
+        """
+        按 rowid 分页流式读取表数据，每次只持有一个分块，内存占用与总行数无关。
+        每个分块单独加锁查询，导出期间不阻塞 Bot 写入。
+    
+        Args:
+            table (str): 表名，见 EXPORT_COLUMNS
+            guild_id (str): 可选，只导出指定服务器
+            since (int): 可选，created_at 下限（Unix 时间戳，含）
+            until (int): 可选，created_at 上限（Unix 时间戳，不含）
+            after_rowid (int): 只读取 rowid 大于该值的行（增量导出水位）
+            chunk_size (int): 每个分块的行数
+    
+        Yields:
+            list: 行元组列表，列顺序与 EXPORT_COLUMNS[table] 一致
+        """
+        columns = EXPORT_COLUMNS[table]
+        conditions, params = ['rowid > ?'], []
+        if guild_id:
+            conditions.append('guild_id = ?')
+            params.append(guild_id)
+        if since is not None:
+            conditions.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('created_at < ?')
+            params.append(until)
+        sql = f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY rowid LIMIT ?"
+        while True:
+            with self.lock:
+                rows = self.conn.execute(sql, (after_rowid, *params, chunk_size)).fetchall()
+            if not rows:
+                return
+            yield rows
+            after_rowid = rows[-1][0]
+    
+    def get_watermark(self, name):
+        """获取导出任务的水位（已导出的最大 rowid），不存在时返回 0"""
+        with self.lock:
+            row = self.conn.execute('SELECT last_rowid FROM export_watermarks WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+    
+    def set_watermark(self, name, last_rowid):
+        """更新导出任务的水位"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO export_watermarks VALUES (?, ?, ?) '
+                'ON CONFLICT DO UPDATE SET last_rowid = excluded.last_rowid, updated_at = excluded.updated_at',
+                (name, last_rowid, int(time.time()))
+            )
+    
+    def since_day(self, days, timezone_offset=0):
+        """计算最近 days 天的起始日期字符串（含当天），days 为空时返回最早日期"""
+        if not days:
+            return '0000-00-00'
+        now = datetime.now(timezone(timedelta(hours=timezone_offset)))
+        return (now - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    
+    def type_histogram(self, guild_id, days=None, timezone_offset=0):
+        """
+        问题类型分布。
+    
+        Args:
+            guild_id (str): Discord 服务器 ID
+            days (int): 统计最近多少天，None 表示全部
+            timezone_offset (int): 服务器时区偏移
+    
+        Returns:
+            list: [(problem_type, count)]，按数量降序
+        """
+        with self.lock:
+            return self.conn.execute(
+                'SELECT problem_type, SUM(count) AS total FROM rollup_type WHERE guild_id = ? AND day >= ? '
+                'GROUP BY problem_type ORDER BY total DESC',
+                (guild_id, self.since_day(days, timezone_offset))
+            ).fetchall()
+    
+    def daily_counts(self, guild_id, days=7, timezone_offset=0):
+        """
+        每日问题数。
+    
+        Returns:
+            list: [(day, count)]，按日期升序
+        """
+        with self.lock:
+            return self.conn.execute(
+                'SELECT day, count FROM rollup_daily WHERE guild_id = ? AND day >= ? ORDER BY day',
+                (guild_id, self.since_day(days, timezone_offset))
+            ).fetchall()
+    
+    def top_sources(self, guild_id, days=None, limit=10, timezone_offset=0):
+        """
+        问题来源排行。
+    
+        Returns:
+            list: [(source, count)]，按数量降序
+        """
+        with self.lock:
+            if not days:
+                return self.conn.execute(
+                    'SELECT source, count FROM rollup_source_total WHERE guild_id = ? ORDER BY count DESC LIMIT ?',
+                    (guild_id, limit)
+                ).fetchall()
+            return self.conn.execute(
+                'SELECT source, SUM(count) AS total FROM rollup_source WHERE guild_id = ? AND day >= ? '
+                'GROUP BY source ORDER BY total DESC LIMIT ?',
+                (guild_id, self.since_day(days, timezone_offset), limit)
+            ).fetchall()
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            self.conn.close()
+
+def bench(count=100000):
+    """写入 count 条模拟问题后测量统计查询耗时"""
+    import os
+    import random
+    import tempfile
+    
+    random.seed(0)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    store = ProblemStore(path)
+    types = ['Bug 报告', '功能建议', '账户问题', '资产问题', '活动咨询', '其他']
+    now = time.time()
+    start = time.perf_counter()
+    for i in range(count):
+        store.add_problem(str(random.randrange(5)), {
+            'id': i, 'problem_type': random.choice(types), 'summary': 's', 'details': 'd',
+            'source': f'ticket-{random.randrange(2000)}', 'user': 'u', 'original': 'o',
+            'timestamp': '', 'link': ''
+        }, created_at=now - random.random() * 365 * 86400)
+    print(f"写入 {count} 条: {time.perf_counter() - start:.1f} s")
+    for name, fn in (
+        ('类型分布（全部）', lambda: store.type_histogram('0')),
+        ('类型分布（30 天）', lambda: store.type_histogram('0', days=30)),
+        ('每日数量（30 天）', lambda: store.daily_counts('0', days=30)),
+        ('来源排行（全部）', lambda: store.top_sources('0')),
+        ('来源排行（30 天）', lambda: store.top_sources('0', days=30)),
+    ):
+        start = time.perf_counter()
+        for _ in range(20):
+            fn()
+        print(f"{name}: {(time.perf_counter() - start) / 20 * 1000:.2f} ms")
+    store.close()
+
+if __name__ == "__main__":
+    bench()
\ No newline at end of file
@@ -0,0 +1,538 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import argparse
+import operator
+import datetime
+import logging
+import tempfile
+import threading
+import numpy as np
+from cadence import NEGATIVE_RE
+from gateway_profile import rss_mb
+
+logger = logging.getLogger(__name__)
+
+# 录制的网关事件，定长 48 字节，不含消息内容和用户名；ID 为加盐哈希，同一次录制内保持一致
+EVENT_DTYPE = np.dtype([
+    ('ts', '<f8'),  # 事件时间（Unix 时间戳，秒）
+    ('guild', '<i8'),  # 服务器 ID 哈希
+    ('channel', '<i8'),  # 频道 ID 哈希
+    ('category', '<i8'),  # 频道类别 ID 哈希，无类别为 0
+    ('author', '<i8'),  # 发送者 ID 哈希，频道删除事件为 0
+    ('length', '<i4'),  # 消息长度（字符数）
+    ('kind', 'i1'),  # 事件类型，见 EVENT_MESSAGE / EVENT_CHANNEL_DELETE
+    ('flags', 'u1'),  # 消息特征位，见 FLAG_*
+    ('reserved', '<u2'),
+])
+
+EVENT_MESSAGE = 0  # 新消息
+EVENT_CHANNEL_DELETE = 1  # 频道删除（Ticket 关闭）
+
+FLAG_BOT = 1  # 发送者为 Bot
+FLAG_REPLY = 2  # 回复消息
+FLAG_TICKET = 4  # 录制时位于 Ticket 类别下
+FLAG_MONITOR = 8  # 录制时为监控频道
+FLAG_NEGATIVE = 16  # 命中事件类负面关键词
+
+RECORD_FLUSH_EVERY = 1024  # 缓冲多少条事件后写入文件
+RECORD_FLUSH_SECONDS = 60  # 距上次写入超过该时长时写入文件
+HASH_CACHE_SIZE = 65536  # ID 哈希缓存条数，超出后清空重建
+
+HISTORY_LIMIT = 200  # 回放时每个模拟频道保留的最近消息数
+LAG_SAMPLE_INTERVAL = 0.05  # 事件循环延迟采样间隔（秒）
+FILLER_WORDS = 'the wallet claim page shows pending after i signed bridge transaction please check my account'.split()
+
+class EventRecorder:
+    """
+    将 on_message 收到的网关事件脱敏后录制到二进制文件，供 replay 回放。
+    - 只记录时间、服务器/频道/类别/发送者 ID 的加盐哈希、消息长度和几个特征位，不保存内容和用户名。
+    - 事件先缓冲在内存中，攒够一批后在线程池中追加写入，事件循环线程不做磁盘 IO。
+    """
+    def __init__(self, path, salt=None, flush_every=RECORD_FLUSH_EVERY, flush_seconds=RECORD_FLUSH_SECONDS):
+        """
+        Args:
+            path (str): 录制文件路径（追加写入）
+            salt (str): 可选的哈希盐；未设置时每次启动随机生成，不同进程录制的 ID 无法对应
+            flush_every (int): 缓冲多少条事件后写入
+            flush_seconds (float): 距上次写入超过该时长时写入
+        """
+        self.path = path
+        self.salt = salt.encode() if salt else os.urandom(16)
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.hashes = {}  # 原始 ID -> 哈希
+        self.lock = threading.Lock()  # 保证批次按顺序完整写入
+        self.last_flush = time.monotonic()
+        self.recorded = 0
+
+    def hash_id(self, value):
+        """将 Discord ID 映射为 63 位正整数哈希，0 保留给“无”"""
+        if not value:
+            return 0
+        hashed = self.hashes.get(value)
+        if hashed is None:
+            if len(self.hashes) >= HASH_CACHE_SIZE:
+                self.hashes.clear()
+            digest = hashlib.blake2b(str(value).encode(), digest_size=8, key=self.salt).digest()
+            hashed = self.hashes[value] = (int.from_bytes(digest, 'little') >> 1) or 1
+        return hashed
+
+    def record_message(self, message, route):
+        """
+        记录一条新消息。
+
+        Args:
+            message (discord.Message): 收到的消息对象
+            route (GuildRoute): 消息所在服务器的路由快照
+        """
+        content = message.content or ''
+        flags = FLAG_BOT if message.author.bot else 0
+        if message.reference is not None:
+            flags |= FLAG_REPLY
+        if route.is_ticket_channel(message.channel):
+            flags |= FLAG_TICKET
+        elif message.channel.id in route.monitor_channel_ids:
+            flags |= FLAG_MONITOR
+        if content and NEGATIVE_RE.search(content):
+            flags |= FLAG_NEGATIVE
+        self.append(message.created_at.timestamp(), EVENT_MESSAGE, message.guild.id, message.channel.id,
+                    getattr(message.channel, 'category_id', None), message.author.id, len(content), flags)
+
+    def record_channel_delete(self, channel):
+        """记录频道删除事件"""
+        self.append(time.time(), EVENT_CHANNEL_DELETE, channel.guild.id, channel.id, getattr(channel, 'category_id', None), None, 0, 0)
+
+    def append(self, ts, kind, guild_id, channel_id, category_id, author_id, length, flags):
+        self.buffer.append((ts, self.hash_id(guild_id), self.hash_id(channel_id), self.hash_id(category_id),
+                            self.hash_id(author_id), min(length, 2**31 - 1), kind, flags, 0))
+        self.recorded += 1
+        if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """将缓冲的事件交给线程池写入；没有运行中的事件循环时直接写入"""
+        batch, self.buffer = self.buffer, []
+        self.last_flush = time.monotonic()
+        if not batch:
+            return
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self.write, batch)
+        except RuntimeError:
+            self.write(batch)
+
+    def write(self, batch):
+        try:
+            with self.lock, open(self.path, 'ab') as f:
+                np.array(batch, dtype=EVENT_DTYPE).tofile(f)
+        except OSError as e:
+            logger.error(f"写入事件录制文件失败: {e}")
+
+    def close(self):
+        """同步写入剩余事件（程序退出前调用）"""
+        batch, self.buffer = self.buffer, []
+        if batch:
+            self.write(batch)
+
+def load_events(path):
+    """
+    读取录制文件。
+
+    Returns:
+        np.ndarray: EVENT_DTYPE 结构化数组，按时间排序（分批写入可能轻微乱序）
+    """
+    events = np.fromfile(path, dtype=EVENT_DTYPE)
+    return events[np.argsort(events['ts'], kind='stable')]
+
+def synthetic_events(count=20000, guilds=20, rate=20.0, ticket_share=0.05, monitor_share=0.3, seed=0):
+    """
+    生成模拟流量：服务器活跃度长尾分布，Ticket 由 Ticket Bot 开单模板开始、若干条对话后关闭，
+    监控频道中夹杂少量回复和负面关键词消息。
+
+    Args:
+        count (int): 消息条数
+        guilds (int): 服务器数量
+        rate (float): 平均消息速率（条/秒）
+        ticket_share (float): Ticket 频道消息占比
+        monitor_share (float): 监控频道消息占比
+        seed (int): 随机种子
+
+    Returns:
+        np.ndarray: EVENT_DTYPE 结构化数组，按时间排序
+    """
+    rng = np.random.default_rng(seed)
+    times = 1.7e9 + np.cumsum(rng.exponential(1 / rate, count))
+    rows = []
+    open_tickets = {}  # 服务器 -> [[频道, 剩余消息数, 开单用户]]
+    next_channel = 1
+    for ts in times:
+        guild = int(rng.zipf(1.6)) % guilds + 1
+        length = int(min(rng.lognormal(3.5, 1.0), 2000))
+        roll = rng.random()
+        if roll < ticket_share:
+            tickets = open_tickets.setdefault(guild, [])
+            if not tickets or rng.random() < 0.15:
+                ticket = [10**6 + next_channel, int(rng.integers(2, 12)), int(rng.integers(1, 10**6))]
+                next_channel += 1
+                tickets.append(ticket)
+                # Ticket Bot 的开单模板
+                rows.append((ts, guild, ticket[0], guild * 10 + 1, 1, 120, EVENT_MESSAGE, FLAG_BOT | FLAG_TICKET, 0))
+                continue
+            ticket = tickets[int(rng.integers(len(tickets)))]
+            author = ticket[2] if rng.random() < 0.6 else int(rng.integers(1, 20))  # 开单用户或管理员
+            rows.append((ts, guild, ticket[0], guild * 10 + 1, author, length, EVENT_MESSAGE, FLAG_TICKET, 0))
+            ticket[1] -= 1
+            if ticket[1] <= 0:
+                tickets.remove(ticket)
+                closed_at = ts + rng.uniform(1800, 7200)  # 最后一条消息后 30 分钟 ~ 2 小时关闭
+                if closed_at < times[-1]:
+                    rows.append((closed_at, guild, ticket[0], guild * 10 + 1, 0, 0, EVENT_CHANNEL_DELETE, 0, 0))
+        elif roll < ticket_share + monitor_share:
+            flags = FLAG_MONITOR
+            if rng.random() < 0.1:
+                flags |= FLAG_REPLY
+            if rng.random() < 0.02:
+                flags |= FLAG_NEGATIVE
+            rows.append((ts, guild, guild * 1000 + 900 + int(rng.integers(3)), guild * 10 + 2,
+                         int(rng.zipf(1.3)) % 5000 + 100, length, EVENT_MESSAGE, flags, 0))
+        else:
+            rows.append((ts, guild, guild * 1000 + 950 + int(rng.integers(10)), guild * 10 + 2,
+                         int(rng.zipf(1.3)) % 5000 + 100, length, EVENT_MESSAGE, 0, 0))
+    events = np.array(rows, dtype=EVENT_DTYPE)
+    return events[np.argsort(events['ts'], kind='stable')]
+
+def synthetic_content(length, negative):
+    """按录制的长度生成替代内容，负面关键词消息以关键词开头"""
+    text = 'scam ' if negative else ''
+    words = FILLER_WORDS
+    i = 0
+    while len(text) < length:
+        text += words[i % len(words)] + ' '
+        i += 1
+    return text[:max(length, 5 if negative else 0)]
+
+class FakeGuild:
+    __slots__ = ('id',)
+
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+class FakeUser:
+    __slots__ = ('id', 'name', 'bot')
+
+    def __init__(self, user_id, bot):
+        self.id = user_id
+        self.name = f"user{user_id % 100000}"
+        self.bot = bot
+
+class FakeMessage:
+    __slots__ = ('id', 'guild', 'channel', 'author', 'content', 'created_at', 'reference')
+
+    def __init__(self, message_id, guild, channel, author, content, created_at, reference):
+        self.id = message_id
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+        self.reference = reference
+
+class FakeChannel:
+    """模拟的 Discord 频道，history() 与 discord.py 的排序规则一致（指定 after 时按时间正序）"""
+    def __init__(self, channel_id, guild, category_id, name):
+        self.id = channel_id
+        self.guild = guild
+        self.category_id = category_id or None
+        self.name = name
+        self.last_message_id = None
+        self.messages = []
+
+    def add(self, message):
+        self.messages.append(message)
+        if len(self.messages) > HISTORY_LIMIT * 2:
+            del self.messages[:-HISTORY_LIMIT]
+        self.last_message_id = message.id
+
+    @staticmethod
+    def position(message, bound):
+        """与 discord.py 一致：datetime 边界比较消息时间，其他边界（discord.Object、消息）比较 ID"""
+        if isinstance(bound, datetime.datetime):
+            return message.created_at, bound
+        return message.id, bound.id
+
+    async def history(self, limit=100, after=None, before=None, oldest_first=None):
+        selected = []
+        for message in self.messages:
+            if after is not None and operator.le(*self.position(message, after)):
+                continue
+            if before is not None and operator.ge(*self.position(message, before)):
+                continue
+            selected.append(message)
+        if oldest_first is None:
+            oldest_first = after is not None
+        if not oldest_first:
+            selected.reverse()
+        for message in selected[:limit]:
+            yield message
+
+class Replayer:
+    """
+    将录制（或模拟）的事件按原始时间间隔加速后送入 bot.on_message / on_guild_channel_delete。
+    Discord 频道、LLM 和 Telegram 均替换为模拟实现（LLM 与 Telegram 按设定延迟休眠），配置、问题库、
+    相似度索引等本地组件使用真实实现（位于临时目录）。
+    """
+    def __init__(self, bot_module, events, speed=10.0, llm_latency=2.0, telegram_latency=0.2):
+        """
+        Args:
+            bot_module (module): 已导入的 bot 模块
+            events (np.ndarray): EVENT_DTYPE 事件数组
+            speed (float): 回放倍速（1~100），Ticket 空闲等待和草稿防抖按同一倍数缩短
+            llm_latency (float): 模拟 LLM 调用耗时（秒，不随倍速缩短）
+            telegram_latency (float): 模拟 Telegram 推送耗时（秒）
+        """
+        self.bot = bot_module
+        self.events = events
+        self.speed = speed
+        self.llm_latency = llm_latency
+        self.telegram_latency = telegram_latency
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+        self.next_message_id = 1
+        self.calls = {'full': 0, 'delta': 0, 'triage': 0, 'telegram': 0}
+        self.calls_lock = threading.Lock()
+        self.latencies = []  # on_message 耗时（秒）
+        self.lags = []  # 事件循环延迟（秒）
+        self.max_tasks = 0
+        self.peak_rss = 0.0
+
+    def count(self, name):
+        with self.calls_lock:
+            self.calls[name] += 1
+
+    def install(self):
+        """写入回放配置并替换外部依赖"""
+        from llm_analyzer import finalize_problem
+        from models import Problem
+        bot_module = self.bot
+        guilds = {}
+        for event in self.events[self.events['kind'] == EVENT_MESSAGE]:
+            config = guilds.setdefault(str(event['guild']), {
+                'ticket_category_ids': set(), 'monitor_channels': set(), 'tg_channel_id': '-100',
+                'ticket_idle_minutes': bot_module.DEFAULT_TICKET_IDLE_MINUTES / self.speed,
+                'ticket_max_wait_minutes': bot_module.DEFAULT_TICKET_MAX_WAIT_MINUTES / self.speed,
+            })
+            if event['flags'] & FLAG_TICKET and event['category']:
+                config['ticket_category_ids'].add(int(event['category']))
+            if event['flags'] & FLAG_MONITOR:
+                config['monitor_channels'].add(int(event['channel']))
+        for config in guilds.values():
+            config['ticket_category_ids'] = sorted(config['ticket_category_ids'])
+            config['monitor_channels'] = sorted(config['monitor_channels'])
+        manager = bot_module.config_manager
+        manager.config['is_activated'] = True
+        manager.config['guilds'] = guilds
+        manager.config_version += 1
+        bot_module.TICKET_DRAFT_DEBOUNCE_SECONDS /= self.speed
+        bot_module.bot_start_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=1)
+
+        def fake_analyze(conversation, channel, guild_id, config, llm_api_key, base_url, model_id, creation_time, on_partial=None):
+            time.sleep(self.llm_latency)
+            self.count('full')
+            problem = Problem(problem_type='Bug', summary=f"replay ticket {channel.id}", source='', user='replay',
+                              timestamp='', details=f"{len(conversation)} messages", original='', is_valid=True)
+            return finalize_problem(problem, channel, guild_id, config, creation_time)
+
+        def fake_update(draft, new_conversation, *args):
+            time.sleep(self.llm_latency)
+            self.count('delta')
+            return dict(draft)
+
+        def fake_triage(conversation, *args):
+            time.sleep(self.llm_latency / 4)
+            self.count('triage')
+            return True
+
+        async def fake_send_problem_form(problem, tg_channel_id):
+            await asyncio.sleep(self.telegram_latency)
+            self.count('telegram')
+
+        async def process_commands(message):
+            pass  # 模拟消息无法构造命令上下文
+
+        import job_queue
+        bot_module.analyze_ticket_conversation = fake_analyze  # /warp_msg 流式分析在 bot 模块内直接调用
+        job_queue.analyze_ticket_conversation = fake_analyze
+        job_queue.update_ticket_analysis = fake_update
+        job_queue.triage_ticket_conversation = fake_triage
+        bot_module.telegram_bot.send_problem_form = fake_send_problem_form
+        bot_module.bot.process_commands = process_commands
+        # 监控频道从回放开始计数，达到突增阈值时与线上一样唤醒调度循环
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for guild_id, config in guilds.items():
+            cadence = bot_module.get_cadence_config(config)
+            for channel_id in config['monitor_channels']:
+                bot_module.activity_tracker.decide(channel_id, now, config.get('monitor_period', 2) * 3600, cadence)
+
+    def channel(self, event):
+        channel = self.channels.get(int(event['channel']))
+        if channel is None:
+            guild = self.guilds.setdefault(int(event['guild']), FakeGuild(int(event['guild'])))
+            ticket = bool(event['flags'] & FLAG_TICKET)
+            name = f"ticket-{int(event['channel']) % 10000}" if ticket else f"channel-{int(event['channel']) % 10000}"
+            channel = self.channels[int(event['channel'])] = FakeChannel(int(event['channel']), guild, int(event['category']), name)
+        return channel
+
+    def message(self, event):
+        channel = self.channel(event)
+        author_key = (int(event['author']), bool(event['flags'] & FLAG_BOT))
+        author = self.users.get(author_key)
+        if author is None:
+            author = self.users[author_key] = FakeUser(*author_key)
+        content = synthetic_content(int(event['length']), bool(event['flags'] & FLAG_NEGATIVE))
+        reference = object() if event['flags'] & FLAG_REPLY else None
+        message = FakeMessage(self.next_message_id, channel.guild, channel, author, content,
+                              datetime.datetime.now(datetime.timezone.utc), reference)
+        self.next_message_id += 1
+        channel.add(message)
+        return message
+
+    async def sample(self):
+        """定时采样事件循环延迟、任务数和常驻内存"""
+        loop = asyncio.get_running_loop()
+        expected = loop.time() + LAG_SAMPLE_INTERVAL
+        while True:
+            await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+            now = loop.time()
+            self.lags.append(max(now - expected, 0.0))
+            expected = now + LAG_SAMPLE_INTERVAL
+            self.max_tasks = max(self.max_tasks, len(asyncio.all_tasks()))
+            self.peak_rss = max(self.peak_rss, rss_mb())
+
+    async def run(self, drain_seconds=60.0):
+        """
+        回放全部事件，结束后最多等待 drain_seconds 让后台分析任务完成。
+
+        Returns:
+            dict: 回放报告
+        """
+        self.install()
+        on_message = self.bot.on_message
+        on_channel_delete = self.bot.on_guild_channel_delete
+        loop = asyncio.get_running_loop()
+        rss_start = rss_mb()
+        sampler = asyncio.create_task(self.sample())
+        base_tasks = len(asyncio.all_tasks())
+        t0 = float(self.events['ts'][0]) if len(self.events) else 0.0
+        start = loop.time()
+        messages = deletes = 0
+        for event in self.events:
+            delay = start + (float(event['ts']) - t0) / self.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if event['kind'] == EVENT_CHANNEL_DELETE:
+                channel = self.channels.pop(int(event['channel']), None)
+                if channel is not None:
+                    await on_channel_delete(channel)
+                    deletes += 1
+                continue
+            message = self.message(event)
+            began = time.perf_counter()
+            await on_message(message)
+            self.latencies.append(time.perf_counter() - began)
+            messages += 1
+        replay_seconds = loop.time() - start
+        deadline = loop.time() + drain_seconds
+        while len(asyncio.all_tasks()) > base_tasks and loop.time() < deadline:
+            await asyncio.sleep(0.2)
+        pending = len(asyncio.all_tasks()) - base_tasks
+        sampler.cancel()
+        latencies = np.array(self.latencies or [0.0]) * 1000
+        lags = np.array(self.lags or [0.0]) * 1000
+        return {
+            'messages': messages,
+            'deletes': deletes,
+            'recorded_minutes': (float(self.events['ts'][-1]) - t0) / 60 if len(self.events) else 0.0,
+            'replay_seconds': replay_seconds,
+            'handler_ms': {p: float(np.percentile(latencies, p)) for p in (50, 99, 100)},
+            'loop_lag_ms': {p: float(np.percentile(lags, p)) for p in (50, 99, 100)},
+            'max_tasks': self.max_tasks,
+            'pending_tasks': pending,
+            'rss_mb': (rss_start, rss_mb(), max(self.peak_rss, rss_mb())),
+            'ticket_states': len(self.bot.ticket_states.states),
+            'calls': dict(self.calls),
+        }
+
+def print_report(report, traced=None):
+    handler, lag = report['handler_ms'], report['loop_lag_ms']
+    rss_start, rss_end, rss_peak = report['rss_mb']
+    calls = report['calls']
+    print(f"回放 {report['messages']} 条消息、{report['deletes']} 次频道删除，录制时长 {report['recorded_minutes']:.1f} 分钟，"
+          f"实际耗时 {report['replay_seconds']:.1f} 秒")
+    print(f"on_message 耗时: p50 {handler[50]:.3f} ms，p99 {handler[99]:.3f} ms，最大 {handler[100]:.3f} ms")
+    print(f"事件循环延迟: p50 {lag[50]:.2f} ms，p99 {lag[99]:.2f} ms，最大 {lag[100]:.2f} ms")
+    print(f"任务数: 峰值 {report['max_tasks']}，结束时未完成 {report['pending_tasks']}；未清理的 Ticket 状态 {report['ticket_states']} 个")
+    print(f"常驻内存: {rss_start:.1f} MB -> {rss_end:.1f} MB（峰值 {rss_peak:.1f} MB）")
+    if traced:
+        print(f"tracemalloc: 增长 {traced[0]:.2f} MB，峰值 {traced[1]:.2f} MB")
+    print(f"模拟调用: 完整分析 {calls['full']} 次，增量更新 {calls['delta']} 次，初筛 {calls['triage']} 次，Telegram 推送 {calls['telegram']} 次")
+
+async def replay(events, speed=10.0, llm_latency=2.0, telegram_latency=0.2, drain_seconds=60.0, log_level='WARNING', trace_memory=False):
+    """在当前目录导入 bot 模块并回放事件，打印并返回报告"""
+    import bot as bot_module
+    logging.getLogger().setLevel(log_level)
+    traced = None
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+    report = await Replayer(bot_module, events, speed, llm_latency, telegram_latency).run(drain_seconds)
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        traced = ((current - before) / 1024 / 1024, peak / 1024 / 1024)
+        tracemalloc.stop()
+    print_report(report, traced)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='回放录制的 Discord 消息事件，测量 on_message 与 Ticket 检测路径的性能')
+    parser.add_argument('events', nargs='?', help='RECORD_EVENTS_FILE 录制的事件文件；不指定时使用模拟流量')
+    parser.add_argument('--synthetic', type=int, default=20000, help='未指定事件文件时生成的模拟消息条数')
+    parser.add_argument('--rate', type=float, default=20.0, help='模拟流量的平均消息速率（条/秒）')
+    parser.add_argument('--save', help='将模拟流量保存为事件文件')
+    parser.add_argument('--speed', type=float, default=10.0, help='回放倍速（1~100）')
+    parser.add_argument('--llm-latency', type=float, default=2.0, help='模拟 LLM 调用耗时（秒）')
+    parser.add_argument('--telegram-latency', type=float, default=0.2, help='模拟 Telegram 推送耗时（秒）')
+    parser.add_argument('--drain', type=float, default=60.0, help='回放结束后等待后台任务完成的最长时间（秒）')
+    parser.add_argument('--log-level', default='WARNING', help='回放期间的日志级别，INFO 可复现线上日志开销')
+    parser.add_argument('--tracemalloc', action='store_true', help='额外统计 Python 内存分配（会明显拖慢回放）')
+    args = parser.parse_args(argv)
+    if not 1 <= args.speed <= 100:
+        parser.error('--speed 需在 1~100 之间')
+    if args.events:
+        events = load_events(os.path.abspath(args.events))
+        print(f"读取 {len(events)} 个事件（{os.path.getsize(args.events) / 1024:.0f} KB）")
+    else:
+        events = synthetic_events(args.synthetic, rate=args.rate)
+        if args.save:
+            events.tofile(args.save)
+            print(f"模拟流量已保存到 {args.save}")
+    # bot 模块在导入时读取配置并创建日志、问题库等文件，在临时目录中运行，不影响线上数据
+    for name, value in (('MY_ACTIVE_KEY', 'replay'), ('TELEGRAM_TOKEN', 'replay'), ('DISCORD_TOKEN', 'replay'),
+                        ('LLM_API_KEY', 'replay'), ('MODEL_ID', 'replay')):
+        os.environ.setdefault(name, value)
+    os.environ['RECORD_EVENTS_FILE'] = ''  # 回放时不录制
+    cwd = os.getcwd()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            asyncio.run(replay(events, args.speed, args.llm_latency, args.telegram_latency, args.drain, args.log_level.upper(), args.tracemalloc))
+        finally:
+            os.chdir(cwd)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GuildRoute:
+    """单个服务器的路由快照，全部为 frozenset，供热路径 O(1) 判断"""
+    __slots__ = ('ticket_category_ids', 'monitor_channel_ids', 'allowed_role_ids', 'warp_msg_role_ids')
+
+    def __init__(self, ticket_category_ids=(), monitor_channel_ids=(), allowed_role_ids=(), warp_msg_role_ids=()):
+        self.ticket_category_ids = frozenset(ticket_category_ids)  # Ticket 类别 ID
+        self.monitor_channel_ids = frozenset(monitor_channel_ids)  # 监控的 General Chat 频道 ID
+        self.allowed_role_ids = frozenset(allowed_role_ids)  # 允许使用命令的角色 ID
+        self.warp_msg_role_ids = frozenset(warp_msg_role_ids)  # 允许使用 warp_msg 的角色 ID
+
+    def is_ticket_channel(self, channel):
+        """判断频道是否位于 Ticket 类别下"""
+        return getattr(channel, 'category_id', None) in self.ticket_category_ids
+
+    def has_any_role(self, role_ids, roles):
+        """判断成员角色中是否有任一角色在给定集合内"""
+        return not role_ids.isdisjoint(role.id for role in roles)
+
+EMPTY_ROUTE = GuildRoute()  # 未配置服务器共用的空路由
+
+class RoutingIndex:
+    """
+    按服务器编译的路由索引，键为整数服务器 ID。
+    - 仅在 ConfigManager.config_version 变化（配置被修改）时重建。
+    - 热路径只做一次整数比较、一次字典查找和集合判断，不做字符串转换和日志。
+    """
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self.version = None  # 当前快照对应的配置版本
+        self.routes = {}
+
+    def rebuild(self):
+        """根据当前配置重建全部服务器的路由快照"""
+        routes = {}
+        for guild_id, config in self.config_manager.config.get('guilds', {}).items():
+            try:
+                key = int(guild_id)
+            except ValueError:
+                continue  # 忽略示例配置等非数字键
+            routes[key] = GuildRoute(
+                config.get('ticket_category_ids', []),
+                config.get('monitor_channels', []),
+                config.get('allowed_roles', []),
+                config.get('warp_msg_allowed_roles', [])
+            )
+        self.routes = routes
+        self.version = self.config_manager.config_version
+        logger.info(f"路由索引已重建，共 {len(routes)} 个服务器")
+
+    def get(self, guild_id):
+        """
+        获取服务器的路由快照，配置有变化时先重建。
+
+        Args:
+            guild_id (int): Discord 服务器 ID
+
+        Returns:
+            GuildRoute: 路由快照，未配置的服务器返回空路由
+        """
+        if self.version != self.config_manager.config_version:
+            self.rebuild()
+        return self.routes.get(guild_id, EMPTY_ROUTE)
+
+def bench(guild_count=500, message_count=100000, rate=1000):
+    """
+    对比旧的 on_message 路由判断（字符串转换 + 字典查找 + 列表扫描 + INFO 日志）与路由索引的开销。
+
+    Args:
+        guild_count (int): 模拟的服务器数量
+        message_count (int): 模拟的消息数量
+        rate (int): 目标消息速率（条/秒），用于换算 CPU 占用
+    """
+    import random
+    import time
+    from types import SimpleNamespace
+
+    random.seed(0)
+    guilds = {}
+    for g in range(guild_count):
+        guilds[str(10**17 + g)] = {
+            'ticket_category_ids': [10**16 + g * 10 + i for i in range(3)],
+            'monitor_channels': [10**15 + g * 10 + i for i in range(5)],
+            'allowed_roles': [10**14 + g * 10 + i for i in range(4)],
+        }
+    manager = SimpleNamespace(config={'guilds': guilds}, config_version=0)
+    manager.get_guild_config = lambda guild_id: manager.config.get('guilds', {}).get(guild_id, {})
+    messages = []
+    for _ in range(message_count):
+        g = random.randrange(guild_count)
+        # 约 10% 的消息来自 Ticket 频道，其余来自普通频道
+        category_id = 10**16 + g * 10 + random.randrange(3) if random.random() < 0.1 else 10**13 + random.randrange(1000)
+        messages.append(SimpleNamespace(
+            guild=SimpleNamespace(id=10**17 + g),
+            channel=SimpleNamespace(category_id=category_id, name='channel'),
+            author=SimpleNamespace(name='user')
+        ))
+
+    bench_logger = logging.getLogger('routing.bench')
+    bench_logger.addHandler(logging.NullHandler())
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+
+    def legacy(message):
+        config = manager.get_guild_config(str(message.guild.id))
+        if message.channel.category_id in config.get('ticket_category_ids', []):
+            bench_logger.info(f"处理消息，频道: {message.channel.name}，发送者: {message.author.name}")
+            return True
+        return False
+
+    index = RoutingIndex(manager)
+    def indexed(message):
+        return index.get(message.guild.id).is_ticket_channel(message.channel)
+
+    for name, fn in (('旧路径', legacy), ('路由索引', indexed)):
+        start = time.perf_counter()
+        hits = sum(1 for message in messages if fn(message))
+        elapsed = time.perf_counter() - start
+        per_message_us = elapsed / message_count * 1e6
+        print(f"{name}: {per_message_us:.2f} us/条，{message_count / elapsed:,.0f} 条/秒，"
+              f"{rate} 条/秒时 CPU 占用 {per_message_us * rate / 1e4:.3f}%，命中 {hits}")
+
+if __name__ == "__main__":
+    bench()
\ No newline at end of file
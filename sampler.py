@@ -0,0 +1,272 @@
+import math
+import random
+import logging
+from collections import deque
+from cadence import NEGATIVE_RE
+from utils import message_to_dict
+
+logger = logging.getLogger(__name__)
+
+# 监控频道的消息抽样方式：recent 只取最新的 monitor_max_messages 条；stratified 在整个窗口内分层抽样
+SAMPLING_MODES = ('stratified', 'recent')
+DEFAULT_SAMPLING_MODE = 'stratified'
+
+DEFAULT_BUCKETS = 12  # 时间分层数
+DEFAULT_USER_SHARE = 0.1  # 单个用户在每个分层中最多占的比例（至少 1 条）
+DEFAULT_IMPORTANT_SHARE = 0.3  # 为重要消息预留的样本比例
+LONG_MESSAGE_CHARS = 200  # 达到该长度的消息视为长消息
+
+def importance(content, is_reply):
+    """消息重要度：回复、长消息、命中事件类负面关键词各计 1 分，0 表示普通消息"""
+    content = content or ''
+    return int(is_reply) + int(len(content) >= LONG_MESSAGE_CHARS) + int(bool(NEGATIVE_RE.search(content)))
+
+class Reservoir:
+    """
+    按随机键保留键最大的 capacity 个元素（bottom-k 抽样，与到达顺序无关），每个用户最多占 user_cap 个。
+    已达上限的用户只与自己已保留的元素竞争，刷屏用户无法挤占其他用户的名额。
+    最小键位置按需重算，只在有元素被接收后发生，每条消息的常规开销为 O(1)。
+    """
+    def __init__(self, capacity, user_cap):
+        self.capacity = capacity
+        self.user_cap = user_cap
+        self.items = []  # [键, 用户, 元素]
+        self.user_counts = {}  # 用户 -> 已保留条数
+        self.user_min = {}  # 用户 -> 其键最小元素的位置
+        self.min_index = None  # 键最小元素的位置，None 表示需要重算
+
+    def refresh_user(self, user):
+        """重算用户键最小元素的位置"""
+        if self.user_counts.get(user):
+            self.user_min[user] = min((i for i, item in enumerate(self.items) if item[1] == user), key=lambda i: self.items[i][0])
+        else:
+            self.user_counts.pop(user, None)
+            self.user_min.pop(user, None)
+
+    def offer(self, key, user, element):
+        """
+        提交一个元素。
+
+        Args:
+            key: 随机键（可为元组，如 (重要度, 随机数)）
+            user (str): 用户名
+            element: 元素
+
+        Returns:
+            被淘汰或未被接收的元素，全部保留时返回 None
+        """
+        if self.user_counts.get(user, 0) >= self.user_cap:
+            i = self.user_min[user]
+            if key <= self.items[i][0]:
+                return element
+            evicted = self.items[i][2]
+            self.items[i] = [key, user, element]
+            self.refresh_user(user)
+            self.min_index = None
+            return evicted
+        if len(self.items) < self.capacity:
+            self.items.append([key, user, element])
+            self.user_counts[user] = self.user_counts.get(user, 0) + 1
+            self.refresh_user(user)
+            self.min_index = None
+            return None
+        if not self.items:
+            return element
+        if self.min_index is None:
+            self.min_index = min(range(len(self.items)), key=lambda i: self.items[i][0])
+        i = self.min_index
+        if key <= self.items[i][0]:
+            return element
+        _, old_user, evicted = self.items[i]
+        self.items[i] = [key, user, element]
+        self.user_counts[old_user] -= 1
+        self.user_counts[user] = self.user_counts.get(user, 0) + 1
+        self.refresh_user(old_user)
+        self.refresh_user(user)
+        self.min_index = None
+        return evicted
+
+    def top(self, count):
+        """键最大的 count 个元素（均匀随机样本的随机子集仍是均匀样本）"""
+        return [item[2] for item in sorted(self.items, key=lambda item: item[0], reverse=True)[:count]]
+
+class StratifiedSampler:
+    """
+    单次遍历、O(k) 内存的代表性抽样：
+    - 窗口按时间等分为若干层，每层独立做 bottom-k 随机抽样，最终按层均分名额（消息少的层让出的名额分给其他层），
+      消息风暴中也能覆盖整个周期，而不是只反映最后几分钟。
+    - 每层中单个用户最多占 user_share 比例，抑制刷屏；因用户上限被拒绝的消息进入该层的候补池，
+      发言用户较少、各层名额填不满时再用候补补足 k 条。
+    - 回复、长消息和命中事件类负面关键词的消息进入重要消息池（预留 important_share 比例），按重要度优先保留，
+      被挤出的重要消息回落到所属时间层继续参与抽样。
+    - 消息总数不超过 k 时原样保留全部消息。
+    """
+    def __init__(self, k, start, end, buckets=DEFAULT_BUCKETS, user_share=DEFAULT_USER_SHARE,
+                 important_share=DEFAULT_IMPORTANT_SHARE, seed=None):
+        """
+        Args:
+            k (int): 样本大小
+            start (datetime): 窗口起点
+            end (datetime): 窗口终点
+            buckets (int): 时间分层数
+            user_share (float): 单个用户在每层（及重要消息池）中最多占的比例
+            important_share (float): 重要消息池占样本的比例
+            seed (int): 可选的随机种子
+        """
+        self.k = k
+        self.start = start.timestamp()
+        self.span = max(end.timestamp() - self.start, 1.0)
+        self.buckets = max(buckets, 1)
+        self.random = random.Random(seed)
+        capacity = min(k, 2 * math.ceil(k / self.buckets))  # 每层多保留一倍，供其他层消息不足时补位
+        user_cap = max(1, round(k / self.buckets * user_share))  # 按每层最终名额计算用户上限
+        self.strata = [Reservoir(capacity, user_cap) for _ in range(self.buckets)]
+        self.overflow = [Reservoir(capacity, capacity) for _ in range(self.buckets)]  # 各层的候补池，不限用户
+        important_quota = int(k * important_share)
+        self.important = Reservoir(important_quota, max(1, round(important_quota * user_share))) if important_quota else None
+        self.bucket_counts = [0] * self.buckets  # 每层消息总数
+        self.seen = 0  # 已遍历的消息总数
+        self.head = []  # 前 k 条消息，总数不超过 k 时直接返回
+
+    def offer(self, item, created_at, score=0):
+        """
+        提交一条消息。
+
+        Args:
+            item (dict): message_to_dict() 返回的消息字典
+            created_at (datetime): 消息时间
+            score (int): importance() 返回的重要度
+        """
+        self.seen += 1
+        if self.head is not None:
+            if len(self.head) < self.k:
+                self.head.append(item)
+            else:
+                self.head = None
+        bucket = min(max(int((created_at.timestamp() - self.start) / self.span * self.buckets), 0), self.buckets - 1)
+        self.bucket_counts[bucket] += 1
+        entry = (bucket, item)
+        if score and self.important is not None:
+            entry = self.important.offer((score, self.random.random()), item['user'], entry)
+            if entry is None:
+                return
+        bucket, item = entry
+        rejected = self.strata[bucket].offer(self.random.random(), item['user'], item)
+        if rejected is not None:
+            self.overflow[bucket].offer(self.random.random(), rejected['user'], rejected)
+
+    def result(self):
+        """
+        生成样本。
+
+        Returns:
+            list: 按时间倒序排列的消息字典（与 get_conversation 一致）
+        """
+        if self.head is not None:
+            return sorted(self.head, key=lambda item: item['timestamp'], reverse=True)
+        chosen = [entry[1] for entry in self.important.top(self.important.capacity)] if self.important else []
+        remaining = self.k - len(chosen)
+        # 第一轮在受用户上限约束的各层中分配名额，第二轮用各层候补池补足仍空缺的名额
+        for pools in (self.strata, self.overflow):
+            allocation = allocate([len(pool.items) for pool in pools], remaining)
+            for pool, count in zip(pools, allocation):
+                chosen.extend(pool.top(count))
+            remaining -= sum(allocation)
+        return sorted(chosen, key=lambda item: item['timestamp'], reverse=True)
+
+def allocate(sizes, remaining):
+    """
+    将 remaining 个名额尽量均分给各层，元素不足的层让出的名额分给其他层。
+
+    Args:
+        sizes (list): 各层可用的元素数
+        remaining (int): 待分配的名额
+
+    Returns:
+        list: 各层分到的名额
+    """
+    allocation = [0] * len(sizes)
+    active = [b for b in range(len(sizes)) if sizes[b]]
+    while remaining > 0 and active:
+        share = max(remaining // len(active), 1)
+        for b in list(active):
+            take = min(share, sizes[b] - allocation[b], remaining)
+            allocation[b] += take
+            remaining -= take
+            if allocation[b] == sizes[b]:
+                active.remove(b)
+            if not remaining:
+                break
+    return allocation
+
+async def sample_channel_history(channel, k, after, before, mode=DEFAULT_SAMPLING_MODE):
+    """
+    单次遍历频道在时间窗口内的历史消息，返回抽样后的对话和消息总数，内存占用与窗口内消息总数无关。
+
+    Args:
+        channel (discord.TextChannel): 监控频道
+        k (int): 样本大小（monitor_max_messages）
+        after (datetime): 窗口起点
+        before (datetime): 窗口终点
+        mode (str): 抽样方式，见 SAMPLING_MODES
+
+    Returns:
+        tuple: (对话列表, 窗口内消息总数)，两种方式均与 get_conversation 一致按时间倒序
+    """
+    if mode == 'recent':
+        recent = deque(maxlen=k)
+        total = 0
+        async for msg in channel.history(limit=None, after=after, before=before):  # 按时间正序
+            recent.append(msg)
+            total += 1
+        return [message_to_dict(msg) for msg in reversed(recent)], total
+    sampler = StratifiedSampler(k, after, before)
+    async for msg in channel.history(limit=None, after=after, before=before):
+        sampler.offer(message_to_dict(msg), msg.created_at, importance(msg.content, msg.reference is not None))
+    return sampler.result(), sampler.seen
+
+def bench(count=20000, k=100, users=300, seed=0):
+    """
+    模拟 2 小时内 count 条消息的消息风暴（最后 20 分钟消息量激增、一个用户刷屏、零星长消息和回复），
+    对比只取最新 k 条与分层抽样的时间覆盖、用户分布和重要消息保留情况。
+    """
+    import datetime
+    import time
+
+    rng = random.Random(seed)
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(hours=2)
+    messages = []
+    for i in range(count):
+        # 一半消息集中在最后 20 分钟
+        offset = rng.uniform(6000, 7200) if i % 2 else rng.uniform(0, 7200)
+        user = 'spammer' if rng.random() < 0.25 else f'user{int(rng.paretovariate(1.2)) % users}'
+        content = 'wen token' if user == 'spammer' else 'gm'
+        if rng.random() < 0.003:
+            content = 'my wallet got drained after signing a fake claim, details: ' + 'x' * 200
+        messages.append((start + datetime.timedelta(seconds=offset), user, content, rng.random() < 0.01))
+    messages.sort()
+    important_total = sum(1 for m in messages if importance(m[2], m[3]) >= 2)
+
+    def describe(name, sample, elapsed_ms):
+        times = sorted(datetime.datetime.fromisoformat(item['timestamp']) for item in sample)
+        covered = (times[-1] - times[0]).total_seconds() / 60 if times else 0
+        spam = sum(1 for item in sample if item['user'] == 'spammer')
+        important = sum(1 for item in sample if importance(item['content'], item['reply']) >= 2)
+        print(f"{name}: {len(sample)} 条，覆盖 {covered:.0f}/120 分钟，刷屏用户占 {spam} 条，"
+              f"重要消息 {important}/{important_total} 条，耗时 {elapsed_ms:.1f} ms")
+
+    def as_item(m):
+        return {'id': 0, 'user': m[1], 'content': m[2], 'timestamp': m[0].isoformat(), 'is_bot': False, 'reply': m[3]}
+
+    t = time.perf_counter()
+    recent = [as_item(m) for m in messages[-k:]]
+    describe('最新 k 条', recent, (time.perf_counter() - t) * 1000)
+    t = time.perf_counter()
+    sampler = StratifiedSampler(k, start, end, seed=seed)
+    for m in messages:
+        sampler.offer(as_item(m), m[0], importance(m[2], m[3]))
+    describe('分层抽样', sampler.result(), (time.perf_counter() - t) * 1000)
+
+if __name__ == "__main__":
+    bench()
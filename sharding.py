@@ -0,0 +1,265 @@
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+RESTART_BACKOFF_SECONDS = (5, 15, 60)  # 子进程异常退出后的重启间隔，连续失败时逐级增加
+STABLE_SECONDS = 300  # 子进程连续运行超过该时长后重置退避
+
+def shard_for_guild(guild_id, shard_count):
+    """Discord 的分片规则：服务器 ID 右移 22 位（创建时间戳）对分片总数取模"""
+    return (int(guild_id) >> 22) % shard_count
+
+def parse_shard_ids(value):
+    """解析逗号分隔的分片 ID（如 "0,2,4"），空值返回 None"""
+    shard_ids = sorted({int(part) for part in (value or '').split(',') if part.strip()})
+    return shard_ids or None
+
+def assign_shards(shard_count, processes):
+    """
+    将分片轮流分配给各进程，ID 相邻的分片落在不同进程，各进程负载接近。
+
+    Returns:
+        list: 每个进程负责的分片 ID 列表
+    """
+    return [list(range(i, shard_count, processes)) for i in range(processes)]
+
+class ShardPlan:
+    """
+    本进程的分片范围。
+    - shard_count 为 None 且未开启自动分片时为单进程 commands.Bot（现有部署方式）。
+    - 只设置分片总数时由 AutoShardedBot 在本进程内运行全部分片；同时设置分片 ID 时本进程只连接这些分片，
+      其余分片由其他进程负责（见 launch()）。
+    - 持有 0 号分片的进程为主进程：负责接收 Telegram 更新和同步斜杠命令，避免多个进程重复执行。
+    """
+    def __init__(self, shard_count=None, shard_ids=None, auto=False):
+        """
+        Args:
+            shard_count (int): 分片总数
+            shard_ids (list): 本进程负责的分片 ID，None 表示全部
+            auto (bool): 是否使用 Discord 推荐的分片数（单进程 AutoShardedBot）
+        """
+        if shard_ids and not shard_count:
+            raise ValueError("设置 SHARD_IDS 时必须同时设置 SHARD_COUNT")
+        if shard_ids and any(shard_id >= shard_count for shard_id in shard_ids):
+            raise ValueError(f"SHARD_IDS 中的分片 ID 必须小于 SHARD_COUNT（{shard_count}）")
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids if shard_ids and len(shard_ids) < shard_count else None
+        self.auto = auto or bool(shard_count)
+
+    @classmethod
+    def from_env(cls, shard_count, shard_ids):
+        """
+        从环境变量创建。
+
+        Args:
+            shard_count (str): SHARD_COUNT，整数或 auto
+            shard_ids (str): SHARD_IDS，逗号分隔的分片 ID
+        """
+        if (shard_count or '').strip().lower() == 'auto':
+            return cls(None, parse_shard_ids(shard_ids), auto=True)
+        return cls(int(shard_count) if shard_count else None, parse_shard_ids(shard_ids))
+
+    @property
+    def partial(self):
+        """本进程是否只负责部分分片（多进程部署）"""
+        return self.shard_ids is not None
+
+    @property
+    def is_primary(self):
+        return not self.partial or 0 in self.shard_ids
+
+    @property
+    def label(self):
+        """用于日志和文件名的分片标识"""
+        return f"shards-{'-'.join(map(str, self.shard_ids))}" if self.partial else 'all'
+
+    def owns_guild(self, guild_id):
+        """服务器的网关事件是否发往本进程"""
+        return not self.partial or shard_for_guild(guild_id, self.shard_count) in self.shard_ids
+
+    def scoped_path(self, path):
+        """按分片区分的本地文件路径（多进程部署时各进程写各自的文件，如回填检查点、日志）"""
+        if not self.partial:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.label}{ext}"
+
+    def bot_kwargs(self):
+        """创建 AutoShardedBot 的分片参数"""
+        return {'shard_count': self.shard_count, 'shard_ids': self.shard_ids}
+
+def launch(processes, shard_count, script='bot.py'):
+    """
+    启动 processes 个 Bot 进程并负责监护：各进程负责 shard_count 个分片中的一部分，共用 config.db 共享配置库；
+    子进程异常退出时按退避间隔重启，收到 SIGINT/SIGTERM 时终止全部子进程。
+
+    Args:
+        processes (int): 进程数
+        shard_count (int): 分片总数（不少于进程数）
+        script (str): Bot 入口脚本
+    """
+    plans = assign_shards(shard_count, processes)
+    children = {}  # 进程序号 -> [Popen, 启动时间, 连续失败次数]
+    stopping = False
+
+    def start(index, failures=0):
+        env = {
+            **os.environ,
+            'SHARD_COUNT': str(shard_count),
+            'SHARD_IDS': ','.join(map(str, plans[index])),
+            'CONFIG_STORE': 'sqlite',
+        }
+        child = subprocess.Popen([sys.executable, script], env=env)
+        children[index] = [child, time.monotonic(), failures]
+        logger.info(f"进程 {index} 已启动（PID {child.pid}），负责分片 {plans[index]}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(processes):
+        start(index)
+    restarts = {}  # 进程序号 -> 计划重启时间
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for index, (child, started, failures) in list(children.items()):
+            code = child.poll()
+            if code is None or index in restarts:
+                continue
+            failures = 1 if now - started >= STABLE_SECONDS else failures + 1
+            delay = RESTART_BACKOFF_SECONDS[min(failures, len(RESTART_BACKOFF_SECONDS)) - 1]
+            logger.error(f"进程 {index} 退出（返回码 {code}），{delay} 秒后重启")
+            restarts[index] = (now + delay, failures)
+        for index, (due, failures) in list(restarts.items()):
+            if now >= due:
+                del restarts[index]
+                start(index, failures)
+    for child, _, _ in children.values():
+        if child.poll() is None:
+            child.terminate()
+    for child, _, _ in children.values():
+        try:
+            child.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            child.kill()
+
+def bench(messages=100000, guilds=2000, shard_count=8, process_counts=(1, 2, 4)):
+    """
+    按分片把模拟消息分配给不同进程，用 Bot 的真实消息热路径处理（见 bench_worker），
+    测量总吞吐随进程数的变化，并检查按服务器 ID 分片的负载均衡程度。
+    并行吞吐按各进程的 CPU 时间估算（总消息数 / 最忙进程的 CPU 时间），CPU 核数不少于进程数时与实际吞吐一致。
+    只覆盖网关消息处理的 CPU 开销；LLM 调用和 Discord/Telegram 请求是 IO 等待，不随进程数扩展，也不在测量范围内。
+    """
+    import random
+    from multiprocessing import Pool
+
+    random.seed(0)
+    guild_ids = [(random.getrandbits(41) << 22) | random.getrandbits(22) for _ in range(guilds)]
+    weights = [1 / (rank + 1) for rank in range(guilds)]  # 服务器活跃度长尾分布
+    traffic = random.choices(guild_ids, weights, k=messages)
+    shard_loads = [0] * shard_count
+    for guild_id in traffic:
+        shard_loads[shard_for_guild(guild_id, shard_count)] += 1
+    print(f"{shard_count} 个分片的消息占比: " + ' '.join(f"{load / messages:.1%}" for load in shard_loads))
+    baseline = None
+    for processes in process_counts:
+        jobs = [[guild_id for guild_id in traffic if shard_for_guild(guild_id, shard_count) in shard_ids]
+                for shard_ids in assign_shards(shard_count, processes)]
+        start = time.perf_counter()
+        with Pool(processes) as pool:
+            cpu_times = pool.map(bench_worker, jobs)
+        wall = messages / (time.perf_counter() - start)
+        throughput = messages / max(cpu_times)
+        baseline = baseline or throughput
+        print(f"{processes} 个进程: 并行吞吐 {throughput:,.0f} 条/秒（{throughput / baseline:.2f}x），"
+              f"本机实测 {wall:,.0f} 条/秒（含各进程加载服务器的时间），最忙进程处理 {max(map(len, jobs)) / messages:.1%} 的消息")
+    print(f"本机 CPU 核数: {len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()}")
+
+def bench_worker(guild_ids):
+    """
+    在单个进程内按 Bot 的消息热路径处理模拟消息，返回处理耗费的 CPU 时间（秒）：
+    解码网关 JSON 负载，discord.py 构造 Message 对象（与 MESSAGE_CREATE 的解析相同），
+    路由索引判断 Ticket/监控频道，监控频道消息计数并匹配负面关键词（与 on_message 相同）。
+    各服务器的 GUILD_CREATE 在计时前处理。
+    """
+    import json
+    import datetime
+    from types import SimpleNamespace
+    import discord
+    from cadence import ActivityTracker, get_cadence_config
+    from gateway_profile import client_kwargs, PROFILE_LEAN
+    from routing import RoutingIndex
+
+    client = discord.Client(**client_kwargs(PROFILE_LEAN))
+    state = client._connection
+    self_id = 10 ** 17
+    state.user = discord.ClientUser(state=state, data={'id': self_id, 'username': 'bot', 'discriminator': '0', 'avatar': None, 'bot': True})
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    guild_configs = {}
+    tracker = ActivityTracker()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cadence = get_cadence_config({})
+    for guild_id in set(guild_ids):
+        state.parse_guild_create({
+            'id': guild_id, 'name': f'guild {guild_id}', 'member_count': 1000, 'owner_id': self_id + 1,
+            'roles': [{'id': guild_id, 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0, 'hoist': False,
+                       'managed': False, 'mentionable': False, 'flags': 0}],
+            'channels': [{'id': guild_id + 1, 'type': 4, 'name': 'tickets', 'position': 0, 'permission_overwrites': []}]
+                + [{'id': guild_id + 10 + i, 'type': 0, 'name': f'channel {i}', 'position': i, 'permission_overwrites': [],
+                    'parent_id': guild_id + 1 if i >= 18 else None} for i in range(20)],
+            'members': [{'user': {'id': self_id, 'username': 'bot', 'discriminator': '0', 'avatar': None, 'bot': True},
+                         'roles': [], 'joined_at': timestamp, 'deaf': False, 'mute': False, 'flags': 0}],
+            'threads': [], 'emojis': [], 'stickers': [], 'voice_states': [], 'guild_scheduled_events': [],
+        })
+        monitor_channels = [guild_id + 10 + i for i in range(5)]
+        guild_configs[str(guild_id)] = {'ticket_category_ids': [guild_id + 1], 'monitor_channels': monitor_channels}
+        for channel_id in monitor_channels:
+            tracker.decide(channel_id, now, 7200, cadence)  # 登记监控频道，之后的消息计入窗口
+    routing_index = RoutingIndex(SimpleNamespace(config={'guilds': guild_configs}, config_version=0))
+    contents = ('gm', 'wen token', 'my wallet shows pending after i signed the bridge transaction, is this a scam?')
+    payloads = []
+    for i, guild_id in enumerate(guild_ids):
+        user_id = guild_id + 1000 + i % 300
+        payloads.append(json.dumps({'op': 0, 't': 'MESSAGE_CREATE', 's': i, 'd': {
+            'id': (guild_id << 1) + i, 'channel_id': guild_id + 10 + i % 20, 'guild_id': guild_id,
+            'author': {'id': user_id, 'username': f'user{user_id}', 'discriminator': '0', 'global_name': None, 'avatar': None},
+            'member': {'roles': [], 'joined_at': timestamp, 'nick': None, 'deaf': False, 'mute': False, 'flags': 0},
+            'content': contents[i % len(contents)], 'timestamp': timestamp, 'edited_timestamp': None, 'tts': False,
+            'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+        }}))
+    start = time.process_time()
+    for payload in payloads:
+        data = json.loads(payload)['d']
+        channel, _ = state._get_guild_channel(data, data['guild_id'])
+        message = discord.Message(state=state, channel=channel, data=data)
+        route = routing_index.get(message.guild.id)
+        if not route.is_ticket_channel(message.channel) and message.channel.id in route.monitor_channel_ids:
+            tracker.record(message.channel.id, message.content)
+    return time.process_time() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='以多进程分片方式启动 Bot：每个进程负责部分分片，共用共享配置库')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='进程数，默认 CPU 核数')
+    parser.add_argument('--shards', type=int, help='分片总数，默认等于进程数；服务器较多时按 Discord 推荐值（每分片约 1000 个服务器）设置')
+    parser.add_argument('--bench', action='store_true', help='运行分片吞吐基准测试，不启动 Bot')
+    args = parser.parse_args(argv)
+    if args.bench:
+        bench()
+        return
+    shard_count = args.shards or args.processes
+    if shard_count < args.processes:
+        parser.error('--shards 不能少于 --processes')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    launch(args.processes, shard_count)
+
+if __name__ == "__main__":
+    main()
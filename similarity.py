@@ -0,0 +1,183 @@
+import re
+import zlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 去重模式：off 关闭；link 推送时标注关联的首个问题 ID；suppress 重复问题只写入问题库，不推送到 Telegram
+DEDUP_MODES = ('off', 'link', 'suppress')
+
+# 默认参数，可通过服务器配置 dedup 覆盖
+DEFAULT_DEDUP_CONFIG = {
+    'mode': 'off',  # 需通过 /set_dedup 开启
+    'threshold': 0.75,  # 分析完成后，问题与近期问题的余弦相似度达到该值即视为重复
+    'skip_analysis': False,  # 是否在完整分析前跳过明显重复的 Ticket
+    'skip_threshold': 0.8,  # 完整分析前，Ticket 用户发言（未经 LLM 整理）与近期问题文本的相似度达到该值才跳过分析
+    'window_days': 7,  # 只与最近 N 天的问题比较
+}
+
+SIMILARITY_DIM = 2048  # 哈希特征维度
+SIMILARITY_CAPACITY = 500  # 每个服务器保留的最近问题数（环形缓冲）
+SIMILARITY_INITIAL_ROWS = 32  # 索引矩阵的初始行数，按需倍增到 SIMILARITY_CAPACITY，问题少的服务器不预占满容量内存
+SIMILARITY_MAX_GUILDS = 100  # 内存中最多保留的服务器索引数，超出时淘汰最久未使用的，再次使用时从问题库重建
+
+# 英文/数字按单词切分，中文等非 ASCII 文本按相邻两字切分（无需分词器）
+ASCII_WORD_RE = re.compile(r'[a-z0-9_]{2,}')
+NON_ASCII_RUN_RE = re.compile(r'[^\x00-\x7f\W]+')
+
+def get_dedup_config(config):
+    """合并服务器配置与默认去重参数
+    参数:
+        config: 服务器配置
+    返回:
+        dict: 完整的去重配置
+    """
+    return {**DEFAULT_DEDUP_CONFIG, **config.get('dedup', {})}
+
+def tokenize(text):
+    """将文本切分为特征词：英文单词 + 中文二元组（单字片段保留单字）"""
+    text = (text or '').lower()
+    tokens = ASCII_WORD_RE.findall(text)
+    for run in NON_ASCII_RUN_RE.findall(text):
+        tokens.extend(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+    return tokens
+
+def term_vector(text, dim=SIMILARITY_DIM):
+    """
+    将文本映射为哈希词频向量（次线性词频 1 + log(tf)），IDF 在查询时再乘上。
+
+    Returns:
+        np.ndarray: float32 向量
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return np.zeros(dim, dtype=np.float32)
+    buckets = np.fromiter((zlib.crc32(token.encode()) % dim for token in tokens), dtype=np.int64, count=len(tokens))
+    counts = np.bincount(buckets, minlength=dim).astype(np.float32)
+    np.log(counts, out=counts, where=counts > 0)
+    counts[buckets] += 1  # 出现过的特征为 1 + log(tf)
+    return counts
+
+def problem_text(problem):
+    """用于相似度比较的问题文本：简述 + 详情 + 原始对话"""
+    return f"{problem.get('summary', '')} {problem.get('details', '')} {problem.get('original', '')}"
+
+class SimilarityIndex:
+    """
+    单个服务器最近问题的 TF-IDF 向量索引。
+    - 向量存放在矩阵中，行数按需倍增到 capacity 后变为环形缓冲，淘汰最旧的问题时同步扣减文档频率。
+    - 查询时一次矩阵乘法计算与全部近期问题的余弦相似度。
+    """
+    def __init__(self, dim=SIMILARITY_DIM, capacity=SIMILARITY_CAPACITY):
+        self.dim = dim
+        self.capacity = capacity
+        rows = min(SIMILARITY_INITIAL_ROWS, capacity)
+        self.vectors = np.zeros((rows, dim), dtype=np.float32)  # 词频向量
+        self.squares = np.zeros((rows, dim), dtype=np.float32)  # 词频平方，查询时与 idf² 相乘得到向量范数
+        self.ids = np.zeros(rows, dtype=np.int64)  # 问题 ID
+        self.roots = np.zeros(rows, dtype=np.int64)  # 所属重复簇的首个问题 ID
+        self.times = np.zeros(rows, dtype=np.float64)  # 写入时间（Unix 时间戳）
+        self.meta = [None] * rows  # 问题类型、简述、详情，供跳过分析时复用
+        self.df = np.zeros(dim, dtype=np.float32)  # 文档频率
+        self.size = 0
+        self.cursor = 0
+
+    def grow(self):
+        """矩阵已写满但未达到 capacity 时，行数倍增（不超过 capacity）"""
+        rows = min(len(self.ids) * 2, self.capacity)
+        for name in ('vectors', 'squares', 'ids', 'roots', 'times'):
+            old = getattr(self, name)
+            new = np.zeros((rows,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        self.meta.extend([None] * (rows - len(self.meta)))
+
+    @property
+    def nbytes(self):
+        """索引矩阵占用的字节数"""
+        return self.vectors.nbytes + self.squares.nbytes
+
+    def add(self, problem_id, root_id, text, created_at, meta=None):
+        """
+        写入一个问题。
+
+        Args:
+            problem_id (int): 问题 ID
+            root_id (int): 所属重复簇的首个问题 ID（非重复问题为自身 ID）
+            text (str): 问题文本
+            created_at (float): Unix 时间戳
+            meta (dict): 可选的问题字段
+        """
+        if self.size == len(self.ids) < self.capacity:
+            self.grow()
+        slot = self.cursor
+        if self.size == self.capacity:
+            self.df -= self.vectors[slot] > 0  # 淘汰最旧的问题
+        vector = term_vector(text, self.dim)
+        self.vectors[slot] = vector
+        self.squares[slot] = vector * vector
+        self.df += vector > 0
+        self.ids[slot] = problem_id
+        self.roots[slot] = root_id or problem_id
+        self.times[slot] = created_at
+        self.meta[slot] = meta
+        self.cursor = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def query(self, text, since=0.0):
+        """
+        查找与文本最相似的近期问题。
+
+        Args:
+            text (str): 查询文本
+            since (float): 只比较该时间之后写入的问题
+
+        Returns:
+            tuple: (槽位, 相似度)，索引为空或没有可比较的问题时返回 (None, 0.0)
+        """
+        if not self.size:
+            return None, 0.0
+        idf = np.log((1 + self.size) / (1 + self.df)) + 1
+        query = term_vector(text, self.dim) * idf
+        query_norm = np.linalg.norm(query)
+        if not query_norm:
+            return None, 0.0
+        # cos(v∘idf, q∘idf) = v·(q∘idf²) / (sqrt(v²·idf²) * |q∘idf|)，两次矩阵向量乘法，无需生成加权矩阵
+        idf_squared = idf * idf
+        norms = np.sqrt(self.squares[:self.size] @ idf_squared)
+        scores = self.vectors[:self.size] @ (query * idf) / (np.maximum(norms, 1e-9) * query_norm)
+        scores[self.times[:self.size] < since] = 0.0
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+def bench(count=SIMILARITY_CAPACITY, queries=1000):
+    """写入 count 个模拟问题后测量单次查询耗时与重复识别效果"""
+    import random
+    import time
+
+    random.seed(0)
+    topics = ['提现失败，交易一直 pending', '钱包连接报错 error 500', '质押奖励没有到账', '跨链桥资产丢失',
+              'claim 按钮无法点击', '建议增加中文界面', '账户被盗请求冻结', '空投领取失败']
+    filler = '用户 反馈 今天 昨天 多次 尝试 仍然 客服 请 帮忙 处理 谢谢'.split()
+    index = SimilarityIndex()
+    start = time.perf_counter()
+    for i in range(count):
+        topic = random.choice(topics)
+        index.add(i + 1, i + 1, f"{topic} {' '.join(random.sample(filler, 5))} #{i}", 0.0, {'topic': topic})
+    add_ms = (time.perf_counter() - start) * 1000 / count
+    start = time.perf_counter()
+    hits = correct = 0
+    for _ in range(queries):
+        topic = random.choice(topics)
+        slot, score = index.query(f"{topic} {' '.join(random.sample(filler, 5))}")
+        hits += score >= DEFAULT_DEDUP_CONFIG['threshold']
+        correct += index.meta[slot]['topic'] == topic
+    query_ms = (time.perf_counter() - start) * 1000 / queries
+    _, unrelated = index.query('请问 NFT 铸造什么时候开始')
+    memory_mb = index.nbytes / 1024 / 1024
+    print(f"索引 {count} 个问题（{memory_mb:.1f} MB），写入 {add_ms:.3f} ms/个，查询 {query_ms:.3f} ms/次")
+    print(f"同主题查询命中重复 {hits}/{queries}，最相似问题主题正确 {correct}/{queries}，无关问题最高相似度 {unrelated:.2f}")
+
+if __name__ == "__main__":
+    bench()
@@ -1,16 +1,29 @@
 import asyncio
+import hmac
+import time
 import logging
+import secrets
+from urllib.parse import urlparse
+from aiohttp import web
 from telegram.ext import Application, CommandHandler
 from telegram import Update
 import discord
 import datetime
 from config_manager import ConfigManager
-from llm_analyzer import analyze_general_conversation
+from job_queue import AnalysisDispatcher, channel_ref, JOB_MONITOR_SUMMARY
+from llm_scheduler import PRIORITY_SUMMARY
 from utils import get_conversation
+from sampler import sample_channel_history, DEFAULT_SAMPLING_MODE
+from token_usage import BUDGET_EXHAUSTED, budget_status, monitor_sample_size, set_usage_scope
+from cadence import ActivityTracker, get_cadence_config, EARLY, SKIP, WAIT, HOLD, MAX_CHECK_INTERVAL
 from datetime import timezone, timedelta
 
 logger = logging.getLogger(__name__)
 
+# 只接收命令处理器实际用到的更新类型：处理器均通过 update.message 回复，编辑消息、频道帖子、回调等一律不订阅
+ALLOWED_UPDATES = [Update.MESSAGE]
+WEBHOOK_SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
 # 自定义过滤器，屏蔽非错误级别的 getUpdates 日志，避免日志污染
 class NoGetUpdatesFilter(logging.Filter):
     def filter(self, record):
@@ -28,11 +41,10 @@ class NoGetUpdatesFilter(logging.Filter):
             return False
         return True
 
-for handler in logging.getLogger().handlers:
-    handler.addFilter(NoGetUpdatesFilter())
-
 class TelegramBot:
-    def __init__(self, token, config_manager, discord_bot, default_llm_api_key, default_base_url, default_model_id):
+    def __init__(self, token, config_manager, discord_bot, default_llm_api_key, default_base_url, default_model_id, problem_store=None, timeseries_store=None, activity_tracker=None, default_token_budget=0,
+                 webhook_url=None, webhook_listen='0.0.0.0', webhook_port=8443, webhook_secret=None, api_base_url=None,
+                 receive_updates=True, owns_guild=None, heartbeat_file='heartbeat.log', analysis_jobs=None):
         """
         初始化 Telegram Bot，设置基本属性。
         
@@ -43,15 +55,45 @@ class TelegramBot:
             default_llm_api_key (str): 默认 LLM API 密钥
             default_base_url (str): 默认 LLM API 基础 URL
             default_model_id (str): 默认 LLM 模型 ID
+            problem_store (ProblemStore): 可选的本地问题库，用于保存 General Chat 总结
+            timeseries_store (TimeSeriesStore): 可选的时间序列存储，用于记录每个周期的消息量与情绪
+            activity_tracker (ActivityTracker): 监控频道活动计数，由 Discord on_message 写入，用于自适应调度
+            default_token_budget (int): 使用默认 LLM 密钥的服务器每日 token 上限，0 表示不限
+            webhook_url (str): 可选，Telegram 推送更新的公网 HTTPS 地址；设置后使用 Webhook 模式代替长轮询
+            webhook_listen (str): Webhook 本地监听地址
+            webhook_port (int): Webhook 本地监听端口
+            webhook_secret (str): Webhook 校验密钥，未设置时每次启动随机生成
+            api_base_url (str): 可选，Telegram Bot API 地址（如本地 Bot API 服务器或测试用的模拟服务器）
+            receive_updates (bool): 是否接收 Telegram 更新（轮询或 Webhook）；多进程部署时只有主进程接收，其他进程只推送消息
+            owns_guild (callable): 判断服务器是否由本进程负责，多进程部署时用于区分其他分片的服务器
+            heartbeat_file (str): 心跳日志文件路径
+            analysis_jobs (AnalysisDispatcher): 分析任务入口，默认在本进程的工作线程中执行
         """
-        self.application = Application.builder().token(token).build()  # 创建 Telegram Application 实例
+        builder = Application.builder().token(token)
+        if api_base_url:
+            builder = builder.base_url(api_base_url)
+        self.application = builder.build()  # 创建 Telegram Application 实例
         self.config_manager = config_manager  # 用于访问配置
         self.discord_bot = discord_bot  # 用于跨平台交互
         self.default_llm_api_key = default_llm_api_key  # 默认 LLM 配置
         self.default_base_url = default_base_url
         self.default_model_id = default_model_id
+        self.problem_store = problem_store
+        self.timeseries_store = timeseries_store
+        self.activity_tracker = activity_tracker or ActivityTracker()
+        self.default_token_budget = default_token_budget
         self.heartbeat_channels = set()  # 存储启用了心跳日志接收的 Telegram 频道 ID
-        self.is_polling = False  # 标志位，跟踪轮询状态
+        self.is_polling = False  # 标志位，跟踪轮询（或 Webhook）运行状态
+        self.webhook_url = webhook_url
+        self.webhook_listen = webhook_listen
+        self.webhook_port = webhook_port
+        self.webhook_secret = webhook_secret or secrets.token_urlsafe(32)
+        self.webhook_runner = None  # Webhook 模式下的 aiohttp 服务
+        self.receive_updates = receive_updates
+        self.owns_guild = owns_guild or (lambda guild_id: True)
+        self.heartbeat_file = heartbeat_file
+        self.analysis_jobs = analysis_jobs or AnalysisDispatcher()
+        self.monitor_tasks = {}  # 监控频道 ID -> 正在进行的窗口分析任务
         logger.info("Telegram Bot 初始化完成")
 
     async def send_problem_form(self, problem, tg_channel_id):
@@ -70,7 +112,8 @@ class TelegramBot:
             f"时间: <b>{problem['timestamp']}</b>\n\n"
             f"简述: {problem['summary']}\n\n"
             f"详情: {problem['details']}\n\n"
-            f"<a href=\"{problem['link']}\"><em>🔗 跳转至 Ticket</em></a>\n"
+            + (f"关联问题: <b>#{problem['duplicate_of']}</b>（疑似重复）\n\n" if problem.get('duplicate_of') else "")
+            + f"<a href=\"{problem['link']}\"><em>🔗 跳转至 Ticket</em></a>\n"
             f"------------------------------------------"
         )
         try:
@@ -110,11 +153,57 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"发送总结到 {tg_channel_id} 失败: {e}")
 
+    async def publish_general_summary(self, guild_id, channel, config, summary, period_hours, total_messages, monitored_messages, end_time=None, notify=True):
+        """
+        发布 General Chat 总结：补充发布字段，推送到 Telegram，并写入问题库和时间序列。
+        定时分析与历史回填共用此流程。
+        
+        Args:
+            guild_id (str): Discord 服务器 ID
+            channel (discord.TextChannel): 监控频道
+            config (dict): 服务器配置
+            summary (dict): GeneralSummary.dict()
+            period_hours (float): 窗口长度（小时），合并冷清周期或提前分析时不等于监控周期
+            total_messages (int): 周期内消息数
+            monitored_messages (int): 实际分析的消息数
+            end_time (datetime): 周期结束时间，默认当前时间（回填时为历史窗口结束时间）
+            notify (bool): 是否推送到 Telegram
+        """
+        timezone_offset = config.get('timezone', 0)
+        tz = timezone(timedelta(hours=timezone_offset))
+        local_time = (end_time or datetime.datetime.now(tz)).astimezone(tz)
+        formatted_publish_time = local_time.strftime("%Y-%m-%d %H:%M") + f" UTC+{timezone_offset}"
+        summary['publish_time'] = formatted_publish_time
+        summary['monitor_period'] = f"{period_hours} 小时"
+        summary['monitored_messages'] = monitored_messages
+        summary['total_messages'] = total_messages
+        tg_channel_id = config.get('tg_channel_id')
+        if notify and tg_channel_id:
+            await self.send_general_summary(summary, tg_channel_id)
+        if self.problem_store:
+            try:
+                await asyncio.to_thread(
+                    self.problem_store.add_summary, guild_id, channel.id, channel.name, summary, local_time.timestamp()
+                )
+            except Exception as e:
+                logger.error(f"写入总结记录失败，频道: {channel.name}，错误: {e}")
+        if self.timeseries_store:
+            try:
+                await asyncio.to_thread(
+                    self.timeseries_store.append, guild_id, channel.id, local_time.timestamp(), period_hours * 3600,
+                    total_messages, monitored_messages, summary['emotion'], summary['key_events']
+                )
+            except Exception as e:
+                logger.error(f"写入时间序列失败，频道: {channel.name}，错误: {e}")
+
     async def periodic_general_analysis(self):
         """
         定期分析 Discord General Chat 频道并发送总结到 Telegram。
-        - 监控周期根据每个服务器的 monitor_period 动态调整，确保监控周期=回溯周期。
+        - 每个频道的窗口由 ActivityTracker 调度：fixed 模式按 monitor_period 固定分析；
+          adaptive 模式跳过冷清周期（并入更长的窗口），并在消息量或负面关键词突增时提前分析。
         - 如果 Bot 未激活，则跳过分析。
+        - 各频道的分析在独立任务中并发执行（并发数由 LLM 调度器限制），慢接口不会拖住其他服务器的频道；
+          单个频道分析失败（如 LLM 接口故障或断路）时记录错误，不中断监控循环。
         """
         while True:
             if not self.config_manager.is_bot_activated():
@@ -123,54 +212,128 @@ class TelegramBot:
                 continue
             
             guilds_config = self.config_manager.config.get('guilds', {})
-            min_sleep = float('inf')  # 用于记录下次最早执行时间
+            min_sleep = float('inf')  # 用于记录下次最早检查时间
             
-            for guild_id, config in guilds_config.items():
-                guild = self.discord_bot.get_guild(int(guild_id))
-                if not guild:
-                    continue
-                
-                monitor_channels = config.get('monitor_channels', [])
-                period_hours = config.get('monitor_period', 2)  # 默认 2 小时
-                period_seconds = period_hours * 3600  # 转换为秒
-                
-                for channel_id in monitor_channels:
-                    channel = guild.get_channel(channel_id)
-                    if channel:
-                        max_messages = config.get('monitor_max_messages', 100)  # 默认 100 条
-                        since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=period_hours)
-                        messages = [msg async for msg in channel.history(limit=None, after=since)]
-                        total_messages = len(messages)
-                        monitored_messages = min(total_messages, max_messages)
-                        conversation = await get_conversation(channel, limit=monitored_messages)
-                        llm_config = self.config_manager.get_llm_config(guild_id) or {
-                            'api_key': self.default_llm_api_key,
-                            'model_id': self.default_model_id,
-                            'base_url': self.default_base_url
-                        }
-                        summary = analyze_general_conversation(
-                            conversation, channel, guild_id, config,
-                            llm_config['api_key'], llm_config['base_url'], llm_config['model_id']
+            try:
+                for guild_id, config in list(guilds_config.items()):
+                    guild = self.discord_bot.get_guild(int(guild_id))
+                    if not guild:
+                        continue
+                    
+                    monitor_channels = config.get('monitor_channels', [])
+                    period_seconds = config.get('monitor_period', 2) * 3600  # 默认 2 小时，转换为秒
+                    cadence = get_cadence_config(config)
+                    
+                    for channel_id in monitor_channels:
+                        channel = guild.get_channel(channel_id)
+                        if not channel:
+                            continue
+                        task = self.monitor_tasks.get(channel_id)
+                        if task and not task.done():
+                            continue  # 上一窗口仍在分析（如 LLM 接口较慢），完成后再调度
+                        now = datetime.datetime.now(datetime.timezone.utc)
+                        # 先检查今日 token 预算再调度：用尽时保留窗口（不重置计数），预算恢复后一起分析；接近预算时缩小样本
+                        level, used, budget = budget_status(self.config_manager, guild_id, self.default_token_budget)
+                        action, since, count, wait = self.activity_tracker.decide(
+                            channel_id, now, period_seconds, cadence, hold=level == BUDGET_EXHAUSTED
                         )
-                        timezone_offset = config.get('timezone', 0)
-                        tz = timezone(timedelta(hours=timezone_offset))
-                        local_time = datetime.datetime.now(tz)
-                        formatted_publish_time = local_time.strftime("%Y-%m-%d %H:%M") + f" UTC+{timezone_offset}"
-                        summary['publish_time'] = formatted_publish_time
-                        summary['monitor_period'] = f"{period_hours} 小时"
-                        summary['monitored_messages'] = monitored_messages
-                        summary['total_messages'] = total_messages
-                        tg_channel_id = config.get('tg_channel_id')
-                        if tg_channel_id:
-                            await self.send_general_summary(summary, tg_channel_id)
-                
-                # 更新下次最早执行时间
-                min_sleep = min(min_sleep, period_seconds)
+                        min_sleep = min(min_sleep, wait)
+                        if action == HOLD:
+                            logger.warning(f"服务器 {guild_id} 今日 token 用量 {used}/{budget} 已达预算，监控频道 {channel.name} 本周期分析顺延")
+                            self.config_manager.increment_stat(guild_id, 'budget_skipped')
+                            continue
+                        if action == SKIP:
+                            logger.info(f"监控频道 {channel.name} 本周期仅 {count} 条消息，并入下一周期分析")
+                            self.config_manager.increment_stat(guild_id, 'monitor_skipped')
+                            continue
+                        if action == WAIT:
+                            continue
+                        if action == EARLY:
+                            logger.info(f"监控频道 {channel.name} 消息量或负面关键词突增（{count} 条），提前分析")
+                            self.config_manager.increment_stat(guild_id, 'monitor_early')
+                        self.monitor_tasks[channel_id] = asyncio.create_task(
+                            self.run_monitor_window(guild_id, channel, config, since, now, count, monitor_sample_size(config, level))
+                        )
+            except Exception as e:
+                logger.error(f"General Chat 调度检查失败: {e}", exc_info=True)  # 不中断监控循环，下次检查重试
             
-            # 等待下次执行，使用所有服务器中最短的周期
-            sleep_duration = min_sleep if min_sleep != float('inf') else 7200  # 默认 2 小时
-            logger.info(f"下次 General Chat 分析将在 {sleep_duration / 3600} 小时后执行")
-            await asyncio.sleep(sleep_duration)
+            # 等待下次检查，突增的频道会提前唤醒
+            sleep_duration = min_sleep if min_sleep != float('inf') else MAX_CHECK_INTERVAL
+            logger.info(f"下次 General Chat 调度检查将在 {sleep_duration / 60:.0f} 分钟内执行")
+            await self.activity_tracker.wait(sleep_duration)
+
+    async def run_monitor_window(self, guild_id, channel, config, since, until, total_messages, max_messages):
+        """在独立任务中分析监控频道一个窗口，失败时记录错误并计入统计（参数同 analyze_monitor_window）"""
+        try:
+            await self.analyze_monitor_window(guild_id, channel, config, since, until, total_messages, max_messages)
+        except Exception as e:
+            logger.error(f"监控频道 {channel.name} 本周期分析失败: {e}")
+            self.config_manager.increment_stat(guild_id, 'monitor_failed')
+
+    async def analyze_monitor_window(self, guild_id, channel, config, since, until, total_messages=None, max_messages=None):
+        """
+        分析监控频道一个窗口内的消息并发布总结。
+
+        Args:
+            guild_id (str): Discord 服务器 ID
+            channel (discord.TextChannel): 监控频道
+            config (dict): 服务器配置
+            since (datetime): 窗口起点
+            until (datetime): 窗口终点
+            total_messages (int): 窗口内消息数，由 on_message 计数得到；为 None 时遍历频道历史统计（仅 recent 抽样方式使用）
+            max_messages (int): 最大分析消息数，默认取 monitor_max_messages（预算降级时更小）
+        """
+        set_usage_scope(guild_id)  # 本次分析的 token 用量计入该服务器
+        max_messages = max_messages or config.get('monitor_max_messages', 100)  # 默认 100 条
+        sampling = config.get('monitor_sampling', DEFAULT_SAMPLING_MODE)
+        if sampling == 'stratified':
+            # 单次遍历整个窗口分层抽样，同时得到准确的消息总数
+            conversation, total_messages = await sample_channel_history(channel, max_messages, since, until, sampling)
+            if not conversation:
+                logger.info(f"监控频道 {channel.name} 窗口内没有消息，跳过分析")
+                return
+        else:
+            if total_messages is None:
+                total_messages = len([msg async for msg in channel.history(limit=None, after=since)])
+            conversation = await get_conversation(channel, limit=min(total_messages, max_messages))
+        monitored_messages = len(conversation)
+        llm_config = self.config_manager.get_llm_config(guild_id) or {
+            'api_key': self.default_llm_api_key,
+            'model_id': self.default_model_id,
+            'base_url': self.default_base_url
+        }
+        window_hours = round((until - since).total_seconds() / 3600, 1)
+
+        async def publish(summary):
+            await self.publish_general_summary(
+                guild_id, channel, config, summary, int(window_hours) if window_hours.is_integer() else window_hours,
+                total_messages, monitored_messages
+            )
+
+        # 总结发布后才确认任务交付，发布前 Bot 进程退出时重启后由 recover_monitor_summary 重新发布
+        await self.analysis_jobs.run(JOB_MONITOR_SUMMARY, {
+            'guild_id': guild_id, 'channel': channel_ref(channel), 'config': config, 'conversation': conversation,
+            'window_hours': window_hours, 'total_messages': total_messages, 'until': until.isoformat()
+        }, llm_config, PRIORITY_SUMMARY, publish=publish)
+
+    async def recover_monitor_summary(self, job):
+        """
+        发布 Bot 重启前提交、重启后才完成的监控频道总结（按原窗口的结束时间记录）。
+
+        Args:
+            job (Job): 已完成的 monitor_summary 任务
+        """
+        payload = job.payload
+        channel = self.discord_bot.get_channel(payload['channel']['id'])
+        if channel is None:
+            logger.warning(f"监控频道 {payload['channel']['name']} 已不可见，丢弃重启前的总结")
+            return
+        window_hours = payload['window_hours']
+        await self.publish_general_summary(
+            payload['guild_id'], channel, self.config_manager.get_guild_config(payload['guild_id']), job.result,
+            int(window_hours) if window_hours.is_integer() else window_hours,
+            payload['total_messages'], len(payload['conversation']), datetime.datetime.fromisoformat(payload['until'])
+        )
 
     async def get_group_id(self, update: Update, context):
         """
@@ -199,6 +362,8 @@ class TelegramBot:
                 guild = self.discord_bot.get_guild(int(guild_id))
                 if guild:
                     bound_servers.append({'name': guild.name, 'id': guild_id})
+                elif not self.owns_guild(guild_id):
+                    bound_servers.append({'name': '其他分片进程', 'id': guild_id})  # 服务器由其他进程连接，本进程没有其缓存
         response = "当前绑定的 Discord 服务器:\n" + "\n".join([f"- {s['name']} (ID: {s['id']})" for s in bound_servers]) if bound_servers else "当前没有绑定的 Discord 服务器"
         await update.message.reply_text(response)
 
@@ -240,7 +405,7 @@ class TelegramBot:
         while True:
             await asyncio.sleep(60)
             if self.heartbeat_channels:
-                with open('heartbeat.log', 'r') as f:
+                with open(self.heartbeat_file, 'r') as f:
                     lines = f.readlines()
                     if lines:
                         latest_log = lines[-1].strip()
@@ -250,9 +415,58 @@ class TelegramBot:
                             except Exception as e:
                                 logger.error(f"发送心跳日志到 {chat_id} 失败: {e}")
 
+    async def handle_webhook(self, request):
+        """
+        接收 Telegram 推送的更新，校验密钥后放入 Application 的更新队列，立即返回 200。
+
+        Args:
+            request (aiohttp.web.Request): Telegram 的 POST 请求
+
+        Returns:
+            aiohttp.web.Response: 响应
+        """
+        if not hmac.compare_digest(request.headers.get(WEBHOOK_SECRET_HEADER, ''), self.webhook_secret):
+            logger.warning(f"拒绝密钥不匹配的 Webhook 请求，来源: {request.remote}")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        update = Update.de_json(data, self.application.bot)
+        if update is not None:
+            await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def start_webhook(self):
+        """
+        启动本地 aiohttp 服务接收更新，并向 Telegram 注册 Webhook。
+        本地路由路径与 webhook_url 的路径一致，便于反向代理直接转发。
+        """
+        path = urlparse(self.webhook_url).path or '/'
+        server = web.Application()
+        server.router.add_post(path, self.handle_webhook)
+        self.webhook_runner = web.AppRunner(server, access_log=None)
+        await self.webhook_runner.setup()
+        await web.TCPSite(self.webhook_runner, self.webhook_listen, self.webhook_port).start()
+        await self.application.bot.set_webhook(
+            url=self.webhook_url,
+            allowed_updates=ALLOWED_UPDATES,
+            secret_token=self.webhook_secret
+        )
+        logger.info(f"Telegram Webhook 已注册: {self.webhook_url}，本地监听 {self.webhook_listen}:{self.webhook_port}{path}")
+
+    def add_handlers(self):
+        """注册 Telegram 命令处理器"""
+        self.application.add_handler(CommandHandler('get_group_id', self.get_group_id))
+        self.application.add_handler(CommandHandler('current_binding', self.current_binding))
+        self.application.add_handler(CommandHandler('heartbeat_on', self.heartbeat_on))
+        self.application.add_handler(CommandHandler('heartbeat_off', self.heartbeat_off))
+
     async def run(self):
         """
-        启动 Telegram Bot 的主循环，注册命令并开始轮询。
+        启动 Telegram Bot 的主循环，注册命令并开始接收更新。
+        设置了 webhook_url 时由 Telegram 主动推送更新，否则使用长轮询；两种模式都只订阅 ALLOWED_UPDATES。
+        receive_updates 为 False 时不接收更新（同一 Token 只能有一个进程轮询），只运行本进程服务器的监控分析并推送消息。
         """
         logger.info("Telegram Bot 启动中...")
         
@@ -261,23 +475,32 @@ class TelegramBot:
             logger.warning("Telegram Bot 已在轮询中，跳过重复启动")
             return
         
-        # 注册 Telegram 命令处理器
-        self.application.add_handler(CommandHandler('get_group_id', self.get_group_id))
-        self.application.add_handler(CommandHandler('current_binding', self.current_binding))
-        self.application.add_handler(CommandHandler('heartbeat_on', self.heartbeat_on))
-        self.application.add_handler(CommandHandler('heartbeat_off', self.heartbeat_off))
-        
         # 启动定期任务
         asyncio.create_task(self.periodic_general_analysis())
+        
+        if not self.receive_updates:
+            await self.application.initialize()  # 只用于发送消息
+            logger.info("Telegram Bot 已启动（仅推送，更新由主进程接收）")
+            try:
+                await asyncio.Event().wait()  # 保持运行
+            finally:
+                await self.application.shutdown()
+        
+        self.add_handlers()
         asyncio.create_task(self.send_heartbeat_logs())
         
         try:
             await self.application.initialize()
             await self.application.start()
-            logger.info("准备启动 Telegram 轮询...")
             self.is_polling = True
-            await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
-            logger.info("Telegram Bot 已启动并开始轮询")
+            if self.webhook_url:
+                await self.start_webhook()
+                logger.info("Telegram Bot 已启动（Webhook 模式）")
+            else:
+                logger.info("准备启动 Telegram 轮询...")
+                # 轮询启动时会自动删除已注册的 Webhook，两种模式可随时切换
+                await self.application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+                logger.info("Telegram Bot 已启动并开始轮询")
             await asyncio.Event().wait()  # 保持运行
         except Exception as e:
             self.is_polling = False
@@ -288,4 +511,204 @@ class TelegramBot:
             raise
         finally:
             self.is_polling = False
-            logger.info("Telegram Bot 轮询已停止")
\ No newline at end of file
+            if self.webhook_runner is not None:
+                await self.webhook_runner.cleanup()  # Webhook 保持注册，重启期间的更新由 Telegram 暂存
+                self.webhook_runner = None
+            logger.info("Telegram Bot 轮询已停止")
+class FakeBotApi:
+    """
+    本地模拟的 Telegram Bot API，仅用于 bench()：
+    - 实现 getMe、setWebhook、deleteWebhook、getUpdates（长轮询）和 sendMessage，记录每个方法的请求数。
+    - 与 Telegram 一样按 allowed_updates 过滤更新类型；注册了 Webhook 时携带密钥头 POST 给 Bot，否则放入 getUpdates 队列。
+    - 长轮询的等待时长按 speed 倍缩短，空闲期的请求数按模拟时间换算。
+    """
+    def __init__(self, speed=10.0):
+        self.speed = speed
+        self.requests = {}  # 方法名 -> 请求数
+        self.webhook = None  # setWebhook 的参数
+        self.allowed_updates = None  # 最近一次 getUpdates 或 setWebhook 的 allowed_updates
+        self.queue = []  # 等待 getUpdates 取走的更新
+        self.arrived = asyncio.Event()
+        self.update_id = 0
+        self.delivered = {}  # 更新类型 -> 交给 Bot 的次数
+        self.sent = {}  # 对话 ID -> 收到 sendMessage 的时间
+        self.session = None
+        self.runner = None
+        self.base_url = None
+
+    async def start(self):
+        import aiohttp
+
+        server = web.Application()
+        server.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(server, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/bot"
+        self.session = aiohttp.ClientSession()
+
+    async def stop(self):
+        await self.session.close()
+        await self.runner.cleanup()
+
+    async def handle(self, request):
+        import json
+
+        method = request.match_info['method']
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = {}
+            for key, value in (await request.post()).items():
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif method == 'setWebhook':
+            self.webhook = params
+            self.allowed_updates = params.get('allowed_updates')
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook = None
+            result = True
+        elif method == 'getUpdates':
+            self.allowed_updates = params.get('allowed_updates') or self.allowed_updates
+            offset = int(params.get('offset') or 0)
+            self.queue = [update for update in self.queue if update['update_id'] >= offset]
+            if not self.queue:
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), float(params.get('timeout') or 0) / self.speed)
+                except asyncio.TimeoutError:
+                    pass
+            result, self.queue = self.queue, []
+        elif method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            self.sent[chat_id] = time.monotonic()
+            result = {'message_id': len(self.sent), 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'group', 'title': 'bench'},
+                      'from': {'id': 1, 'is_bot': True, 'first_name': 'bench'}, 'text': params.get('text', '')}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    def make_update(self, kind, chat_id):
+        self.update_id += 1
+        now = int(time.time())
+        chat = {'id': chat_id, 'type': 'channel' if kind == 'channel_post' else 'group', 'title': 'bench'}
+        user = {'id': 2, 'is_bot': False, 'first_name': 'user'}
+        if kind == 'message_reaction':
+            body = {'chat': chat, 'message_id': 1, 'date': now, 'user': user, 'old_reaction': [],
+                    'new_reaction': [{'type': 'emoji', 'emoji': '👍'}]}
+        elif kind == 'message':
+            body = {'message_id': self.update_id, 'date': now, 'chat': chat, 'from': user, 'text': '/get_group_id',
+                    'entities': [{'type': 'bot_command', 'offset': 0, 'length': 13}]}
+        else:
+            body = {'message_id': self.update_id, 'date': now, 'chat': chat, 'from': user, 'text': 'hello'}
+            if kind == 'edited_message':
+                body['edit_date'] = now
+        return {'update_id': self.update_id, kind: body}
+
+    async def push(self, kind, chat_id):
+        """Telegram 侧产生一条更新，按当前接收方式交给 Bot；不在 allowed_updates 中的类型不交付"""
+        if self.allowed_updates and kind not in self.allowed_updates:
+            return
+        self.delivered[kind] = self.delivered.get(kind, 0) + 1
+        update = self.make_update(kind, chat_id)
+        if self.webhook:
+            async with self.session.post(self.webhook['url'], json=update,
+                                         headers={WEBHOOK_SECRET_HEADER: self.webhook.get('secret_token', '')}) as response:
+                response.raise_for_status()
+        else:
+            self.queue.append(update)
+            self.arrived.set()
+
+def bench(duration=600.0, commands=20, noise_per_command=10, speed=10.0):
+    """
+    对照本地模拟的 Telegram Bot API（FakeBotApi）运行 TelegramBot：旧的长轮询（订阅全部更新类型）、
+    当前的长轮询（只订阅 ALLOWED_UPDATES）和 Webhook 模式，在 duration 秒模拟时间内
+    发送 commands 条 /get_group_id 命令，每条命令伴随 noise_per_command 条 Bot 不处理的更新（编辑、频道帖子、表情回应），
+    输出命令从产生到收到 sendMessage 回复的耗时、交付的更新数和 Bot 发出的 Bot API 请求数（按每小时换算）。
+    Webhook 模式同时检查 setWebhook 的 allowed_updates、缺少密钥的请求被拒绝（403）以及命令得到回复。
+    """
+    import os
+    import random
+    import socket
+    import aiohttp
+
+    logging.getLogger('telegram').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    noise_kinds = ['edited_message', 'channel_post', 'message_reaction']
+
+    async def simulate(mode):
+        rng = random.Random(0)
+        api = FakeBotApi(speed)
+        await api.start()
+        webhook_url = None
+        if mode == 'webhook':
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+            webhook_url = f"http://127.0.0.1:{port}/telegram"
+        bot = TelegramBot('123:bench', None, None, None, None, None, webhook_url=webhook_url, webhook_listen='127.0.0.1',
+                          webhook_port=port if webhook_url else 8443, api_base_url=api.base_url, heartbeat_file=os.devnull)
+        bot.add_handlers()
+        await bot.application.initialize()
+        await bot.application.start()
+        checks = []
+        if webhook_url:
+            await bot.start_webhook()
+            checks.append(f"setWebhook allowed_updates={api.webhook.get('allowed_updates')}")
+            async with aiohttp.ClientSession() as session:
+                async with session.post(webhook_url, json=api.make_update('message', 0)) as response:
+                    checks.append(f"缺少密钥的请求 {response.status}")
+        else:
+            await bot.application.updater.start_polling(allowed_updates=Update.ALL_TYPES if mode == 'polling_all' else ALLOWED_UPDATES)
+        baseline = sum(api.requests.values())
+        latencies = []
+        start = time.monotonic()
+        for i in range(commands):
+            chat_id = -1000 - i
+            events = ['message'] + [rng.choice(noise_kinds) for _ in range(noise_per_command)]
+            rng.shuffle(events)
+            for kind in events:
+                await asyncio.sleep(duration / commands / len(events) / speed)
+                if kind == 'message':
+                    sent_at = time.monotonic()
+                await api.push(kind, chat_id)
+            for _ in range(200):
+                if chat_id in api.sent:
+                    break
+                await asyncio.sleep(0.01)
+            if chat_id in api.sent:
+                latencies.append((api.sent[chat_id] - sent_at) * 1000)
+        elapsed = (time.monotonic() - start) * speed
+        requests = {method: count for method, count in api.requests.items()}
+        background = sum(requests.values()) - baseline - len(latencies)  # 除 sendMessage 回复外 Bot 主动发出的请求
+        if webhook_url:
+            checks.append(f"命令回复 {len(latencies)}/{commands}")
+            await bot.webhook_runner.cleanup()
+        else:
+            await bot.application.updater.stop()
+        await bot.application.stop()
+        await bot.application.shutdown()
+        await api.stop()
+        return latencies, background, elapsed, sum(api.delivered.values()), requests, checks
+
+    async def main():
+        for mode, label in (('polling_all', '长轮询（全部更新类型）'), ('polling', '长轮询（ALLOWED_UPDATES）'), ('webhook', 'Webhook')):
+            latencies, background, elapsed, delivered, requests, checks = await simulate(mode)
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] if latencies else float('nan')
+            p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] if latencies else float('nan')
+            print(f"{label}: 命令回复耗时 p50 {p50:.1f} ms p99 {p99:.1f} ms；交付更新 {delivered} 条；"
+                  f"后台 Bot API 请求 {background} 次（每小时约 {background / elapsed * 3600:.0f} 次）；"
+                  f"请求明细 {requests}" + (f"；检查: {'，'.join(checks)}" if checks else ''))
+
+    asyncio.run(main())
+
+if __name__ == "__main__":
+    bench()
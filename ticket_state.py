@@ -0,0 +1,43 @@
+import asyncio
+
+class TicketState:
+    """单个 Ticket 频道的分析状态"""
+    def __init__(self):
+        self.last_message_id = None  # 已纳入分析的最后一条消息 ID
+        self.problem = None  # 当前的问题草稿（问题字典）
+        self.triage_rejected_id = None  # 初筛判定无效时的最后一条消息 ID，无新消息时不重复初筛
+        self.published_draft = None  # 最近一次发布的问题草稿（发布前的副本），草稿未变化时不重复发布
+        self.published_id = None  # 最近一次发布分配的问题 ID
+        self.lock = asyncio.Lock()  # 同一频道的分析串行执行，避免后台更新与 /warp_msg 重复调用 LLM
+        self.refresh_task = None  # 后台草稿更新任务
+
+class TicketStateStore:
+    """存储所有未关闭 Ticket 频道的分析状态，键为频道 ID"""
+    def __init__(self):
+        self.states = {}
+
+    def get(self, channel_id):
+        """
+        获取指定频道的分析状态，不存在时创建。
+
+        Args:
+            channel_id (int): Ticket 频道 ID
+
+        Returns:
+            TicketState: 频道分析状态
+        """
+        state = self.states.get(channel_id)
+        if state is None:
+            state = self.states[channel_id] = TicketState()
+        return state
+
+    def drop(self, channel_id):
+        """
+        移除已关闭频道的分析状态，并取消未完成的后台更新。
+
+        Args:
+            channel_id (int): Ticket 频道 ID
+        """
+        state = self.states.pop(channel_id, None)
+        if state and state.refresh_task and not state.refresh_task.done():
+            state.refresh_task.cancel()
\ No newline at end of file
@@ -0,0 +1,244 @@
+import os
+import re
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 时间序列数据目录常量，每个 (服务器, 频道) 一个追加写入的二进制文件
+TIMESERIES_DIR = 'timeseries'
+
+# 单条记录对应一个监控周期，定长 32 字节，一年 2 小时周期约 140 KB
+RECORD_DTYPE = np.dtype([
+    ('ts', '<i8'),  # 周期结束时间（Unix 时间戳，秒）
+    ('period_s', '<i4'),  # 周期长度（秒）
+    ('volume', '<i4'),  # 周期内消息数
+    ('monitored', '<i4'),  # 实际送入 LLM 分析的消息数
+    ('score', '<f4'),  # 情绪分数，-1（消极）~ 1（积极）
+    ('label', 'i1'),  # 情绪标签，见 SENTIMENT_LABELS
+    ('key_event', '?'),  # 是否有重点关注事件
+    ('_pad', 'V6'),
+])
+
+SENTIMENT_LABELS = {-1: '消极', 0: '中立', 1: '积极'}
+
+# emotion 为 LLM 输出的自由文本，按关键词映射为分数；同时命中正负词时取平均
+POSITIVE_RE = re.compile(r'积极|正面|乐观|兴奋|期待|热情|满意|看涨|positive|optimistic|excited|bullish', re.IGNORECASE)
+NEGATIVE_RE = re.compile(r'消极|负面|悲观|不满|愤怒|焦虑|担忧|恐慌|失望|抱怨|看跌|negative|angry|anxious|fud|bearish', re.IGNORECASE)
+NO_EVENT_RE = re.compile(r'^\s*(无|暂无|没有|none|n/?a|-)?\s*[。.]?\s*$', re.IGNORECASE)
+
+ROLLUP_FREQS = ('day', 'week', 'month')
+
+def sentiment_score(emotion):
+    """
+    将 LLM 输出的情绪描述映射为分数和标签。
+
+    Args:
+        emotion (str): GeneralSummary.emotion
+
+    Returns:
+        tuple: (分数 -1~1, 标签 -1/0/1)
+    """
+    positive = len(POSITIVE_RE.findall(emotion or ''))
+    negative = len(NEGATIVE_RE.findall(emotion or ''))
+    if not positive and not negative:
+        return 0.0, 0
+    score = (positive - negative) / (positive + negative)
+    return score, int(np.sign(score))
+
+def has_key_event(key_events):
+    """判断 key_events 是否包含实际事件（LLM 默认输出“无”）"""
+    return not NO_EVENT_RE.match(key_events or '')
+
+class TimeSeriesStore:
+    """
+    按 (服务器, 频道) 存储 General Chat 监控周期的活动与情绪时间序列。
+    - 记录为 NumPy 结构化数组，追加写入定长二进制文件，读取时 np.fromfile 一次性载入。
+    - 汇总与异常检测全部向量化，一年的数据在毫秒级完成。
+    """
+    def __init__(self, base_dir=TIMESERIES_DIR):
+        self.base_dir = base_dir
+        self.lock = threading.Lock()
+
+    def path(self, guild_id, channel_id):
+        return os.path.join(self.base_dir, str(guild_id), f"{channel_id}.bin")
+
+    def append(self, guild_id, channel_id, ts, period_s, volume, monitored, emotion, key_events):
+        """
+        追加一个监控周期的记录。
+
+        Args:
+            guild_id (str): Discord 服务器 ID
+            channel_id (int): 监控频道 ID
+            ts (float): 周期结束时间（Unix 时间戳）
+            period_s (int): 周期长度（秒）
+            volume (int): 周期内消息数
+            monitored (int): 实际分析的消息数
+            emotion (str): GeneralSummary.emotion
+            key_events (str): GeneralSummary.key_events
+        """
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        score, label = sentiment_score(emotion)
+        record[0]['ts'] = int(ts)
+        record[0]['period_s'] = int(period_s)
+        record[0]['volume'] = volume
+        record[0]['monitored'] = monitored
+        record[0]['score'] = score
+        record[0]['label'] = label
+        record[0]['key_event'] = has_key_event(key_events)
+        path = self.path(guild_id, channel_id)
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(record.tobytes())
+
+    def load(self, guild_id, channel_id, since=None):
+        """
+        载入频道的全部记录（按时间升序）。
+
+        Args:
+            guild_id (str): Discord 服务器 ID
+            channel_id (int): 监控频道 ID
+            since (float): 可选，只返回该时间之后的记录
+
+        Returns:
+            np.ndarray: RECORD_DTYPE 结构化数组
+        """
+        path = self.path(guild_id, channel_id)
+        if not os.path.exists(path):
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        with self.lock:
+            size = os.path.getsize(path) // RECORD_DTYPE.itemsize  # 忽略写入中断留下的不完整尾部
+            records = np.fromfile(path, dtype=RECORD_DTYPE, count=size)
+        if len(records) > 1 and (np.diff(records['ts']) < 0).any():
+            records = np.sort(records, order='ts', kind='stable')  # 历史回填会追加较早的记录
+        if since is not None:
+            records = records[records['ts'] >= since]
+        return records
+
+def bucket_keys(ts, freq, timezone_offset=0):
+    """
+    计算每条记录所属的汇总区间起点（本地时间的 datetime64[D]）。
+
+    Args:
+        ts (np.ndarray): Unix 时间戳数组
+        freq (str): day / week（周一开始）/ month
+        timezone_offset (int): 服务器时区偏移（小时）
+
+    Returns:
+        np.ndarray: datetime64[D] 数组
+    """
+    local = (ts + timezone_offset * 3600).astype('datetime64[s]')
+    days = local.astype('datetime64[D]')
+    if freq == 'day':
+        return days
+    if freq == 'week':
+        # 1970-01-01 为周四，偏移 3 天后整除 7 得到以周一为起点的周序号
+        return ((days.astype(np.int64) + 3) // 7 * 7 - 3).astype('datetime64[D]')
+    if freq == 'month':
+        return local.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"不支持的汇总粒度: {freq}")
+
+def volume_anomalies(records, window=24, threshold=3.5, min_ratio=2.0, min_mad=1.0):
+    """
+    基于滚动中位数与 MAD（中位数绝对偏差）的消息量突增检测。
+    消息量先按周期长度归一化为每小时消息数，避免监控周期调整造成误报。
+
+    Args:
+        records (np.ndarray): RECORD_DTYPE 结构化数组（按时间升序）
+        window (int): 参考窗口（之前的周期数）
+        threshold (float): 稳健 z 分数阈值
+        min_ratio (float): 同时要求消息量达到窗口中位数的倍数，过滤小窗口 MAD 偏小造成的误报
+        min_mad (float): MAD 下限，防止长期平稳时极小波动被判为突增
+
+    Returns:
+        tuple: (是否突增的布尔数组, 稳健 z 分数数组)，前 window 个周期不做判断
+    """
+    rate = records['volume'] / np.maximum(records['period_s'], 1) * 3600
+    flags = np.zeros(len(rate), dtype=bool)
+    z = np.zeros(len(rate))
+    if len(rate) <= window:
+        return flags, z
+    history = np.lib.stride_tricks.sliding_window_view(rate[:-1], window)  # 第 i 行为第 i+window 个周期之前的窗口
+    median = np.median(history, axis=1)
+    mad = np.maximum(np.median(np.abs(history - median[:, None]), axis=1), min_mad)
+    z[window:] = 0.6745 * (rate[window:] - median) / mad
+    flags[window:] = (z[window:] > threshold) & (rate[window:] >= median * min_ratio)
+    return flags, z
+
+def rollup(records, freq='day', timezone_offset=0, anomalies=None):
+    """
+    按日/周/月汇总消息量、情绪和重点事件。
+
+    Args:
+        records (np.ndarray): RECORD_DTYPE 结构化数组
+        freq (str): day / week / month
+        timezone_offset (int): 服务器时区偏移（小时）
+        anomalies (np.ndarray): 可选，volume_anomalies 返回的突增标记
+
+    Returns:
+        dict: 各列为等长数组，bucket（区间起点）、periods（周期数）、volume（消息总数）、
+              sentiment（按分析消息数加权的平均情绪分数）、negative（消极周期数）、
+              key_events（有重点事件的周期数）、spikes（突增周期数）
+    """
+    keys = bucket_keys(records['ts'], freq, timezone_offset)
+    buckets, inverse = np.unique(keys, return_inverse=True)
+    n = len(buckets)
+    weights = np.maximum(records['monitored'], 1).astype(np.float64)
+    weight_sum = np.bincount(inverse, weights=weights, minlength=n)
+    return {
+        'bucket': buckets,
+        'periods': np.bincount(inverse, minlength=n),
+        'volume': np.bincount(inverse, weights=records['volume'], minlength=n).astype(np.int64),
+        'sentiment': np.bincount(inverse, weights=records['score'] * weights, minlength=n) / np.maximum(weight_sum, 1),
+        'negative': np.bincount(inverse, weights=records['label'] < 0, minlength=n).astype(np.int64),
+        'key_events': np.bincount(inverse, weights=records['key_event'], minlength=n).astype(np.int64),
+        'spikes': (np.bincount(inverse, weights=anomalies, minlength=n).astype(np.int64)
+                   if anomalies is not None else np.zeros(n, dtype=np.int64)),
+    }
+
+def bench(periods_per_day=12, days=365):
+    """生成一年的模拟监控记录，测量载入、突增检测与日/周/月汇总耗时"""
+    import tempfile
+    import time
+
+    rng = np.random.default_rng(0)
+    store = TimeSeriesStore(tempfile.mkdtemp())
+    count = periods_per_day * days
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+    records['ts'] = 1700000000 + np.arange(count) * (86400 // periods_per_day)
+    records['period_s'] = 86400 // periods_per_day
+    records['volume'] = rng.poisson(80, count)
+    records['volume'][rng.choice(count, 20, replace=False)] *= 6  # 注入 20 个突增
+    records['monitored'] = np.minimum(records['volume'], 100)
+    records['score'] = rng.uniform(-1, 1, count)
+    records['label'] = np.sign(records['score'])
+    records['key_event'] = rng.random(count) < 0.1
+    os.makedirs(os.path.dirname(store.path('1', '1')), exist_ok=True)
+    records.tofile(store.path('1', '1'))
+
+    start = time.perf_counter()
+    store.append('1', '1', records['ts'][-1] + 7200, 7200, 90, 90, '积极', '无')
+    append_ms = (time.perf_counter() - start) * 1000
+    timings = {}
+    for name, fn in (
+        ('载入', lambda: store.load('1', '1')),
+        ('突增检测', lambda: volume_anomalies(records)),
+        ('日汇总', lambda: rollup(records, 'day', 8)),
+        ('周汇总', lambda: rollup(records, 'week', 8)),
+        ('月汇总', lambda: rollup(records, 'month', 8)),
+    ):
+        start = time.perf_counter()
+        for _ in range(20):
+            result = fn()
+        timings[name] = (time.perf_counter() - start) / 20 * 1000
+    flags, _ = volume_anomalies(records)
+    print(f"{count} 条记录（{days} 天 × 每天 {periods_per_day} 个周期），文件 {records.nbytes / 1024:.0f} KB")
+    print(f"追加 1 条: {append_ms:.3f} ms")
+    for name, ms in timings.items():
+        print(f"{name}: {ms:.2f} ms")
+    print(f"检测到突增 {flags.sum()} 个，月汇总 {len(result['bucket'])} 个区间")
+
+if __name__ == "__main__":
+    bench()
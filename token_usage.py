@@ -0,0 +1,224 @@
+import threading
+import logging
+import contextvars
+import datetime
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+# 当前 LLM 调用所属的服务器 ID；asyncio.to_thread 会复制上下文，线程中的回调可以读取到
+usage_scope = contextvars.ContextVar('usage_scope', default=None)
+# 当前 LLM 调用是否为备用模型调用（使用运营方密钥），用量另计入 fallback，受默认密钥的每日预算约束
+usage_fallback = contextvars.ContextVar('usage_fallback', default=False)
+
+# 预算等级：normal 正常；degraded 接近预算，缩小监控样本并改用廉价模型；exhausted 预算用尽，跳过自动分析
+BUDGET_NORMAL = 'normal'
+BUDGET_DEGRADED = 'degraded'
+BUDGET_EXHAUSTED = 'exhausted'
+
+# 默认预算参数，可通过服务器配置 token_budget 覆盖
+DEFAULT_BUDGET_CONFIG = {
+    'daily_tokens': 0,  # 每日 token 预算（UTC 自然日），0 表示不限
+    'degrade_at': 0.8,  # 用量达到预算的该比例时开始降级
+}
+
+DEGRADED_SAMPLE_RATIO = 0.5  # 降级时监控频道的分析样本缩小到该比例
+
+# 接口未返回用量时按字符数估算（中英文混合约 2 个字符 1 个 token）
+CHARS_PER_TOKEN = 2
+
+def set_usage_scope(guild_id):
+    """将之后的 LLM 调用用量计入指定服务器（只影响当前任务及其创建的线程）"""
+    usage_scope.set(str(guild_id))
+
+def call_as_fallback(func, *args):
+    """以备用模型调用的身份执行 func，用量同时计入 fallback（在执行调用的线程中设置，只影响本次调用）"""
+    usage_fallback.set(True)
+    return func(*args)
+
+def usage_day(now=None):
+    """用量统计日期（UTC）"""
+    return (now or datetime.datetime.now(datetime.timezone.utc)).strftime('%Y-%m-%d')
+
+def monitor_sample_size(config, level):
+    """按预算等级计算监控频道每次分析的最大消息数"""
+    max_messages = config.get('monitor_max_messages', 100)
+    if level == BUDGET_DEGRADED:
+        return max(int(max_messages * DEGRADED_SAMPLE_RATIO), 1)
+    return max_messages
+
+def get_budget_config(config):
+    """合并服务器配置与默认预算参数
+    参数:
+        config: 服务器配置
+    返回:
+        dict: 完整的预算配置
+    """
+    return {**DEFAULT_BUDGET_CONFIG, **config.get('token_budget', {})}
+
+class TokenMeter:
+    """
+    内存中的 token 用量累加器，LLM 回调（工作线程）写入，定期由事件循环合并到配置文件。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # (服务器 ID, 日期) -> {'prompt', 'completion', 'calls', 'estimated', 'fallback'}
+
+    def record(self, guild_id, prompt_tokens, completion_tokens, estimated=False, fallback=False):
+        """
+        记录一次 LLM 调用的用量。
+
+        Args:
+            guild_id (str): Discord 服务器 ID
+            prompt_tokens (int): 输入 token 数
+            completion_tokens (int): 输出 token 数
+            estimated (bool): 是否为按字符数估算的用量
+            fallback (bool): 是否为备用模型调用，是则另计入 fallback（已包含在 prompt 和 completion 中）
+        """
+        with self.lock:
+            counts = self.pending.setdefault((guild_id, usage_day()), {'prompt': 0, 'completion': 0, 'calls': 0, 'estimated': 0})
+            counts['prompt'] += prompt_tokens
+            counts['completion'] += completion_tokens
+            counts['calls'] += 1
+            counts['estimated'] += int(estimated)
+            if fallback:
+                counts['fallback'] = counts.get('fallback', 0) + prompt_tokens + completion_tokens
+
+    def count(self, guild_id, key, amount=1):
+        """累加一项随用量按日保存的计数（如结构化输出的解析统计）"""
+        with self.lock:
+            counts = self.pending.setdefault((guild_id, usage_day()), {'prompt': 0, 'completion': 0, 'calls': 0, 'estimated': 0})
+            counts[key] = counts.get(key, 0) + amount
+
+    def pending_counts(self, guild_id, day):
+        """尚未合并到配置文件的全部计数"""
+        with self.lock:
+            return dict(self.pending.get((guild_id, day), {}))
+
+    def pending_tokens(self, guild_id, day, fallback=False):
+        """尚未合并到配置文件的用量；fallback 为 True 时只统计备用模型调用"""
+        with self.lock:
+            counts = self.pending.get((guild_id, day))
+            if not counts:
+                return 0
+            return counts.get('fallback', 0) if fallback else counts['prompt'] + counts['completion']
+
+    def merge(self, usage):
+        """
+        合并其他进程（如分析进程）记录的用量。
+
+        Args:
+            usage (list): [服务器 ID, 日期, 用量字典] 列表
+        """
+        with self.lock:
+            for guild_id, day, counts in usage:
+                pending = self.pending.setdefault((guild_id, day), {'prompt': 0, 'completion': 0, 'calls': 0, 'estimated': 0})
+                for name, value in counts.items():
+                    pending[name] = pending.get(name, 0) + value
+
+    def drain(self):
+        """取出全部待合并的用量"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    从 LLM 响应中提取 token 用量并计入 usage_scope 对应的服务器。
+    - 优先使用响应消息的 usage_metadata，其次使用 llm_output.token_usage。
+    - 流式调用等接口未返回用量时，按提示和输出的字符数估算并单独计数。
+    """
+    def __init__(self, meter):
+        super().__init__()
+        self.meter = meter
+        self.prompt_chars = {}  # run_id -> 提示字符数，用于估算
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.prompt_chars[run_id] = sum(len(str(message.content)) for batch in messages for message in batch)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_chars = self.prompt_chars.pop(run_id, 0)
+        guild_id = usage_scope.get()
+        if guild_id is None:
+            return
+        prompt_tokens = completion_tokens = 0
+        output_chars = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if usage:
+                    prompt_tokens += usage.get('input_tokens', 0)
+                    completion_tokens += usage.get('output_tokens', 0)
+                output_chars += len(generation.text or '')
+        if not prompt_tokens and not completion_tokens:
+            token_usage = (response.llm_output or {}).get('token_usage') or {}
+            prompt_tokens = token_usage.get('prompt_tokens', 0)
+            completion_tokens = token_usage.get('completion_tokens', 0)
+        if prompt_tokens or completion_tokens:
+            self.meter.record(guild_id, prompt_tokens, completion_tokens, fallback=usage_fallback.get())
+        else:
+            self.meter.record(guild_id, prompt_chars // CHARS_PER_TOKEN, output_chars // CHARS_PER_TOKEN, estimated=True,
+                              fallback=usage_fallback.get())
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.prompt_chars.pop(run_id, None)
+
+TOKEN_METER = TokenMeter()
+USAGE_CALLBACKS = [UsageCallbackHandler(TOKEN_METER)]
+
+def record_parse_stat(key, amount=1):
+    """
+    记录结构化输出的解析统计（键名加 parse_ 前缀），与 token 用量一起按日计入 usage_scope 对应的服务器，
+    分析进程中的计数随任务结果交回 Bot 进程。
+    """
+    guild_id = usage_scope.get()
+    if guild_id is not None:
+        TOKEN_METER.count(guild_id, f'parse_{key}', amount)
+
+def budget_status(config_manager, guild_id, default_budget=0):
+    """
+    计算服务器今日的预算等级。
+
+    Args:
+        config_manager (ConfigManager): 配置管理器
+        guild_id (str): Discord 服务器 ID
+        default_budget (int): 使用默认 LLM 密钥时的每日预算上限，0 表示不限；服务器自带密钥时不适用
+
+    Returns:
+        tuple: (预算等级, 今日已用 token 数, 生效的每日预算（0 表示不限）)
+    """
+    budget_config = get_budget_config(config_manager.get_guild_config(guild_id))
+    budgets = [budget_config['daily_tokens']]
+    if config_manager.get_llm_config(guild_id) is None:
+        budgets.append(default_budget)  # 默认密钥由我们付费，服务器自设预算不能超过该上限
+    budgets = [budget for budget in budgets if budget and budget > 0]
+    day = usage_day()
+    usage = config_manager.get_token_usage(guild_id, day)
+    used = usage.get('prompt', 0) + usage.get('completion', 0) + TOKEN_METER.pending_tokens(guild_id, day)
+    if not budgets:
+        return BUDGET_NORMAL, used, 0
+    budget = min(budgets)
+    if used >= budget:
+        return BUDGET_EXHAUSTED, used, budget
+    if used >= budget * budget_config['degrade_at']:
+        return BUDGET_DEGRADED, used, budget
+    return BUDGET_NORMAL, used, budget
+
+def fallback_budget_left(config_manager, guild_id, default_budget=0):
+    """
+    服务器今日的备用模型用量是否仍在默认密钥的每日预算内。
+    备用模型使用运营方密钥，自带密钥的服务器调用备用模型同样受 default_budget 约束（budget_status 对其不适用）。
+
+    Args:
+        config_manager (ConfigManager): 配置管理器
+        guild_id (str): Discord 服务器 ID
+        default_budget (int): 默认 LLM 密钥的每日预算上限，0 表示不限
+
+    Returns:
+        bool: 是否还可以调用备用模型
+    """
+    if not default_budget or default_budget <= 0:
+        return True
+    day = usage_day()
+    used = config_manager.get_token_usage(guild_id, day).get('fallback', 0) + TOKEN_METER.pending_tokens(guild_id, day, fallback=True)
+    return used < default_budget
@@ -1,22 +1,33 @@
 import discord
 
+# 将 Discord 消息转换为对话字典
+def message_to_dict(msg):
+    """将 Discord 消息转换为分析使用的对话字典
+    参数:
+        msg: Discord 消息对象
+    返回:
+        dict: 包含 id, user, content, timestamp, is_bot
+    """
+    return {
+        'id': msg.id,  # 消息 ID，用于增量分析
+        'user': msg.author.name,  # 用户名
+        'content': msg.content,  # 消息内容
+        'timestamp': msg.created_at.isoformat(),  # 时间戳
+        'is_bot': msg.author.bot  # 是否为 Bot 发送（如 Ticket Bot 的开单模板）
+    }
+
 # 获取频道对话
-async def get_conversation(channel, limit=100):
+async def get_conversation(channel, limit=100, after=None):
     """获取指定频道的最近对话
     参数:
         channel: Discord 频道对象
         limit: 获取的消息数量上限，默认 100
+        after: 可选的消息 ID，只获取该消息之后的对话（此时按时间正序返回）
     返回:
-        list: 对话列表，每个元素包含 user, content, timestamp
+        list: 对话列表，每个元素包含 id, user, content, timestamp, is_bot
     """
-    messages = []
-    async for msg in channel.history(limit=limit):  # 异步遍历消息历史
-        messages.append({
-            'user': msg.author.name,  # 用户名
-            'content': msg.content,  # 消息内容
-            'timestamp': msg.created_at.isoformat()  # 时间戳
-        })
-    return messages
+    after = discord.Object(id=after) if after else None
+    return [message_to_dict(msg) async for msg in channel.history(limit=limit, after=after)]  # 异步遍历消息历史
 
 # 判断是否为 Ticket 频道
 def is_ticket_channel(channel, config):